@@ -0,0 +1,216 @@
+"""This module provides asyncio counterparts of the calcloud.io branches so that
+handlers can issue independent S3 operations concurrently using asyncio.gather()
+rather than paying one synchronous round trip after another.
+
+Each async method runs the corresponding calcloud.io method on a thread pool owned
+by the AsyncIoBundle,  sharing the bundle's thread-safe boto3 S3 client.   This keeps
+message naming,  payload serialization,  and "all" expansion identical to the sync
+bundle and needs no additional async S3 package in the lambda images.
+
+>>> import asyncio
+>>> async def demo(dataset):
+...     async with get_async_io_bundle() as acomm:
+...         await asyncio.gather(
+...             acomm.messages.put(f"placed-{dataset}"),
+...             acomm.outputs.put(f"{dataset}/preview.txt"),
+...             acomm.xdata.put(dataset, {"retries": 0}),
+...         )
+...         msgs, outputs, metadata = await asyncio.gather(
+...             acomm.messages.listl(), acomm.outputs.listl(), acomm.xdata.get(dataset)
+...         )
+...         await acomm.clean(dataset)
+...         return msgs, outputs, metadata, await acomm.ids()
+>>> asyncio.run(demo("lcw303cjq"))
+(['placed-lcw303cjq'], ['lcw303cjq/preview.txt'], {'retries': 0}, [])
+"""
+
+import asyncio
+import doctest
+import functools
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from calcloud import io
+from calcloud import s3
+
+# -------------------------------------------------------------
+
+__all__ = [
+    "get_async_io_bundle",
+    "AsyncIoBundle",
+    "AsyncS3Io",
+    "AsyncMessageIo",
+    "AsyncMetadataIo",
+]
+
+# -------------------------------------------------------------
+
+
+class AsyncS3Io:
+    """Async wrapper of an io.S3Io branch.   Awaiting any method runs the sync
+    method of the same name on `executor`.
+    """
+
+    def __init__(self, sync_io, executor):
+        self.sync_io = sync_io
+        self.executor = executor
+
+    @property
+    def client(self):
+        return self.sync_io.client
+
+    @property
+    def s3_path(self):
+        return self.sync_io.s3_path
+
+    def path(self, prefix):
+        """Return the full S3 path of `prefix`,  no I/O is performed."""
+        return self.sync_io.path(prefix)
+
+    async def _run(self, method, *args, **keys):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(method, *args, **keys))
+
+    async def list(self, prefixes="all", max_objects=s3.MAX_LIST_OBJECTS):
+        """Return the list of io.S3Io.list() results for `prefixes`."""
+        return await self._run(lambda: list(self.sync_io.list(prefixes, max_objects=max_objects)))
+
+    async def listl(self, prefixes="all", max_objects=s3.MAX_LIST_OBJECTS):
+        """Return the sorted list of io.S3Io.list() results for `prefixes`."""
+        return await self._run(self.sync_io.listl, prefixes, max_objects=max_objects)
+
+    async def list_s3(self, prefixes="all", max_objects=s3.MAX_LIST_OBJECTS):
+        """Return the list of full S3 paths matching `prefixes`."""
+        return await self._run(lambda: list(self.sync_io.list_s3(prefixes, max_objects=max_objects)))
+
+    async def get(self, prefixes, *args, **keys):
+        """See io.S3Io.get(),  or the get() of the wrapped branch."""
+        return await self._run(self.sync_io.get, prefixes, *args, **keys)
+
+    async def put(self, msgs, *args, **keys):
+        """See io.S3Io.put(),  or the put() of the wrapped branch."""
+        return await self._run(self.sync_io.put, msgs, *args, **keys)
+
+    async def delete(self, prefixes, *args, **keys):
+        """See io.S3Io.delete()."""
+        return await self._run(self.sync_io.delete, prefixes, *args, **keys)
+
+    async def delete_literal(self, msg):
+        """See io.S3Io.delete_literal()."""
+        return await self._run(self.sync_io.delete_literal, msg)
+
+    async def move(self, prefix_from, prefix_to):
+        """See io.S3Io.move()."""
+        return await self._run(self.sync_io.move, prefix_from, prefix_to)
+
+    async def pop(self, prefix):
+        """See io.S3Io.pop()."""
+        return await self._run(self.sync_io.pop, prefix)
+
+    async def exists(self, prefixes):
+        """See io.S3Io.exists()."""
+        return await self._run(self.sync_io.exists, prefixes)
+
+    async def ids(self, prefixes="all"):
+        """See io.S3Io.ids(),  or the ids() of the wrapped branch."""
+        return await self._run(self.sync_io.ids, prefixes)
+
+
+class AsyncMessageIo(AsyncS3Io):
+    """Async wrapper of io.MessageIo."""
+
+    async def broadcast(self, type, datasets, payload=None):
+        """See io.MessageIo.broadcast()."""
+        return await self._run(self.sync_io.broadcast, type, datasets, payload)
+
+    async def reset(self, ids):
+        """See io.MessageIo.reset()."""
+        return await self._run(self.sync_io.reset, ids)
+
+
+class AsyncMetadataIo(AsyncS3Io):
+    """Async wrapper of io.MetadataIo,  get() and put() (de)serialize job metadata."""
+
+    async def update(self, dataset, func, default=None, retries=io.METADATA_UPDATE_RETRIES):
+        """See io.MetadataIo.update(),  `func` runs on the executor thread."""
+        return await self._run(self.sync_io.update, dataset, func, default, retries)
+
+
+# -------------------------------------------------------------
+
+
+class AsyncIoBundle:
+    """Bundle async versions of all the I/O branches of io.IoBundle into one package.
+
+    The bundle owns a thread pool of `max_workers` threads used by every branch.
+    Use it as an async context manager or call close() when finished.
+    """
+
+    def __init__(self, bucket=s3.DEFAULT_BUCKET, client=None, max_workers=s3.MAX_TRANSFER_THREADS):
+        self.sync_bundle = io.IoBundle(bucket, client)
+        self.bucket = self.sync_bundle.bucket
+        self.client = self.sync_bundle.client
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.messages = AsyncMessageIo(self.sync_bundle.messages, self.executor)
+        self.inputs = AsyncS3Io(self.sync_bundle.inputs, self.executor)
+        self.outputs = AsyncS3Io(self.sync_bundle.outputs, self.executor)
+        self.control = AsyncS3Io(self.sync_bundle.control, self.executor)
+        self.xdata = AsyncMetadataIo(self.sync_bundle.xdata, self.executor)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Shut down the bundle thread pool."""
+        self.executor.shutdown(wait=True)
+
+    async def _run(self, method, *args, **keys):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(method, *args, **keys))
+
+    async def ids(self, prefixes="all"):
+        """Return the id associated with every object in any branch,  listing branches concurrently."""
+        branch_ids = await asyncio.gather(
+            self.inputs.ids(prefixes),
+            self.outputs.ids(prefixes),
+            self.control.ids(prefixes),
+            self.messages.ids(prefixes),
+        )
+        return list(set().union(*branch_ids))
+
+    async def reset(self, ids="all"):
+        """See io.IoBundle.reset()."""
+        return await self._run(self.sync_bundle.reset, ids)
+
+    async def clean(self, ids="all", max_workers=s3.MAX_TRANSFER_THREADS):
+        """See io.IoBundle.clean()."""
+        return await self._run(self.sync_bundle.clean, ids, max_workers)
+
+    async def send(self, msg_type, datasets="all"):
+        """See io.IoBundle.send()."""
+        return await self._run(self.sync_bundle.send, msg_type, datasets)
+
+
+def get_async_io_bundle(bucket=s3.DEFAULT_BUCKET, client=None, max_workers=s3.MAX_TRANSFER_THREADS):
+    """Return the AsyncIoBundle defined by root S3 `bucket` and accessed using
+    S3 `client` from a pool of `max_workers` threads.
+    """
+    io._reject_cross_env_bucket(bucket)
+    return AsyncIoBundle(bucket, client, max_workers)
+
+
+# ------------------------------------------------------------
+
+
+def test():
+    from calcloud import aio
+
+    return doctest.testmod(aio)
+
+
+if __name__ == "__main__":
+    if sys.argv[1] == "test":
+        print(test())
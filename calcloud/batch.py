@@ -8,16 +8,36 @@ import json
 import datetime
 import re
 import os
+import queue as queue_mod
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
+from botocore.config import Config
 
 from . import common
+from . import timing
 
 JOB_STATUSES = tuple("SUBMITTED|PENDING|RUNNABLE|STARTING|RUNNING|SUCCEEDED|FAILED".split("|"))
 
 KILL_STATUSES = tuple("SUBMITTED|PENDING|RUNNABLE|STARTING|RUNNING".split("|"))
 
-JOB_ID_RE = re.compile("[a-f0-9]{8}_[a-f0-9]{4}_[a-f0-9]{4}_[a-f0-9]{4}_[a-f0-9]{12}")  # just uuid with "_" vs "-"
+LIST_THREADS = int(os.environ.get("BATCH_LIST_THREADS", 8))  # concurrent queue/status listings
+
+LIST_RATE = float(os.environ.get("BATCH_LIST_RATE", 10))  # average ListJobs calls per second across threads
+
+LIST_PAGE_SIZE = 100  # maximum jobs per ListJobs call
+
+TERMINATE_THREADS = int(os.environ.get("BATCH_TERMINATE_THREADS", 16))  # concurrent TerminateJob calls
+
+TERMINATE_RATE = float(os.environ.get("BATCH_TERMINATE_RATE", 20))  # average TerminateJob calls per second
+
+# just uuid with "_" vs "-",  array child jobs append ":<index>"
+JOB_ID_RE = re.compile("[a-f0-9]{8}_[a-f0-9]{4}_[a-f0-9]{4}_[a-f0-9]{4}_[a-f0-9]{12}(:[0-9]+)?")
+
+ARRAY_NAME_PREFIX = "calcloud-array-"  # job name prefix of array jobs submitted by calcloud.submit
+
+PACK_NAME_PREFIX = "calcloud-pack-"  # job name prefix of jobs processing several packed datasets in turn
 
 
 def get_queues():
@@ -53,8 +73,15 @@ def get_job_ids(queues=None, collect_statuses=KILL_STATUSES, client=None):
 
 
 def list_jobs(queue, collect_statuses=JOB_STATUSES, client=None):
-    client = client or get_default_client()
+    """Return the formatted job listings for `queue` (or list of queues) having any
+    of `collect_statuses`.
+
+    If `client` is specified the queue/status pairs are listed serially with it,
+    otherwise they are listed concurrently by iter_jobs().
+    """
     queues = [queue] if isinstance(queue, str) else queue
+    if client is None:
+        return list(iter_jobs(queues, collect_statuses))
     jobs = []
     for queue in queues:
         for status in collect_statuses:
@@ -62,6 +89,124 @@ def list_jobs(queue, collect_statuses=JOB_STATUSES, client=None):
     return jobs
 
 
+_DONE = object()
+
+
+def iter_jobs(
+    queues,
+    collect_statuses=JOB_STATUSES,
+    max_workers=LIST_THREADS,
+    rate_limiter=None,
+    histogram=None,
+    formatted=True,
+    page_size=LIST_PAGE_SIZE,
+):
+    """Generate the job listings for every (queue, status) pair of `queues` and
+    `collect_statuses`,  listing up to `max_workers` pairs concurrently.
+
+    Each worker thread uses its own Batch client.   Jobs are yielded page by page
+    as they arrive so listings from different pairs may interleave.   Listings are
+    passed through _format_job_listing() unless `formatted` is False,  in which case
+    the raw jobSummaryList entries are yielded.
+
+    Every ListJobs call first acquires a token from `rate_limiter`,  by default a
+    timing.TokenBucket shared by all workers allowing LIST_RATE calls per second.
+
+    If `histogram` is specified,  e.g. a timing.LatencyHistogram,  the latency of
+    every ListJobs call is recorded in it.
+    """
+    queues = [queues] if isinstance(queues, str) else queues
+    pairs = [(queue, status) for queue in queues for status in collect_statuses]
+    rate_limiter = rate_limiter or timing.TokenBucket(LIST_RATE)
+    results = queue_mod.Queue()
+    local = threading.local()
+
+    def worker(queue, status):
+        try:
+            if not hasattr(local, "client"):
+                local.client = boto3.session.Session().client("batch", config=common.retry_config)
+            for jobs in _iter_job_pages(queue, status, local.client, rate_limiter, histogram, page_size):
+                results.put(jobs)
+        finally:
+            results.put(_DONE)
+
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as pool:
+        futures = [pool.submit(worker, queue, status) for (queue, status) in pairs]
+        remaining = len(futures)
+        while remaining:
+            jobs = results.get()
+            if jobs is _DONE:
+                remaining -= 1
+                continue
+            for job in jobs:
+                yield _format_job_listing(job) if formatted else job
+        for future in futures:
+            future.result()  # re-raise any listing errors
+
+
+def _iter_job_pages(queue, status, client, rate_limiter=None, histogram=None, page_size=LIST_PAGE_SIZE):
+    """Generate each page of the jobSummaryList for `queue` and `status` calling
+    ListJobs directly so that every call can be rate limited and timed.
+    """
+    params = dict(jobQueue=queue, jobStatus=status, maxResults=page_size)
+    while True:
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        if histogram is not None:
+            response = histogram.timed(client.list_jobs, **params)
+        else:
+            response = client.list_jobs(**params)
+        yield response["jobSummaryList"]
+        next_token = response.get("nextToken")
+        if not next_token:
+            break
+        params["nextToken"] = next_token
+
+
+def split_job_id(job_id):
+    """Return (parent_job_id, child_index) for an array child `job_id` of the form
+    <uuid>:<index>,  or (job_id, None) for any other job.
+    """
+    parent, sep, index = job_id.partition(":")
+    return (parent, int(index)) if sep else (job_id, None)
+
+
+def is_array_name(job_name):
+    """Return True IFF `job_name` names an array job submitted by calcloud.submit
+    rather than a job for a single dataset.
+    """
+    return job_name.startswith(ARRAY_NAME_PREFIX)
+
+
+def is_pack_name(job_name):
+    """Return True IFF `job_name` names a job processing several packed datasets."""
+    return job_name.startswith(PACK_NAME_PREFIX)
+
+
+def is_manifest_name(job_name):
+    """Return True IFF `job_name` names an array or packed job whose datasets are
+    listed in a manifest rather than defined by the job name.
+    """
+    return is_array_name(job_name) or is_pack_name(job_name)
+
+
+def iter_array_children(array_job_id, collect_statuses=JOB_STATUSES, client=None, page_size=LIST_PAGE_SIZE):
+    """Generate the raw job summaries of the child jobs of array job `array_job_id`
+    having any of `collect_statuses`.   Summaries include the child's arrayProperties index.
+    """
+    client = client or get_default_client()
+    array_job_id = array_job_id.replace("_", "-")
+    for status in collect_statuses:
+        params = dict(arrayJobId=array_job_id, jobStatus=status, maxResults=page_size)
+        while True:
+            response = client.list_jobs(**params)
+            yield from response["jobSummaryList"]
+            next_token = response.get("nextToken")
+            if not next_token:
+                break
+            params["nextToken"] = next_token
+
+
 def _list_jobs(queue, status, client=None):
     client = client or get_default_client()
     paginator = client.get_paginator("list_jobs")
@@ -150,6 +295,37 @@ def terminate_job(job_id, reason=None, client=None):
     return response["ResponseMetadata"]["HTTPStatusCode"] == 200
 
 
+def get_terminate_client(max_workers=TERMINATE_THREADS):
+    """Return a Batch client whose connection pool is sized for `max_workers` threads."""
+    config = common.retry_config.merge(Config(max_pool_connections=max(max_workers, 10)))
+    return boto3.client("batch", config=config)
+
+
+def terminate_jobs(job_ids, reason=None, max_workers=TERMINATE_THREADS, rate_limiter=None, client=None):
+    """Terminate every job of `job_ids` using up to `max_workers` concurrent TerminateJob
+    calls sharing one Batch `client`.   Every call first acquires a token from
+    `rate_limiter`,  by default a timing.TokenBucket allowing TERMINATE_RATE calls per second.
+
+    Returns {job_id: error}  for the jobs which could not be terminated.
+    """
+    client = client or get_terminate_client(max_workers)
+    rate_limiter = rate_limiter or timing.TokenBucket(TERMINATE_RATE)
+
+    def terminate(job_id):
+        rate_limiter.acquire()
+        client.terminate_job(jobId=job_id.replace("_", "-"), reason=reason)
+
+    failures = {}
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as pool:
+        futures = {job_id: pool.submit(terminate, job_id) for job_id in job_ids}
+        for job_id, future in futures.items():
+            try:
+                future.result()
+            except Exception as exc:
+                failures[job_id] = repr(exc)
+    return failures
+
+
 def main(args=None):
     parser = argparse.ArgumentParser(description="Perform AWS Batch functions on arbitrary numbers of jobs, etc.")
     parser.add_argument(
@@ -176,7 +352,9 @@ def main(args=None):
     parsed = parser.parse_args(args)
     outputter = _get_outputter(parsed.format)
     if parsed.command == "list-jobs":
-        outputter(list_jobs(parsed.job_queue))
+        histogram = timing.LatencyHistogram("ListJobs")
+        outputter(list(iter_jobs(parsed.job_queue or get_queues(), parsed.job_statuses, histogram=histogram)))
+        histogram.report()
     elif parsed.command == "describe-jobs":
         if parsed.job_names is not None:
             outputter(describe_jobs(parsed.job_names))
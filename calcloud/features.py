@@ -0,0 +1,100 @@
+"""This module encodes the job metadata in <ipppssoot>_MemModelFeatures.txt files
+as the 9 integer features used to train and run the resource prediction models.
+
+It is shared by the JobPredict lambda and calcloud.model_ingest.  It depends only
+on numpy so it can be copied alongside predict_handler.py into the JobPredict image.
+
+>>> body = b"n_files=3\\ntotal_mb=12.6\\nDETECTOR=WFC\\nSUBARRAY=False\\nDRIZCORR=PERFORM\\nPCTECORR=OMIT\\nCRSPLIT=2"
+>>> fields = parse_features(body)
+>>> fields["DETECTOR"], fields["total_mb"]
+('WFC', '12.6')
+
+>>> encode("jpppssoo0", fields)
+[3, 13, 1, 0, 2, 0, 1, 1, 0]
+
+>>> encode_many(["jpppssoo0", "ipppssoo1"], [body, b"n_files=1\\ntotal_mb=0.4"])
+array([[ 3, 13,  1,  0,  2,  0,  1,  1,  0],
+       [ 1,  0,  0,  0,  0,  0,  0,  0,  3]])
+
+>>> as_dict(encode("jpppssoo0", fields))["total_mb"]
+13
+"""
+
+import numpy as np
+
+# -----------------------------------------------------------------------------
+
+FEATURE_NAMES = ["n_files", "total_mb", "drizcorr", "pctecorr", "crsplit", "subarray", "detector", "dtype", "instr"]
+
+# feature file field -> {field value: feature value},  unlisted values encode as the "default"
+FIELD_TABLES = {
+    "DRIZCORR": ("drizcorr", {"PERFORM": 1}, 0),
+    "PCTECORR": ("pctecorr", {"PERFORM": 1}, 0),
+    "CRSPLIT": ("crsplit", {"NaN": 0, "1": 1, "1.0": 1}, 2),
+    "SUBARRAY": ("subarray", {"True": 1}, 0),
+    "DETECTOR": ("detector", {"UVIS": 1, "WFC": 1}, 0),
+}
+
+# first character of ipppssoot -> instr feature
+INSTRUMENT_TABLE = {"j": 0, "l": 1, "o": 2, "i": 3}
+
+_COLUMNS = {name: i for (i, name) in enumerate(FEATURE_NAMES)}
+
+# -----------------------------------------------------------------------------
+
+
+def parse_features(body):
+    """Given the bytes or str `body` of a _MemModelFeatures.txt file,  return the dict
+    of its key=value lines with keys and values as str.
+    """
+    if isinstance(body, bytes):
+        body = body.decode("utf-8")
+    fields = {}
+    for line in body.splitlines():
+        key, sep, value = line.partition("=")
+        if sep:
+            fields[key.strip()] = value.strip()
+    return fields
+
+
+def encode(ipppssoot, fields, row=None):
+    """Given `ipppssoot` and its dict of feature file `fields`,  return its 9 features
+    in FEATURE_NAMES order.   Fields which are not defined encode as 0.
+
+    If numpy `row` is given the features are written into it instead of a new list.
+    """
+    if row is None:
+        row = [0] * len(FEATURE_NAMES)
+    else:
+        row[:] = 0
+    for key, value in fields.items():
+        if key == "n_files":
+            row[0] = int(value)
+        elif key == "total_mb":
+            row[1] = int(round(float(value)))
+        elif key in FIELD_TABLES:
+            name, table, default = FIELD_TABLES[key]
+            row[_COLUMNS[name]] = table.get(value, default)
+    row[7] = 1 if ipppssoot[-1] == "0" else 0  # dtype (asn or singleton)
+    try:
+        row[8] = INSTRUMENT_TABLE[ipppssoot[0].lower()]
+    except KeyError:
+        raise ValueError(f"No instrument encoding for {ipppssoot}") from None
+    return row
+
+
+def encode_many(ipppssoots, bodies):
+    """Given parallel sequences `ipppssoots` and raw feature file `bodies` (bytes,  str,
+    or already parsed dicts),  return the N x 9 integer array of their features in one pass.
+    """
+    ipppssoots = list(ipppssoots)
+    X = np.zeros((len(ipppssoots), len(FEATURE_NAMES)), dtype=np.int64)
+    for i, (ipppssoot, body) in enumerate(zip(ipppssoots, bodies)):
+        fields = body if isinstance(body, dict) else parse_features(body)
+        encode(ipppssoot, fields, X[i])
+    return X
+
+
+def as_dict(row):
+    """Return the dict {feature_name: int, ...} for one encoded `row`."""
+    return {name: int(value) for (name, value) in zip(FEATURE_NAMES, row)}
@@ -7,7 +7,12 @@ import sys
 import os
 import doctest
 import json
+import threading
+import time
 import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 import yaml
 
 from calcloud import s3
@@ -22,11 +27,15 @@ __all__ = [
     "MESSAGE_TYPES",
     "S3Io",
     "MessageIo",
+    "MessageIndex",
+    "DirectoryIo",
     "ControlIo",
     "InputsIo",
     "OutputsIo",
     "JsonIo",
     "MetadataIo",
+    "MetadataCache",
+    "MetadataConflict",
 ]
 
 MESSAGE_TYPES = [
@@ -46,6 +55,20 @@ MESSAGE_TYPES = [
 
 MAX_BROADCAST_MSGS = 10**6  # safety
 
+DEFAULT_INDEX_TTL = 60  # seconds a MessageIndex listing is trusted before automatic refresh
+
+# libyaml based C loader/dumper are ~10x faster than pure Python when PyYAML was built with them
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+YAML_DUMPER = getattr(yaml, "CDumper", yaml.Dumper)
+
+METADATA_CACHE_SIZE = int(os.environ.get("CALCLOUD_METADATA_CACHE_SIZE", 1024))  # job.json records per process
+
+METADATA_UPDATE_RETRIES = 5  # optimistic concurrency attempts before MetadataConflict
+
+ARRAY_MANIFEST = "manifest.json"  # control/<array or packed job name>/manifest.json lists job datasets
+
+_ARRAY_MANIFESTS = {}  # {manifest s3 path: manifest dict},  immutable once written
+
 # -------------------------------------------------------------
 
 
@@ -138,16 +161,24 @@ class S3Io:
         else:
             return {prefix: self.get(prefix, encoding) for prefix in prefixes}
 
-    def put(self, msgs, payload="", encoding="utf-8"):
+    def put(self, msgs, payload="", encoding="utf-8", max_workers=1, stop=None):
         """Put messages `msgs` into S3,  accepting several forms.
 
         See normalize_put_parameters() for permissible values and handling of
         `msgs` and `payload`.
 
+        Messages are written by s3.put_objects() using `max_workers` concurrent
+        requests on self.client.   If threading.Event `stop` is set,  any messages
+        not yet written are skipped.
         """
         msgs = self.normalize_put_parameters(msgs, payload)
-        for msg, value in msgs.items():
-            s3.put_object(value, self.path(msg), encoding=encoding, client=self.client)
+        s3.put_objects(
+            {self.path(msg): value for (msg, value) in msgs.items()},
+            encoding=encoding,
+            client=self.client,
+            max_workers=max_workers,
+            stop=stop,
+        )
 
     def normalize_put_parameters(self, msgs, payload):
         """Consolidate put() parameters into normalized dictionary form where each item
@@ -188,34 +219,67 @@ class S3Io:
             raise ValueError("msgs parameter to put() must be str, list, tuple, set, or dict.")
         return msgs
 
-    def delete(self, prefixes, check_exists=True):  # dangerous to support 'all' as default
+    def delete(self, prefixes, check_exists=True, max_workers=1):  # dangerous to support 'all' as default
         """Given typical *message* prefixes, locate and delete the corresponding objects,
         which are nominally S3 files of some kind.
 
         If check_exists is True and an expanded prefix looks like type-dataset, then
-        check to see if that message exists with s3.get() before trying
-        s3.delete().  When most expansions of all-dataset don't exist,  they only pay
-        1/12 the cost of an unneeded delete making it reasonably cheap to use all-dataset
-        even when most types don't exist.
+        check to see if that message exists with a HeadObject request before trying
+        to delete it.   The checks for every such expansion,  e.g. the 12 message types
+        of all-dataset,  are issued concurrently by s3.exists_many() so probing
+        all-dataset costs roughly one request latency rather than 12.
 
         If it's expected that most expansions do exist,  then set check_exists=False to avoid
         unnecessary tests for messges known to exist,  just delete them.
+
+        Located objects are accumulated and removed by s3.delete_objects() using one
+        DeleteObjects request per 1000 keys,  spread over `max_workers` threads.
+
+        Raises DeleteFailed if any object could not be deleted.
+        """
+        delete_objects(self.delete_paths(prefixes, check_exists), client=self.client, max_workers=max_workers)
+
+    def delete_paths(self, prefixes, check_exists=True):
+        """Generate the full S3 paths of the objects which delete() would remove
+        for `prefixes`.  See delete() for the handling of `check_exists`.
         """
+        probes = []
         for prefix in self.expand_all(prefixes):
             parts = [prefix.split("-")[0], "-".join(prefix.split("-")[1:])]
 
             if hst.is_dataset_name(parts[1]) and parts[0] in MESSAGE_TYPES:
-                try:
-                    # these don't have self.s3_path added yet
-                    s3_path = self.path(prefix)
-                    if check_exists:  # don't try to delete
-                        s3.get_object(s3_path, client=self.client)
-                    s3.delete_object(s3_path, client=self.client)
-                except self.client.exceptions.NoSuchKey:
-                    pass  # Catch any failed gets
+                # these don't have self.s3_path added yet
+                s3_path = self.path(prefix)
+                if check_exists:  # don't try to delete
+                    probes.append(s3_path)
+                    if len(probes) >= s3.MAX_DELETE_KEYS:
+                        yield from self._existing(probes)
+                        probes = []
+                else:
+                    yield s3_path
             else:
-                for path in self.list_s3(prefix):
-                    s3.delete_object(path, client=self.client)
+                yield from self.list_s3(prefix)
+        yield from self._existing(probes)
+
+    def _existing(self, s3_paths):
+        """Generate the subset of `s3_paths` which exist,  checked concurrently."""
+        if not s3_paths:
+            return
+        found = s3.exists_many(s3_paths, client=self.client, max_workers=min(len(s3_paths), s3.MAX_PROBE_THREADS))
+        yield from (s3_path for s3_path in s3_paths if found[s3_path])
+
+    def exists(self, prefixes):
+        """Return True IFF the S3 object associated with `prefixes` exists if prefixes is a string.
+
+        Otherwise return the dictionary mapping each element of `prefixes` to True or False,
+        checking every prefix concurrently.   Only HeadObject requests are made so no
+        object contents are transferred.
+        """
+        if isinstance(prefixes, str):
+            return s3.exists(self.path(prefixes), client=self.client)
+        paths = {self.path(prefix): prefix for prefix in prefixes}
+        found = s3.exists_many(paths, client=self.client, max_workers=min(len(paths), s3.MAX_PROBE_THREADS) or 1)
+        return {prefix: found[path] for (path, prefix) in paths.items()}
 
     def delete_literal(self, msg):
         """Given the name of a message `msg`,  delete it,  and in the case of "all-xxxx" or "xxxx-all"
@@ -258,7 +322,7 @@ class PayloadIo(S3Io):
         else:
             return {prefix: self.get(prefix) for prefix in prefixes}
 
-    def put(self, msgs, payload="", encoding="utf-8"):
+    def put(self, msgs, payload="", encoding="utf-8", max_workers=1, stop=None):
         """Put messages defined by message name `msgs` and payload `value`.
 
         See S3IO.normalize_put_parameters() for more information on permissible values
@@ -271,7 +335,16 @@ class PayloadIo(S3Io):
         JsonIo,  including handling of `encoding`.
         """
         msgs = self.normalize_put_parameters(msgs, payload)
-        super().put({msg: self.dumper(value) for (msg, value) in msgs.items()}, encoding=encoding)
+        super().put(
+            {msg: self.dump_message(msg, value) for (msg, value) in msgs.items()},
+            encoding=encoding,
+            max_workers=max_workers,
+            stop=stop,
+        )
+
+    def dump_message(self, msg, value):
+        """Serialize the payload `value` of message `msg`,  by default using dumper()."""
+        return self.dumper(value)
 
     def dumper(self, value):
         """Ensure the empty string is dumped as an empty string,  not serialization of empty string."""
@@ -288,11 +361,47 @@ class JsonIo(PayloadIo):
     _dumper = staticmethod(json.dumps)
 
 
+def yaml_load(text):
+    """Safely load YAML `text` using the fastest available loader."""
+    return yaml.load(text, Loader=YAML_LOADER)
+
+
+def yaml_dump(value):
+    """Dump `value` as YAML using the fastest available dumper."""
+    return yaml.dump(value, Dumper=YAML_DUMPER)
+
+
+def compact_dump(value):
+    """Dump `value` as JSON without whitespace.   JSON is also YAML so messages
+    dumped this way remain readable by yaml.safe_load().
+    """
+    return json.dumps(value, separators=(",", ":"))
+
+
+def message_load(text):
+    """Load a message payload written by either compact_dump() or yaml_dump(),
+    parsing JSON directly since it is ~50x faster than even the C YAML loader.
+
+    >>> message_load(compact_dump({'messages': ['cancel-lcw303cjq'], 'payload': None}))
+    {'messages': ['cancel-lcw303cjq'], 'payload': None}
+    >>> message_load(yaml_dump({'messages': ['cancel-lcw303cjq'], 'payload': None}))
+    {'messages': ['cancel-lcw303cjq'], 'payload': None}
+    >>> message_load("{timeout_scale: 1.3}")
+    {'timeout_scale': 1.3}
+    """
+    if text.startswith("{"):
+        try:
+            return json.loads(text)
+        except ValueError:
+            pass  # YAML flow mapping
+    return yaml_load(text)
+
+
 class YamlIo(PayloadIo):
     """Serialize to/from YAML before storing/loading message payloads."""
 
-    loader = staticmethod(yaml.safe_load)
-    _dumper = staticmethod(yaml.dump)
+    loader = staticmethod(yaml_load)
+    _dumper = staticmethod(yaml_dump)
 
 
 class MessageIo(YamlIo):
@@ -363,6 +472,13 @@ class MessageIo(YamlIo):
     >>> comm.messages.delete('all-lcw303cjq'); comm.messages.listl()
     ['rescue-lcw304cjq']
 
+    exists() checks for messages using HeadObject requests,  concurrently for a list:
+
+    >>> comm.messages.exists('rescue-lcw304cjq'), comm.messages.exists('error-lcw303cjq')
+    (True, False)
+    >>> comm.messages.exists(['processed-lcw304cjq', 'rescue-lcw304cjq'])
+    {'processed-lcw304cjq': False, 'rescue-lcw304cjq': True}
+
     The type-all message is expanded into every type-dataset combination and is really
     equivalent to searching for S3 prefix "type".
 
@@ -454,6 +570,19 @@ class MessageIo(YamlIo):
         else:
             yield prefix
 
+    loader = staticmethod(message_load)
+
+    def dump_message(self, msg, value):
+        """Serialize broadcast message payloads,  which can list up to MAX_BROADCAST_MSGS messages,
+        as compact JSON.   Other messages and payloads JSON can't represent are dumped as YAML.
+        """
+        if msg.startswith("broadcast-") and isinstance(value, dict):
+            try:
+                return compact_dump(value)
+            except (TypeError, ValueError):
+                pass
+        return self.dumper(value)
+
     def get_id(self):
         """Return a unique message ID,  nominally for broadcast messages."""
         return str(uuid.uuid4()).replace("-", "_")
@@ -463,7 +592,8 @@ class MessageIo(YamlIo):
         is nominally done by sending a list of messages to the broadcast lambda
         which then sends them using a divide-and-conquer approach.
 
-        A yaml-serializable `payload` may also be sent for all messages.
+        A yaml-serializable `payload` may also be sent for all messages.   The broadcast
+        message itself is written as compact JSON,  see MessageIo.dump_message().
 
         >>> comm = get_io_bundle()
 
@@ -485,10 +615,11 @@ class MessageIo(YamlIo):
         {'messages': ['cancel-lcw303cjq', 'cancel-lcw304cjq', 'cancel-lcw305cjq'], 'payload': None}
 
         When the messages list a broadcast message contains large numbers of messages,  the message list is
-        partitioned into two half-length lists and re-broadcast.
+        partitioned into several shorter lists and re-broadcast,  see fanout_broadcast().
 
-        When the message list is sufficiently small,  each message is sent serially and
-        requires ~50-200 msec each.   So e.g. 100 serial messages might take 5-20 seconds.
+        When the message list is sufficiently small,  the messages are sent concurrently from a
+        thread pool.   Each put requires ~50-200 msec so e.g. 1000 messages sent by 32 threads
+        might take 2-6 seconds.
 
         A key purpose of message payloads is to pass override parameters into lambda handlers for messages
         such as 'place' or 'rescue':
@@ -537,10 +668,31 @@ class MessageIo(YamlIo):
         >>> comm.messages.pop(msg2)
         {'messages': ['rescue-lcw304cjq', 'rescue-lcw305cjq'], 'payload': {'timeout_scale': 1.3}}
         """
-        msg1, msg2 = f"broadcast-{self.get_id()}", f"broadcast-{self.get_id()}"
-        self.put(msg1, dict(messages=messages[: len(messages) // 2], payload=payload))
-        self.put(msg2, dict(messages=messages[len(messages) // 2 :], payload=payload))
-        return msg1, msg2
+        return tuple(self.fanout_broadcast(messages, payload, fanout=2))
+
+    def fanout_broadcast(self, messages, payload, fanout=2, max_workers=1):
+        """Given the `messages` and object `payload` of a broadcast message,  send `fanout` new
+        broadcast messages,  each with roughly 1/`fanout` of the original messages and the same
+        payload.   The new broadcasts are put using `max_workers` concurrent requests.
+
+        Returns [broadcast_msg_name1, ...] in message order.
+
+        >>> comm = get_io_bundle()
+
+        >>> msgs = comm.messages.fanout_broadcast(
+        ...    ['rescue-lcw303cjq', 'rescue-lcw304cjq', 'rescue-lcw305cjq', 'rescue-lcw306cjq'], None, fanout=3)
+
+        >>> [comm.messages.pop(msg) for msg in msgs]
+        [{'messages': ['rescue-lcw303cjq'], 'payload': None}, {'messages': ['rescue-lcw304cjq'], 'payload': None}, {'messages': ['rescue-lcw305cjq', 'rescue-lcw306cjq'], 'payload': None}]
+        """
+        n = len(messages)
+        fanout = max(1, min(fanout, n))
+        broadcasts = {}
+        for i in range(fanout):
+            msg = f"broadcast-{self.get_id()}"
+            broadcasts[msg] = dict(messages=messages[i * n // fanout : (i + 1) * n // fanout], payload=payload)
+        self.put(broadcasts, max_workers=max_workers)
+        return list(broadcasts)
 
     def ids(self, message_types="all"):
         """Given a list of `message_types`, return the list of unique
@@ -560,11 +712,20 @@ class MessageIo(YamlIo):
         []
 
         >>> comm.messages.delete("all")
+
+        For message_types="all" a single listing of every message is indexed rather than
+        listing each of the message types separately.
         """
+        if message_types == "all":
+            return self.index(ttl=None).ids()
         return list(
             set("-".join(msg.split("-")[1:]) for msg in self.list(message_types))
         )  # need to use "-".join() to ensure that MVM dataset names (e.g. skycell-p0797x14y06) stay intact
 
+    def index(self, ttl=DEFAULT_INDEX_TTL):
+        """Return a MessageIndex built from one listing of all messages,  trusted for `ttl` seconds."""
+        return MessageIndex(self, ttl=ttl)
+
     def list(self, prefix, max_objects=s3.MAX_LIST_OBJECTS):
         """List all objects related to `prefix,  removing any .trigger suffix."""
         for obj in super().list(prefix, max_objects=max_objects):
@@ -581,6 +742,105 @@ class MessageIo(YamlIo):
         self.delete(["all-" + id for id in ids])
 
 
+class MessageIndex:
+    """An in-memory snapshot of every message,  built from a single S3 listing of
+    the messages prefix rather than one listing per message type.
+
+    Queries are answered from a dictionary mapping each dataset (message tail) to the
+    set of message types which exist for it.  The snapshot is re-listed automatically
+    once it is older than `ttl` seconds,  or explicitly by calling refresh().  A `ttl`
+    of None never refreshes automatically.
+
+    >>> comm = get_io_bundle()
+    >>> comm.messages.put(['error-lcw303cjq', 'processed-lcw303cjq', 'placed-lcw304cjq', 'placed-skycell-p0797x14y06'])
+
+    >>> index = comm.messages.index()
+    >>> sorted(index.types('lcw303cjq'))
+    ['error', 'processed']
+
+    >>> index.exists('placed-lcw304cjq'), index.exists('error-lcw304cjq')
+    (True, False)
+
+    >>> sorted(index.ids('placed'))
+    ['lcw304cjq', 'skycell-p0797x14y06']
+
+    >>> sorted(index.ids(['error', 'processed']))
+    ['lcw303cjq']
+
+    >>> sorted(index.listl('all-lcw303cjq'))
+    ['error-lcw303cjq', 'processed-lcw303cjq']
+
+    The snapshot is not updated by later puts until it is refreshed:
+
+    >>> comm.messages.put('rescue-lcw304cjq')
+    >>> index.exists('rescue-lcw304cjq')
+    False
+    >>> index.refresh().exists('rescue-lcw304cjq')
+    True
+
+    >>> comm.messages.delete("all")
+    """
+
+    def __init__(self, messages, ttl=DEFAULT_INDEX_TTL):
+        self.messages = messages
+        self.ttl = ttl
+        self.datasets = {}
+        self.refreshed = None
+
+    def refresh(self):
+        """List every message once and rebuild the dataset -> types index."""
+        datasets = {}
+        prefix_len = len(self.messages.s3_path + "/")
+        for s3_path in s3.list_objects(self.messages.s3_path + "/", client=self.messages.client):
+            msg = s3_path[prefix_len:]
+            if msg.endswith(".trigger"):  # XXXX Undo trigger hack
+                msg = msg[: -len(".trigger")]
+            type, dataset = msg.split("-")[0], "-".join(msg.split("-")[1:])
+            if type in MESSAGE_TYPES:
+                datasets.setdefault(dataset, set()).add(type)
+        self.datasets = datasets
+        self.refreshed = time.monotonic()
+        return self
+
+    def invalidate(self):
+        """Force the next query to re-list messages."""
+        self.refreshed = None
+
+    def _current(self):
+        """Return the dataset index,  refreshing it first if it has never been listed or is stale."""
+        if self.refreshed is None or (self.ttl is not None and time.monotonic() - self.refreshed > self.ttl):
+            self.refresh()
+        return self.datasets
+
+    def types(self, dataset):
+        """Return the set of message types which exist for `dataset`."""
+        return set(self._current().get(dataset, ()))
+
+    def exists(self, msg):
+        """Return True IFF fully specified message `msg`,  e.g. 'error-lcw303cjq',  exists."""
+        type, dataset = msg.split("-")[0], "-".join(msg.split("-")[1:])
+        return type in self._current().get(dataset, ())
+
+    def ids(self, message_types="all"):
+        """Return the list of datasets having at least one message of `message_types`."""
+        if message_types == "all":
+            return list(self._current())
+        if isinstance(message_types, str):
+            message_types = [message_types]
+        wanted = set(message_types)
+        return [dataset for (dataset, types) in self._current().items() if types & wanted]
+
+    def listl(self, prefix="all"):
+        """Return the messages matching "all",  "all-dataset",  "type",  or "type-dataset"."""
+        msgs = []
+        for expanded in self.messages.expand_all(prefix):
+            type, dataset = expanded.split("-")[0], "-".join(expanded.split("-")[1:])
+            for tail, types in self._current().items():
+                if type in types and tail.startswith(dataset):
+                    msgs.append(f"{type}-{tail}")
+        return sorted(msgs)
+
+
 class InputsIo(S3Io):
     """InputsIo provides simple standard operations on the processing
     inputs store.
@@ -605,17 +865,90 @@ class InputsIo(S3Io):
         return [tarball.split(".")[0] for tarball in self.list(prefixes) if tarball]
 
 
-class ControlIo(S3Io):
+class DirectoryIo(S3Io):
+    """DirectoryIo is the base for branches which store files in one directory
+    per dataset,  e.g. s3://.../outputs/<dataset>/...
+
+    >>> comm = get_io_bundle()
+    >>> comm.control.put({"j6d511gvq/env": "", "j6d511gvq/job.json": "{}", "j6m901040/env": ""})
+    >>> comm.control.put("loose-file")
+    >>> sorted(comm.control.list_ids("all"))
+    ['j6d511gvq', 'j6m901040', 'loose-file']
+    >>> sorted(comm.control.list_ids(["j6d5", "j6m901040"]))
+    ['j6d511gvq', 'j6m901040']
+    >>> comm.control.delete("all")
+    """
+
+    def list_ids(self, prefixes="all", max_objects=s3.MAX_LIST_OBJECTS):
+        """Generate the first key component below self.s3_path for each of
+        `prefixes` using a delimited listing,  so that each dataset directory
+        costs one listed entry no matter how many files it contains.
+        """
+        root = self.s3_path + "/"
+        for expanded in self.expand_all(prefixes):
+            for s3_path in s3.list_directory(root + expanded, client=self.client, max_objects=max_objects):
+                yield s3_path[len(root) :].split("/")[0]
+
+    def ids(self, prefixes="all"):
+        """Return the list of unique dataset/id directories associated with `prefixes`."""
+        return list(set(id for id in self.list_ids(prefixes) if id))
+
+
+class ControlIo(DirectoryIo):
     """ControlIo provides simple standard operations on the processing
     control store.
 
     >>> comm = get_io_bundle()
     >>> comm.control.path('lcw303cjq/env') #doctest: +ELLIPSIS
     's3://.../control/lcw303cjq/env'
+
+    Array and packed job manifests list the datasets of one Batch job,  e.g. by
+    array child index,  and are stored in the directory of the job name:
+
+    >>> comm.control.put_array_manifest("calcloud-array-0a1b", dict(datasets=["lcw303cjq", "j6d511gvq"]))
+    >>> comm.control.array_manifest_path("calcloud-array-0a1b") #doctest: +ELLIPSIS
+    's3://.../control/calcloud-array-0a1b/manifest.json'
+    >>> comm.control.get_array_manifest("calcloud-array-0a1b")["datasets"]
+    ['lcw303cjq', 'j6d511gvq']
+    >>> comm.control.get_array_dataset("calcloud-array-0a1b", 1)
+    'j6d511gvq'
+    >>> comm.control.delete("all")
     """
 
+    def array_manifest_path(self, array_name):
+        """Return the S3 path of the manifest of array job `array_name`."""
+        return self.path(f"{array_name}/{ARRAY_MANIFEST}")
+
+    def put_array_manifest(self, array_name, manifest):
+        """Store dict `manifest` for array or packed job `array_name`.  manifest["datasets"][i]
+        is the dataset processed by array child i,  or i-th by a packed job.
+        """
+        self.put(f"{array_name}/{ARRAY_MANIFEST}", compact_dump(manifest))
+        _ARRAY_MANIFESTS[self.array_manifest_path(array_name)] = manifest
+
+    def get_array_manifest(self, array_name):
+        """Return the manifest dict of array job `array_name`.   Manifests never change
+        once submitted so they are fetched once per process.
+        """
+        path = self.array_manifest_path(array_name)
+        if path not in _ARRAY_MANIFESTS:
+            _ARRAY_MANIFESTS[path] = json.loads(self.get(f"{array_name}/{ARRAY_MANIFEST}"))
+        return _ARRAY_MANIFESTS[path]
+
+    def delete_array_manifest(self, array_name):
+        """Remove the manifest of array or packed job `array_name`,  e.g. when the job
+        could not be submitted.
+        """
+        path = self.array_manifest_path(array_name)
+        s3.delete_object(path, client=self.client)
+        _ARRAY_MANIFESTS.pop(path, None)
+
+    def get_array_dataset(self, array_name, index):
+        """Return the dataset processed by child `index` of array job `array_name`."""
+        return self.get_array_manifest(array_name)["datasets"][int(index)]
 
-class OutputsIo(S3Io):
+
+class OutputsIo(DirectoryIo):
     """OutputsIo provides simple standard operations on the processing
     outputs store.
 
@@ -648,12 +981,89 @@ class OutputsIo(S3Io):
     """
 
 
+class MetadataConflict(RuntimeError):
+    """Job metadata kept changing on S3 while trying to update it."""
+
+
+class DeleteFailed(RuntimeError):
+    """DeleteObjects reported per-key errors,  listed by the `errors` attribute."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(f"Failed deleting {len(errors)} objects,  first: {errors[0]}")
+
+
+def delete_objects(s3_paths, client=None, max_workers=1):
+    """Delete `s3_paths` using s3.delete_objects() raising DeleteFailed if any
+    object could not be deleted.
+    """
+    errors = s3.delete_objects(s3_paths, client=client, max_workers=max_workers)
+    if errors:
+        raise DeleteFailed(errors)
+
+
+class MetadataCache:
+    """Thread-safe bounded LRU mapping the S3 path of a job.json to its (ETag, JSON text).
+
+    Entries are only hints used to make revalidating GETs conditional,  so an entry
+    which is stale or whose object was deleted is simply replaced on the next get().
+
+    >>> cache = MetadataCache(maxsize=2)
+    >>> cache.put("a", '"1"', "{}");  cache.put("b", '"2"', "{}");  _ = cache.get("a")
+    >>> cache.put("c", '"3"', "{}");  sorted(cache.entries)
+    ['a', 'c']
+    >>> cache.get("b") is None
+    True
+    """
+
+    def __init__(self, maxsize=METADATA_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, s3_path):
+        """Return (etag, text) for `s3_path` or None,  marking it most recently used."""
+        with self.lock:
+            entry = self.entries.get(s3_path)
+            if entry is not None:
+                self.entries.move_to_end(s3_path)
+            return entry
+
+    def put(self, s3_path, etag, text):
+        """Record `etag` and JSON `text` for `s3_path`,  evicting the least recently used."""
+        if self.maxsize <= 0 or etag is None:
+            return
+        with self.lock:
+            self.entries[s3_path] = (etag, text)
+            self.entries.move_to_end(s3_path)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def discard(self, s3_path):
+        """Forget any entry for `s3_path`."""
+        with self.lock:
+            self.entries.pop(s3_path, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+METADATA_CACHE = MetadataCache()  # shared by every MetadataIo in a warm lambda container
+
+
 class MetadataIo(JsonIo):
     """Provides simple standard operations on the processing job control metadata,
     transparently serializing/de-serializing Python objects as a JSON encoded payload.
 
     Metadata is stored in the dataset control folder as s3://.../control/dataset/job.json
 
+    Each record read or written is kept in a bounded LRU MetadataCache along with its
+    ETag.   Every get() still revalidates with S3 using If-None-Match,  so only changed
+    records transfer their contents and a cached record is never returned stale.
+    put() writes through to the cache and update() uses If-Match to apply optimistic
+    read-modify-write updates which cannot clobber concurrent updates from other lambdas.
+
     >>> comm = get_io_bundle()
 
     >>> obj = {'job_params': {'memory': 1500, 'vcpus': 2}, 'job_id': '1cc5817c-8d93-4119-bbd4-25407ee233b5', 'retry': 0}
@@ -672,9 +1082,108 @@ class MetadataIo(JsonIo):
     >>> comm.xdata.listl()
     ['icw304cjq', 'jcw305cjq', 'lcw303cjq']
 
+    >>> comm.xdata.delete("all")
+
+    update() re-reads and retries when another writer changes the record first:
+
+    >>> comm.xdata.put('lcw303cjq', {'retries': 0, 'terminated': False})
+    >>> def racing_cancel(metadata):
+    ...     if metadata['retries'] == 0:   # first attempt,  simulate a concurrent cancel
+    ...         other = get_io_bundle(); other.xdata.cache = MetadataCache()
+    ...         other.xdata.put('lcw303cjq', {'retries': 0, 'terminated': True})
+    ...     metadata['retries'] += 1
+    ...     return not metadata['terminated']
+    >>> comm.xdata.update('lcw303cjq', racing_cancel)
+    False
+    >>> comm.xdata.get('lcw303cjq')
+    {'retries': 1, 'terminated': True}
+
+    >>> comm.xdata.update('jcw305cjq', lambda metadata: metadata.update(job_id='new'), default={'retries': 0})
+    >>> comm.xdata.get('jcw305cjq')
+    {'retries': 0, 'job_id': 'new'}
+
     >>> comm.xdata.delete("all")
     """
 
+    def __init__(self, s3_path, client=None, cache=None):
+        super().__init__(s3_path, client)
+        self.cache = METADATA_CACHE if cache is None else cache
+
+    def get(self, prefixes):
+        """Return the job metadata for dataset `prefixes` if it is a string,  otherwise
+        return a dictionary {dataset: metadata, ...} for each dataset in `prefixes`.
+
+        Cached records are revalidated with a conditional GET which transfers no
+        contents when the record is unchanged.
+        """
+        if isinstance(prefixes, str):
+            return self.loader(self._get_text(prefixes)[1])
+        else:
+            return {prefix: self.get(prefix) for prefix in prefixes}
+
+    def _get_text(self, dataset):
+        """Return (etag, JSON text) of the current metadata for `dataset`."""
+        s3_path = self.path(dataset)
+        cached = self.cache.get(s3_path)
+        try:
+            text, etag = s3.get_object_if_changed(s3_path, cached[0] if cached else None, client=self.client)
+        except self.client.exceptions.NoSuchKey:
+            self.cache.discard(s3_path)
+            raise
+        if text is None:
+            return cached
+        self.cache.put(s3_path, etag, text)
+        return etag, text
+
+    def put(self, msgs, payload="", encoding="utf-8", max_workers=1, stop=None, if_match=None):
+        """Put job metadata as described by JsonIo.put(),  recording each record
+        written and its new ETag in the cache.
+
+        If `if_match` is specified it applies to every record:  an ETag makes the
+        put conditional on the record being unchanged,  "*" on the record not existing
+        yet.   Lost races raise botocore ClientError,  see s3.is_precondition_failure().
+        """
+        msgs = self.normalize_put_parameters(msgs, payload)
+        for dataset, value in msgs.items():
+            if stop is not None and stop.is_set():
+                break
+            text, s3_path = self.dumper(value), self.path(dataset)
+            if if_match == "*":
+                etag = s3.put_object(text, s3_path, encoding, client=self.client, if_none_match="*")
+            else:
+                etag = s3.put_object(text, s3_path, encoding, client=self.client, if_match=if_match)
+            self.cache.put(s3_path, etag, text)
+
+    def update(self, dataset, func, default=None, retries=METADATA_UPDATE_RETRIES):
+        """Apply `func` to the metadata of `dataset` and write the result back only if
+        no other writer changed the record in the meantime,  otherwise re-read the
+        record and call `func` again,  up to `retries` times.
+
+        `func` modifies the metadata dict it is passed in place;  its return value is
+        returned by update().   If the record does not exist a copy of `default` is
+        used and only created if still missing,  or if `default` is None NoSuchKey is
+        raised as by get().
+
+        Raises MetadataConflict if every attempt loses a race.
+        """
+        for _attempt in range(retries):
+            try:
+                etag, text = self._get_text(dataset)
+                metadata = self.loader(text)
+            except self.client.exceptions.NoSuchKey:
+                if default is None:
+                    raise
+                etag, metadata = "*", json.loads(json.dumps(default))
+            result = func(metadata)
+            try:
+                self.put(dataset, metadata, if_match=etag)
+                return result
+            except self.client.exceptions.ClientError as exc:
+                if not s3.is_precondition_failure(exc):
+                    raise
+                log.info("Metadata for", dataset, "changed during update, retrying.")
+        raise MetadataConflict(f"Metadata for {dataset} changed on every one of {retries} update attempts.")
+
     def list(self, prefixes="all", max_objects=s3.MAX_LIST_OBJECTS):
         """Given S3 `prefixes` described earlier, use list_s3() to generate a
         sequence of listed objects and yield only the final prefix
@@ -704,6 +1213,7 @@ CONTROL_KEYWORDS = {
     "cancel_type": ((str,), lambda x: x in ("job_id", "dataset")),
     "job_id": ((str,), batch.JOB_ID_RE.match),
     "memory_bin": ((int, type(None)), lambda x: x in (0, 1, 2, 3, None)),
+    "routed_bins": ((int,), lambda x: x >= 0),
     "terminated": ((bool,), lambda x: True),
     "timeout_scale": ((int, float), lambda x: x > 0),
     "dataset": ((str,)),
@@ -728,6 +1238,11 @@ CONTROL_KEYWORDS = {
     ),
     "memory_retries": ((int,), lambda x: x >= 0),
     "retries": ((int,), lambda x: x >= 0),
+    "initial_bin": ((int,), lambda x: x >= 0),
+    "job_bin": ((int,), lambda x: x >= 0),
+    "oom_bins": ((list,), lambda x: all(isinstance(b, int) and b >= 0 for b in x)),
+    "failure_job_id": ((str,), batch.JOB_ID_RE.match),
+    "failure_message": ((str,), lambda x: True),
 }
 
 
@@ -790,33 +1305,54 @@ class IoBundle:
             with log.trap_exception():
                 self.xdata.delete(tail)  # dataset control metadata / retry status
 
-    def clean(self, ids="all"):
+    def clean(self, ids="all", max_workers=s3.MAX_TRANSFER_THREADS):
         """Delete every S3 file associated with `ids` which specifies one of:
 
         1. dataset  -  clean one dataset
         2. [dataset, ...]
         3. "all"
 
+        The objects of every branch are accumulated into a single stream of DeleteObjects
+        requests of up to 1000 keys each,  issued concurrently on `max_workers` threads,
+        so a full clean costs roughly (objects / 1000) delete requests plus listing.
+
+        Raises DeleteFailed if any object could not be deleted.
         """
         if isinstance(ids, str):
             ids = [ids]
-        for id in ids:
-            with log.trap_exception():
-                self.reset(ids)
-            with log.trap_exception():
-                self.control.delete(ids)  # Memory model inputs
-            with log.trap_exception():
-                self.inputs.delete(ids)  # Input tarballs
+        delete_objects(self._clean_paths(ids), client=self.client, max_workers=max_workers)
+
+    def _clean_paths(self, ids):
+        """Generate the S3 paths of outputs, messages, control files (including job metadata),
+        and input tarballs for every dataset in `ids`.
+        """
+        branches = [
+            (self.outputs, ids),
+            (self.messages, ["all-" + id for id in ids]),  # messages.delete() doesn't handle "dataset"
+            (self.control, ids),  # Memory model inputs and job metadata
+            (self.inputs, ids),  # Input tarballs
+        ]
+        for branch, prefixes in branches:
+            with log.trap_exception("Listing", branch.s3_path, "for clean"):
+                yield from branch.delete_paths(prefixes)
 
     def ids(self, prefixes="all"):
         """Return the id associated with every object in any branch of this comm
         bundle.
+
+        The four branches are enumerated concurrently.   Outputs and control are
+        listed by directory so their cost scales with dataset count,  not file count.
         """
+        branches = [
+            self.inputs,  # tarball root
+            self.outputs,  # dataset directory
+            self.control,  # dataset directory
+            self.messages,  # datasets / message tails
+        ]
         ids = set()
-        ids = ids | set(self.inputs.ids(prefixes))  # tarball root
-        ids = ids | set(self.outputs.ids(prefixes))  # dataset directory
-        ids = ids | set(self.control.ids(prefixes))  # dataset directory
-        ids = ids | set(self.messages.ids(prefixes))  # datasets / message tails
+        with ThreadPoolExecutor(max_workers=len(branches)) as pool:
+            for branch_ids in pool.map(lambda branch: branch.ids(prefixes), branches):
+                ids |= set(branch_ids)
         return list(ids)
 
     def list_s3(self, prefixes="all"):
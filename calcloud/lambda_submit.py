@@ -21,12 +21,19 @@ from . import submit
 from . import log
 from . import io
 from . import hst
+from . import s3
 
 
 class CalcloudInputsFailure(RuntimeError):
     """The inputs needed to plan and run this job were not ready in time."""
 
 
+class CalcloudInputsPending(Exception):
+    """The inputs needed to plan and run this job are not ready yet and submission is
+    deferred until retrigger_if_ready() detects the last arriving input.
+    """
+
+
 def main(comm, dataset, bucket_name, overrides):
     """Submit the job for `dataset` using `bucket_name` and io bundle `comm`.
     Control parameters can be overridden by dictionary `overrides`.
@@ -45,6 +52,8 @@ def main(comm, dataset, bucket_name, overrides):
     try:
         terminated = comm.messages.listl(f"terminated-{dataset}")
         _main(comm, dataset, bucket_name, overrides)
+    except CalcloudInputsPending as exc:
+        log.info(str(exc))
     except Exception as exc:
         log.error(f"Exception in lambda_submit.main for {dataset} = {exc}")
         if terminated:
@@ -85,37 +94,126 @@ def _main(comm, dataset, bucket_name, overrides):
     log.info("Job Plan:", p)
     response = submit.submit_job(p)
     log.info("Submitted job for", dataset, "as ID", response["jobId"])
-    metadata["job_id"] = response["jobId"]
+    submit.record_submission(metadata, p, response["jobId"])
     comm.xdata.put(dataset, metadata)
     comm.messages.put(f"submit-{dataset}")
+    _clear_retrigger_markers(comm, dataset)
+
+
+def _clear_retrigger_markers(comm, dataset):
+    """Delete the retrigger markers of `dataset` left by _claim_retrigger()."""
+    markers = [_retrigger_marker(comm, dataset, msg) for msg in [f"placed-{dataset}", f"rescue-{dataset}"]]
+    with log.trap_exception("Deleting retrigger markers of", dataset):
+        io.delete_objects(markers, client=comm.client)
+
+
+def _input_paths(comm, dataset):
+    """Return the S3 paths of the inputs tarball and memory model features file for `dataset`."""
+    return comm.inputs.path(f"{dataset}.tar.gz"), comm.control.path(f"{dataset}/{dataset}_MemModelFeatures.txt")
+
+
+def _submission_requested(comm, dataset):
+    """Return the name of the existing placed-dataset or rescue-dataset message,  or None."""
+    for msg in [f"placed-{dataset}", f"rescue-{dataset}"]:
+        if s3.exists(comm.messages.path(msg), client=comm.client):
+            return msg
+    return None
 
 
 def _wait_for_inputs(comm, dataset):
     """Ensure that the inputs required to plan and run the job for `dataset` are available.
 
     Each iteration,  check for the S3 message files which trigger submissions and abort if none
-    are found.
+    are found.   The exact input keys are probed with HEAD requests,  first after SUBMIT_POLL_INITIAL
+    seconds (default 0.25) and then doubling up to SUBMIT_POLL_MAX seconds (default 30),  so inputs
+    which arrive shortly after the placed message are picked up with little delay.
 
     Eventually after 15 min (default) the lambda will die if it's still waiting.  Instead,  if
     it's still running at 14 minutes an exception is raised to force cleanup and send and error message.
+
+    If SUBMIT_DEFER_INPUTS is set,  the lambda does not wait at all.   CalcloudInputsPending is raised
+    leaving the placed or rescue message in place,  and the submission is triggered later by
+    retrigger_if_ready() when the last input arrives.
     """
-    poll_seconds, seconds_to_fail = 30, int(os.environ.get("SUBMIT_TIMEOUT", 14 * 60))
-    input_tarball, memory_modeling = [], []
-    while not input_tarball or not memory_modeling:
-        input_tarball = comm.inputs.listl(f"{dataset}.tar.gz")
-        memory_modeling = comm.control.listl(f"{dataset}/{dataset}_MemModelFeatures.txt")
-        if not comm.messages.listl([f"placed-{dataset}", f"rescue-{dataset}"]):
+    seconds_to_fail = int(os.environ.get("SUBMIT_TIMEOUT", 14 * 60))
+    poll_seconds = float(os.environ.get("SUBMIT_POLL_INITIAL", 0.25))
+    max_poll_seconds = float(os.environ.get("SUBMIT_POLL_MAX", 30))
+    deadline = time.monotonic() + seconds_to_fail
+    input_tarball, memory_modeling = _input_paths(comm, dataset)
+    pending = {input_tarball, memory_modeling}
+    while True:
+        if not _submission_requested(comm, dataset):
             raise CalcloudInputsFailure(
                 f"Both the 'placed' and 'rescue' messages for {dataset} have been deleted. Aborting input wait and submission."
             )
-        if not input_tarball or not memory_modeling:
-            log.info(
-                f"Waiting for inputs for {dataset} time remaining={seconds_to_fail}. input_tarball={len(input_tarball)}  memory_modeling={len(memory_modeling)}"
-            )
-            time.sleep(poll_seconds)
-            seconds_to_fail -= poll_seconds
-            if seconds_to_fail <= 0:
-                raise CalcloudInputsFailure(
-                    f"Wait for inputs for {dataset} timeout, aborting submission.  input_tarball={len(input_tarball)}  memory_modeling={len(memory_modeling)}"
-                )
+        pending = {path for path in pending if not s3.exists(path, client=comm.client)}
+        if not pending:
+            break
+        found = (
+            f"input_tarball={int(input_tarball not in pending)}  memory_modeling={int(memory_modeling not in pending)}"
+        )
+        if os.environ.get("SUBMIT_DEFER_INPUTS"):
+            raise CalcloudInputsPending(f"Inputs for {dataset} not ready, deferring submission.  {found}")
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise CalcloudInputsFailure(f"Wait for inputs for {dataset} timeout, aborting submission.  {found}")
+        log.info(f"Waiting for inputs for {dataset} time remaining={int(remaining)}. {found}")
+        time.sleep(min(poll_seconds, remaining))
+        poll_seconds = min(poll_seconds * 2, max_poll_seconds)
     log.info(f"Inputs for {dataset} found.")
+
+
+def retrigger_if_ready(comm, dataset):
+    """Called as each input for `dataset` arrives,  if every input now exists and a placed or
+    rescue message is waiting,  rewrite that message unchanged so its S3 event re-runs the
+    submission which was deferred by _wait_for_inputs().
+
+    When inputs arrive together several callers can find every input present,  so only the
+    caller which claims the waiting message with _claim_retrigger() rewrites it.
+
+    Returns the name of the rewritten message or None.
+    """
+    if not all(s3.exists(path, client=comm.client) for path in _input_paths(comm, dataset)):
+        return None
+    msg = _submission_requested(comm, dataset)
+    if msg and _claim_retrigger(comm, dataset, msg):
+        log.info(f"Inputs for {dataset} ready, retriggering {msg}")
+        path = comm.messages.path(msg)
+        s3.put_object(s3.get_object(path, client=comm.client, encoding=None), path, encoding=None, client=comm.client)
+        return msg
+    return None
+
+
+def _retrigger_marker(comm, dataset, msg):
+    """Return the S3 path of the marker recording the last retriggered version of message `msg`."""
+    return comm.control.path(f"{dataset}/{msg}.retrigger")
+
+
+def _claim_retrigger(comm, dataset, msg):
+    """Return True IFF this caller is the first to retrigger the current version of message
+    `msg`,  identified by its ETag and LastModified time.   The version is recorded in the one
+    marker object of the message,  created with If-None-Match or replaced with If-Match on
+    the marker's ETag,  so exactly one concurrent caller succeeds.   The marker is deleted by
+    _clear_retrigger_markers() once the job is submitted.
+    """
+    bucket_name, key = s3.s3_split_path(comm.messages.path(msg))
+    marker = _retrigger_marker(comm, dataset, msg)
+    marker_bucket, marker_key = s3.s3_split_path(marker)
+    try:
+        head = comm.client.head_object(Bucket=bucket_name, Key=key)
+        version = head["ETag"].strip('"') + "-" + head["LastModified"].strftime("%Y%m%dT%H%M%S%f")
+        try:
+            claimed = comm.client.get_object(Bucket=marker_bucket, Key=marker_key)
+        except comm.client.exceptions.NoSuchKey:
+            s3.put_object(version, marker, client=comm.client, if_none_match="*")
+        else:
+            if claimed["Body"].read().decode("utf-8") == version:
+                log.info(f"Retrigger of {msg} already claimed.")
+                return False
+            s3.put_object(version, marker, client=comm.client, if_match=claimed["ETag"])
+    except comm.client.exceptions.ClientError as exc:
+        if s3.is_precondition_failure(exc) or exc.response["Error"]["Code"] in ["404", "NoSuchKey"]:
+            log.info(f"Retrigger of {msg} already claimed or message gone.")
+            return False
+        raise
+    return True
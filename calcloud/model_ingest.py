@@ -12,6 +12,7 @@ import json
 from decimal import Decimal
 from pprint import pprint
 from . import common
+from . import features as feature_encoder
 
 s3 = boto3.resource("s3", config=common.retry_config)
 client = boto3.client("s3", config=common.retry_config)
@@ -72,9 +73,8 @@ class Features(Scraper):
         """
         key = f"control/{self.ipst}/{self.ipst}_MemModelFeatures.txt"
         obj = self.bucket.Object(key)
-        input_data = {}
         try:
-            body = obj.get()["Body"].read().splitlines()
+            body = obj.get()["Body"].read()
         except Exception as e:
             body = None
             print(e)
@@ -83,82 +83,12 @@ class Features(Scraper):
             input_data = None
             sys.exit(3)
         else:
-            for line in body:
-                k, v = str(line).strip("b'").split("=")
-                input_data[k] = v
+            input_data = feature_encoder.parse_features(body)
             print(f"{self.ipst}: {input_data}")
             return input_data
 
     def scrub_keys(self):
-        n_files = 0
-        total_mb = 0
-        detector = 0
-        subarray = 0
-        drizcorr = 0
-        pctecorr = 0
-        crsplit = 0
-
-        for k, v in self.input_data.items():
-            if k == "n_files":
-                n_files = int(v)
-            if k == "total_mb":
-                total_mb = int(np.round(float(v), 0))
-            if k == "DETECTOR":
-                if v in ["UVIS", "WFC"]:
-                    detector = 1
-                else:
-                    detector = 0
-            if k == "SUBARRAY":
-                if v == "True":
-                    subarray = 1
-                else:
-                    subarray = 0
-            if k == "DRIZCORR":
-                if v == "PERFORM":
-                    drizcorr = 1
-                else:
-                    drizcorr = 0
-            if k == "PCTECORR":
-                if v == "PERFORM":
-                    pctecorr = 1
-                else:
-                    pctecorr = 0
-            if k == "CRSPLIT":
-                if v == "NaN":
-                    crsplit = 0
-                elif v in ["1", "1.0"]:
-                    crsplit = 1
-                else:
-                    crsplit = 2
-
-        i = self.ipst
-        # dtype (asn or singleton)
-        if i[-1] == "0":
-            dtype = 1
-        else:
-            dtype = 0
-        # instr encoding cols
-        if i[0] == "j":
-            instr = 0
-        elif i[0] == "l":
-            instr = 1
-        elif i[0] == "o":
-            instr = 2
-        elif i[0] == "i":
-            instr = 3
-
-        features = {
-            "n_files": n_files,
-            "total_mb": total_mb,
-            "drizcorr": drizcorr,
-            "pctecorr": pctecorr,
-            "crsplit": crsplit,
-            "subarray": subarray,
-            "detector": detector,
-            "dtype": dtype,
-            "instr": instr,
-        }
-        return features
+        return feature_encoder.as_dict(feature_encoder.encode(self.ipst, self.input_data))
 
 
 class Targets(Scraper):
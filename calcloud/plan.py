@@ -2,7 +2,8 @@
 get_plan().
 
 get_plan() returns a named tuple specifying all the information needed to
-submit a job.
+submit a job.   get_plans() plans many datasets at once using one batched
+prediction call and DynamoDB BatchGetItem requests instead of 2 calls per dataset.
 
 Based on a memory_retries counter,  get_plan() iterates through a sequence
 of job definitions with increasing memory requirements until the job later
@@ -11,18 +12,63 @@ succeeds with sufficient memory or exhausts all retries.
 
 import sys
 import os
+import csv
+import mmap
+import math
+import struct
+import time
+import bisect
+import functools
 from collections import namedtuple
 
 from . import hst
 from . import log
 from . import common
+from . import batch
 
 import json
 import boto3
 from boto3.dynamodb.conditions import Key
 
 client = boto3.client("lambda", config=common.retry_config)
-dynamodb = boto3.resource("dynamodb", config=common.retry_config, region_name="us-east-1")
+dynamodb = None  # allocated on first use by get_dynamodb()
+
+PREDICT_BATCH_SIZE = 1000  # datasets per batched JobPredict invocation,  well below the 6M payload limit
+
+ARRAY_MAX_SIZE = 10000  # AWS Batch limit on child jobs per array job
+
+PACK_SMALL_SECONDS = 10 * 60  # plans with max_seconds up to this are packed with others into one job
+
+PACK_TARGET_SECONDS = 60 * 60  # total max_seconds of the plans packed into one job
+
+PACK_MAX_DATASETS = 100  # datasets per packed job
+
+DDB_BATCH_SIZE = 100  # DynamoDB limit on keys per BatchGetItem request
+
+DDB_DEFAULT_CLOCK, DDB_DEFAULT_WC_STD = 20 * 60, 5  # used for datasets with no wallclock history
+
+WALLCLOCK_CACHE_TTL = float(os.environ.get("WALLCLOCK_CACHE_TTL", 3600))  # seconds wallclock stats are reused
+
+WALLCLOCK_SNAPSHOT = os.environ.get("WALLCLOCK_SNAPSHOT")  # optional snapshot file from build_wallclock_snapshot()
+
+_WALLCLOCK_CACHE = {}  # {dataset: (expiration time,  (db_clock, wc_std))} shared by warm invocations
+
+QUEUE_ROUTING = os.environ.get("CALCLOUD_QUEUE_ROUTING", "bin")  # "bin" or "depth",  see choose_bin()
+
+QUEUE_DEPTH_TTL = float(os.environ.get("CALCLOUD_QUEUE_DEPTH_TTL", 60))  # seconds a queue depth snapshot is reused
+
+BIN_COST_RATIO = float(os.environ.get("CALCLOUD_BIN_COST_RATIO", 2.0))  # cost of next bin up relative to this bin
+
+OOM_STATS = os.environ.get("CALCLOUD_OOM_STATS")  # optional OomStats JSON file from build_oom_stats()
+
+# acceptable historical OOM rate of a starting bin.   Starting a bin higher only saves compute when
+# the rate exceeds (cost ratio - 1) / (cost ratio - 1 + fraction of runtime spent before the OOM),
+# about 0.55 for bins doubling in cost and late OOMs,  so lower targets trade compute for fewer retries.
+OOM_TARGET = float(os.environ.get("CALCLOUD_OOM_TARGET", 0.5))
+
+OOM_MIN_SAMPLES = 20  # attempts needed before an OOM rate is trusted
+
+_QUEUE_DEPTHS = {}  # {"expires": time,  "depths": {queue: {"RUNNABLE": n, "RUNNING": n}}}
 
 # ----------------------------------------------------------------------
 
@@ -69,27 +115,195 @@ def get_plan(dataset, dataset_type, output_bucket, input_path, metadata):
                           with the maximum retry value set in Terraform.
        memory_bin      absolute memory bin number or None
        timeout_scale   factor to multiply kill time by
+       routed_bins     bins earlier attempts were promoted by queue depth routing,
+                       updated in `metadata` when this plan is promoted further
 
     Returns    Plan   (named tuple)
     """
     timeout_scale = metadata["timeout_scale"]
-    memory_retries = metadata["memory_retries"]
-    memory_bin = metadata["memory_bin"]
     job_resources = _get_resources(dataset, dataset_type, output_bucket, input_path, timeout_scale)
-    env = _get_environment(job_resources, memory_retries, memory_bin)
+    env = _plan_environment(job_resources, metadata)
     return Plan(*(job_resources + env))
 
 
+def get_plans(datasets, output_bucket, input_path, metadatas, skip_exhausted=False):
+    """Plan jobs for every dataset in `datasets` with the same results as calling
+    get_plan() on each,  but in a handful of round trips:  one JobPredict invocation
+    per PREDICT_BATCH_SIZE ipst datasets and one DynamoDB BatchGetItem per
+    DDB_BATCH_SIZE datasets.
+
+    datasets         list of dataset IDs to plan
+    output_bucket    S3 output bucket,  top level
+    input_path
+    metadatas        list of metadata dictionaries parallel to `datasets`,  see get_plan()
+    skip_exhausted   if True,  datasets which would raise AllBinsTriedQuit are logged and
+                     omitted from the result instead.
+
+    Returns    [Plan, ...]   in `datasets` order
+    """
+    datasets = list(datasets)
+    metadatas = list(metadatas)
+    assert len(datasets) == len(metadatas), "get_plans() requires one metadata dict per dataset."
+    predictions = invoke_lambda_predict_batch(datasets, output_bucket)
+    history = query_ddb_batch(datasets)
+    plans = []
+    for dataset, metadata in zip(datasets, metadatas):
+        db_clock, wc_std = history[dataset]
+        prediction = predictions[dataset]
+        clockTime = prediction["clockTime"] * (1 + wc_std)
+        job_resources = _get_resources(
+            dataset,
+            hst.get_dataset_type(dataset),
+            output_bucket,
+            input_path,
+            metadata["timeout_scale"],
+            predicted=(clockTime, db_clock, prediction["memBin"]),
+        )
+        try:
+            env = _plan_environment(job_resources, metadata)
+        except AllBinsTriedQuit:
+            if not skip_exhausted:
+                raise
+            continue
+        plans.append(Plan(*(job_resources + env)))
+    return plans
+
+
+def group_plans(plans, max_size=ARRAY_MAX_SIZE):
+    """Group job `plans` which can run as children of one Batch array job,  i.e.
+    plans sharing job queue,  job definition,  and every command argument except
+    the dataset.
+
+    Returns [[plan, ...], ...] with each group holding at most `max_size` plans in
+    their original order,  or complete groups if `max_size` is None.
+    """
+    groups = {}
+    for p in plans:
+        p = Plan(*p)
+        output_root = p.s3_output_uri.rsplit("/", 1)[0]
+        key = (p.job_queue, p.job_definition, p.command, p.input_path, output_root, p.crds_config)
+        groups.setdefault(key, []).append(p)
+    if max_size is None:
+        return list(groups.values())
+    return [group[i : i + max_size] for group in groups.values() for i in range(0, len(group), max_size)]
+
+
+def pack_plans(
+    plans, target_seconds=PACK_TARGET_SECONDS, small_seconds=PACK_SMALL_SECONDS, max_datasets=PACK_MAX_DATASETS
+):
+    """Bin-pack small job `plans` into groups which run sequentially as one Batch job,
+    amortizing container start,  image pull,  and CRDS setup over several datasets.
+
+    Only plans in the same group_plans() job environment,  i.e. the same memory bin,
+    are packed together.   A plan is small if its max_seconds,  the kill time scaled
+    from its predicted clockTime,  is at most `small_seconds`.   Small plans are packed
+    best-fit-decreasing by max_seconds into groups totaling at most `target_seconds`
+    and `max_datasets` plans.   Other plans are returned as groups of one.
+
+    Returns [[plan, ...], ...]
+    """
+    packs = []
+    for group in group_plans(plans, max_size=None):
+        packs.extend([p] for p in group if p.max_seconds > small_seconds)
+        small = sorted((p for p in group if p.max_seconds <= small_seconds), key=lambda p: -p.max_seconds)
+        bins = []
+        capacities = []  # sorted [(remaining seconds, bin index), ...] of bins with room for more plans
+        for p in small:
+            i = bisect.bisect_left(capacities, (p.max_seconds, -1))
+            if i < len(capacities):  # best fit:  the fullest bin with room for p
+                remaining, k = capacities.pop(i)
+                bins[k].append(p)
+            else:
+                remaining, k = target_seconds, len(bins)
+                bins.append([p])
+            if len(bins[k]) < max_datasets:
+                bisect.insort(capacities, (remaining - p.max_seconds, k))
+        packs.extend(bins)
+    return packs
+
+
+def get_dynamodb():
+    """Return the DynamoDB resource,  allocating it on first use rather than at import."""
+    global dynamodb
+    if dynamodb is None:
+        dynamodb = boto3.resource("dynamodb", config=common.retry_config, region_name="us-east-1")
+    return dynamodb
+
+
 def query_ddb(dataset):
+    """Return the historical (db_clock, wc_std) of `dataset`.
+
+    Stats are taken from the wallclock cache or WALLCLOCK_SNAPSHOT when possible so that
+    retries and rescues of the same dataset do not re-query the DynamoDB table.
+    """
+    stats = _cached_wallclock(dataset)
+    if stats is None:
+        table_name = os.environ["DDBTABLE"]
+        table = get_dynamodb().Table(table_name)
+        response = table.query(KeyConditionExpression=Key("ipst").eq(dataset))
+        stats = _cache_wallclock(dataset, _ddb_stats(response["Items"][0] if response["Items"] else None))
+    return stats
+
+
+def query_ddb_batch(datasets):
+    """Fetch the historical wallclock stats of every dataset in `datasets` using one
+    BatchGetItem request per DDB_BATCH_SIZE datasets,  retrying any unprocessed keys.
+    Datasets found in the wallclock cache or snapshot are not requested.
+
+    Returns {dataset: (db_clock, wc_std), ...}   see query_ddb()
+    """
     table_name = os.environ["DDBTABLE"]
-    table = dynamodb.Table(table_name)
-    response = table.query(KeyConditionExpression=Key("ipst").eq(dataset))
-    db_clock, wc_std = 20 * 60, 5
-    if len(response["Items"]) > 0:
-        data = response["Items"][0]
-        db_clock = float(data["wallclock"])
-        if "wc_std" in data:
-            wc_std = float(data["wc_std"])
+    stats = {dataset: _cached_wallclock(dataset) for dataset in dict.fromkeys(datasets)}
+    missing = [dataset for (dataset, found) in stats.items() if found is None]
+    items = {}
+    for i in range(0, len(missing), DDB_BATCH_SIZE):
+        request = {table_name: {"Keys": [{"ipst": dataset} for dataset in missing[i : i + DDB_BATCH_SIZE]]}}
+        delay = 0.05
+        while request:
+            response = get_dynamodb().batch_get_item(RequestItems=request)
+            for item in response["Responses"].get(table_name, []):
+                items[item["ipst"]] = item
+            request = response.get("UnprocessedKeys")
+            if request:  # throttled,  back off before retrying the remainder
+                time.sleep(delay)
+                delay = min(delay * 2, 2.0)
+    for dataset in missing:
+        stats[dataset] = _cache_wallclock(dataset, _ddb_stats(items.get(dataset)))
+    return stats
+
+
+def _cached_wallclock(dataset):
+    """Return unexpired cached (db_clock, wc_std) for `dataset`,  else any snapshot stats,  else None."""
+    cached = _WALLCLOCK_CACHE.get(dataset)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+    snapshot = get_wallclock_snapshot()
+    if snapshot is not None:
+        stats = snapshot.get(dataset)
+        if stats is not None:
+            return _cache_wallclock(dataset, stats)
+    return None
+
+
+def _cache_wallclock(dataset, stats):
+    """Remember (db_clock, wc_std) `stats` for `dataset` for WALLCLOCK_CACHE_TTL seconds and return them."""
+    if WALLCLOCK_CACHE_TTL > 0:
+        _WALLCLOCK_CACHE[dataset] = (time.monotonic() + WALLCLOCK_CACHE_TTL, stats)
+    return stats
+
+
+def clear_wallclock_cache():
+    """Forget all cached wallclock stats."""
+    _WALLCLOCK_CACHE.clear()
+
+
+def _ddb_stats(item):
+    """Return (db_clock, wc_std) from a wallclock history table `item`,  or the defaults for None."""
+    db_clock, wc_std = DDB_DEFAULT_CLOCK, DDB_DEFAULT_WC_STD
+    if item is not None:
+        db_clock = float(item["wallclock"])
+        if "wc_std" in item:
+            wc_std = float(item["wc_std"])
     return db_clock, wc_std
 
 
@@ -118,7 +332,38 @@ def invoke_lambda_predict(dataset, dataset_type, output_bucket):
     return clockTime, db_clock, predictions["memBin"]
 
 
-def _get_resources(dataset, dataset_type, output_bucket, input_path, timeout_scale):
+def invoke_lambda_predict_batch(datasets, output_bucket):
+    """Invoke calcloud-ai lambda once per PREDICT_BATCH_SIZE ipst datasets of `datasets` to compute
+    their baseline memory bin and kill time predictions.   Other dataset types get default predictions.
+
+    Returns {dataset: {"memBin": ..., "clockTime": ..., ...}, ...}
+    """
+    bucket = output_bucket.replace("s3://", "")
+    predictions = {}
+    ipsts = []
+    for dataset in datasets:
+        if hst.get_dataset_type(dataset) == "ipst":
+            ipsts.append(dataset)
+        else:
+            predictions[dataset] = dict(clockTime=20 * 60, memBin=1)
+    job_predict_lambda = os.environ["JOBPREDICTLAMBDA"]
+    for i in range(0, len(ipsts), PREDICT_BATCH_SIZE):
+        items = [
+            {"Key": f"control/{dataset}/{dataset}_MemModelFeatures.txt", "Ipppssoot": dataset}
+            for dataset in ipsts[i : i + PREDICT_BATCH_SIZE]
+        ]
+        response = client.invoke(
+            FunctionName=job_predict_lambda,
+            InvocationType="RequestResponse",
+            Payload=json.dumps({"Bucket": bucket, "Items": items}),
+        )
+        for result in json.load(response["Payload"])["Results"]:
+            predictions[result["ipppssoot"]] = result
+    log.info(f"Batch predictions for {len(ipsts)} datasets in {len(range(0, len(ipsts), PREDICT_BATCH_SIZE))} calls.")
+    return predictions
+
+
+def _get_resources(dataset, dataset_type, output_bucket, input_path, timeout_scale, predicted=None):
     """Given an HST dataset ID,  return information used to schedule it as a batch job.
 
     Conceptually resource requirements can be tailored to individual datasets.
@@ -126,6 +371,9 @@ def _get_resources(dataset, dataset_type, output_bucket, input_path, timeout_sca
     This defines abstract memory and CPU requirements independently of the AWS Batch
     resources used to satisfy them.
 
+    `predicted` is (clockTime, db_clock, initial_bin) as returned by invoke_lambda_predict(),
+    which is called if it is not specified.
+
     Returns:  JobResources named tuple
     """
     dataset = dataset.lower()
@@ -138,7 +386,9 @@ def _get_resources(dataset, dataset_type, output_bucket, input_path, timeout_sca
     input_path = input_path
     crds_config = "caldp-config-aws"
     # default: predicted time * 6 or * 1+std_err
-    clockTime, db_clock, initial_bin = invoke_lambda_predict(dataset, dataset_type, output_bucket)
+    if predicted is None:
+        predicted = invoke_lambda_predict(dataset, dataset_type, output_bucket)
+    clockTime, db_clock, initial_bin = predicted
     # clip between 20 minutes and 2 days, * timeout_scale
     kill_time = int(min(max(clockTime, db_clock), 48 * 60 * 60) * timeout_scale)
     # minimum Batch requirement 60 seconds
@@ -147,17 +397,40 @@ def _get_resources(dataset, dataset_type, output_bucket, input_path, timeout_sca
     return JobResources(dataset, instr, job_name, s3_output_uri, input_path, crds_config, initial_bin, kill_time)
 
 
-def _get_environment(job_resources, memory_retries, memory_bin):
+def _plan_environment(job_resources, metadata):
+    """Return the JobEnv for `job_resources` and control `metadata`,  recording any queue
+    depth promotion in metadata["routed_bins"] so later attempts retry above the promoted bin.
+    """
+    routed_bins = metadata.get("routed_bins", 0)
+    env, now_routed = _get_environment(job_resources, metadata["memory_retries"], metadata["memory_bin"], routed_bins)
+    if now_routed != routed_bins:
+        metadata["routed_bins"] = now_routed
+    return env
+
+
+def _get_environment(job_resources, memory_retries, memory_bin, routed_bins=0):
     """Based on a resources tuple and a memory_retries counter or memory_bin,  determine:
 
-    (queue,  job_definition_for_memory,  caldp_entrypoint)
+    ((queue,  job_definition_for_memory,  caldp_entrypoint),  routed_bins)
+
+    Without an explicit `memory_bin` the ladder starts at the bin chosen by oom_start_bin()
+    raised by the `routed_bins` earlier attempts were promoted by queue depth routing,  so
+    a job promoted from bin 0 to 1 which runs out of memory is retried in bin 2 rather than
+    bin 1 again.   Queue depth routing may promote the job further,  the returned routed_bins
+    includes that promotion.   An explicit `memory_bin` is used as is and never re-routed.
     """
-    job_defs = os.environ["JOBDEFINITIONS"].split(",")
-    job_queues = os.environ["JOBQUEUES"].split(",")
+    job_defs, job_queues = _get_job_tables(os.environ["JOBDEFINITIONS"], os.environ["JOBQUEUES"])
     job_resources = JobResources(*job_resources)
 
-    final_bin = memory_bin if memory_bin is not None else job_resources.initial_modeled_bin
-    final_bin += memory_retries
+    if memory_bin is not None:
+        final_bin = memory_bin + memory_retries
+    else:
+        start_bin = oom_start_bin(job_resources.instrument, job_resources.initial_modeled_bin, len(job_defs))
+        final_bin = start_bin + memory_retries + routed_bins
+        if final_bin < len(job_defs) and QUEUE_ROUTING == "depth":
+            routed_bin = _route_by_queue_depth(final_bin, job_resources, job_queues)
+            routed_bins += routed_bin - final_bin
+            final_bin = routed_bin
     if final_bin < len(job_defs):
         log.info(
             "Selecting resources for",
@@ -168,6 +441,8 @@ def _get_environment(job_resources, memory_retries, memory_bin):
             memory_retries,
             "Memory bin",
             memory_bin,
+            "Routed bins",
+            routed_bins,
             "Final bin index",
             final_bin,
         )
@@ -185,7 +460,366 @@ def _get_environment(job_resources, memory_retries, memory_bin):
         log.info(*msg)
         raise AllBinsTriedQuit(*msg)
 
-    return JobEnv(job_queue, job_definition, "caldp-process")
+    return JobEnv(job_queue, job_definition, "caldp-process"), routed_bins
+
+
+def get_job_bin(job_plan):
+    """Return the memory bin index of the job definition of `job_plan`."""
+    job_defs, _job_queues = _get_job_tables(os.environ["JOBDEFINITIONS"], os.environ["JOBQUEUES"])
+    return job_defs.index(Plan(*job_plan).job_definition)
+
+
+@functools.lru_cache(maxsize=4)
+def _get_job_tables(job_definitions, job_queues):
+    """Return the (job_definitions, job_queues) tuples indexed by memory bin parsed from
+    the comma separated JOBDEFINITIONS and JOBQUEUES environment values.
+
+    >>> _get_job_tables("jobdef-2g,jobdef-8g", "queue-2g,queue-8g")
+    (('jobdef-2g', 'jobdef-8g'), ('queue-2g', 'queue-8g'))
+    """
+    return tuple(job_definitions.split(",")), tuple(job_queues.split(","))
+
+
+# ----------------------------------------------------------------------
+
+
+def choose_bin(memory_bin, job_seconds, depths, bin_cost_ratio=BIN_COST_RATIO):
+    """Given the memory bin a job requires,  its expected runtime `job_seconds`,  and the
+    list `depths` of (runnable, running) job counts for the queue of every bin,  return
+    the bin to run the job in.
+
+    The expected wait in a queue is its backlog per running job times `job_seconds`.
+    The job is promoted to the next bin up when the wait saved exceeds the extra cost of
+    running on the larger instance,  (bin_cost_ratio - 1) * job_seconds.
+
+    >>> choose_bin(0, 600, [(40, 4), (0, 2), (0, 0)])
+    1
+    >>> choose_bin(0, 600, [(1, 4), (0, 2), (0, 0)])
+    0
+    >>> choose_bin(2, 600, [(0, 0), (0, 0), (50, 1)])
+    2
+    """
+    if memory_bin + 1 >= len(depths):
+        return memory_bin
+
+    def wait(runnable, running):
+        return runnable / max(running, 1) * job_seconds
+
+    saved = wait(*depths[memory_bin]) - wait(*depths[memory_bin + 1])
+    return memory_bin + 1 if saved > (bin_cost_ratio - 1) * job_seconds else memory_bin
+
+
+def get_queue_depths(queues, ttl=QUEUE_DEPTH_TTL):
+    """Return {queue: {"RUNNABLE": count, "RUNNING": count}} for `queues` from a snapshot
+    of batch.iter_jobs() listings which is reused for `ttl` seconds.
+    """
+    if _QUEUE_DEPTHS.get("expires", 0) <= time.monotonic() or set(queues) - set(_QUEUE_DEPTHS["depths"]):
+        depths = {queue: {"RUNNABLE": 0, "RUNNING": 0} for queue in queues}
+        for queue in queues:  # job summaries don't name their queue
+            for job in batch.iter_jobs(queue, ("RUNNABLE", "RUNNING"), formatted=False):
+                depths[queue][job["status"]] += 1
+        _QUEUE_DEPTHS.update(expires=time.monotonic() + ttl, depths=depths)
+    return _QUEUE_DEPTHS["depths"]
+
+
+def clear_queue_depths():
+    """Forget the cached queue depth snapshot."""
+    _QUEUE_DEPTHS.clear()
+
+
+def _route_by_queue_depth(memory_bin, job_resources, job_queues):
+    """Return the bin chosen by choose_bin() for `job_resources` using the cached queue depths,
+    counting the routed job as RUNNABLE in the snapshot so jobs planned together spread out.
+    """
+    with log.trap_exception("Queue depth routing for", job_resources.dataset):
+        depths = get_queue_depths(job_queues)
+        counts = [(depths[q]["RUNNABLE"], depths[q]["RUNNING"]) for q in job_queues]
+        routed = choose_bin(memory_bin, job_resources.max_seconds, counts)
+        if routed != memory_bin:
+            log.info("Promoting", job_resources.dataset, "from bin", memory_bin, "to", routed, "queue depths", counts)
+        depths[job_queues[routed]]["RUNNABLE"] += 1
+        return routed
+    return memory_bin
+
+
+# ----------------------------------------------------------------------
+
+
+class WallclockSnapshot:
+    """Read-only memory mapped table of historical (db_clock, wc_std) per dataset,
+    written by build_wallclock_snapshot() as fixed width records sorted by dataset
+    so lookups are a binary search touching only a few pages.
+
+    >>> import tempfile
+    >>> tmp = tempfile.mkdtemp()
+    >>> with open(f"{tmp}/latest.csv", "w") as csv_file:
+    ...     _ = csv_file.write("wallclock,wc_std,ipst\\n300.5,1.5,lpppssoo0\\n90,,ipppssoo1\\n12,0.5,skycell-p0115x10y10\\n")
+    >>> build_wallclock_snapshot(f"{tmp}/latest.csv", f"{tmp}/wallclock.snapshot")
+    3
+    >>> snapshot = WallclockSnapshot(f"{tmp}/wallclock.snapshot")
+    >>> snapshot.get("lpppssoo0"), snapshot.get("ipppssoo1"), snapshot.get("skycell-p0115x10y10")
+    ((300.5, 1.5), (90.0, 5), (12.0, 0.5))
+    >>> snapshot.get("jpppssoo2") is None
+    True
+    >>> snapshot.close()
+    """
+
+    MAGIC = b"CALCLOUD-WALLCLOCK-1\n"
+    RECORD = struct.Struct("<40sdd")  # dataset,  wallclock,  wc_std (NaN if undefined)
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as snapshot_file:
+            self.map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[: len(self.MAGIC)] != self.MAGIC:
+            self.map.close()
+            raise ValueError(f"Not a wallclock snapshot file: {path}")
+        self.count = (len(self.map) - len(self.MAGIC)) // self.RECORD.size
+
+    def __len__(self):
+        return self.count
+
+    def _record(self, i):
+        return self.RECORD.unpack_from(self.map, len(self.MAGIC) + i * self.RECORD.size)
+
+    def get(self, dataset):
+        """Return (db_clock, wc_std) for `dataset` or None if it is not in the snapshot."""
+        key = dataset.encode("ascii")
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._record(mid)[0].rstrip(b"\0") < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count:
+            name, wallclock, wc_std = self._record(lo)
+            if name.rstrip(b"\0") == key:
+                return wallclock, DDB_DEFAULT_WC_STD if math.isnan(wc_std) else wc_std
+        return None
+
+    def close(self):
+        self.map.close()
+
+
+def build_wallclock_snapshot(csv_path, snapshot_path):
+    """Convert the ipst, wallclock, and wc_std columns of `csv_path`,  e.g. the latest.csv written
+    by modeling.main,  into a WallclockSnapshot file at `snapshot_path`.   When a dataset appears
+    more than once its last row is used.
+
+    Returns the number of datasets written.
+    """
+    rows = {}
+    with open(csv_path, newline="") as csv_file:
+        for row in csv.DictReader(csv_file):
+            dataset = row["ipst"].encode("ascii")
+            if len(dataset) > WallclockSnapshot.RECORD.size - 16:
+                raise ValueError(f"Dataset name too long for wallclock snapshot: {row['ipst']}")
+            rows[dataset] = (float(row["wallclock"]), float(row.get("wc_std") or "nan"))
+    with open(snapshot_path + ".tmp", "wb") as snapshot_file:
+        snapshot_file.write(WallclockSnapshot.MAGIC)
+        for dataset in sorted(rows):
+            snapshot_file.write(WallclockSnapshot.RECORD.pack(dataset, *rows[dataset]))
+    os.replace(snapshot_path + ".tmp", snapshot_path)
+    return len(rows)
+
+
+_WALLCLOCK_SNAPSHOTS = {}
+
+
+def get_wallclock_snapshot(path=None):
+    """Return the WallclockSnapshot for `path`,  default WALLCLOCK_SNAPSHOT,  opening it once
+    per process.   Returns None if no snapshot is configured.
+    """
+    path = path or WALLCLOCK_SNAPSHOT
+    if not path:
+        return None
+    if path not in _WALLCLOCK_SNAPSHOTS:
+        _WALLCLOCK_SNAPSHOTS[path] = WallclockSnapshot(path)
+    return _WALLCLOCK_SNAPSHOTS[path]
+
+
+# ----------------------------------------------------------------------
+
+
+class OomStats:
+    """Counts of job attempts and out-of-memory failures in each memory bin,  keyed by
+    instrument and the memory bin predicted by the JobPredict model.
+
+    Observations with predicted bin None are instrument wide,  e.g. from the ingest table's
+    measured memory bins,  and are used when too few attempts match the predicted bin.
+
+    >>> stats = OomStats()
+    >>> for i in range(20):
+    ...     stats.add_job("wfc3", 0, oom_bins=[0] if i < 8 else [], finished_bin=1 if i < 8 else 0)
+    >>> stats.failure_rate("wfc3", 0, 0), stats.failure_rate("wfc3", 0, 1), stats.failure_rate("wfc3", 1, 1)
+    (0.4, None, None)
+    >>> stats.start_bin("wfc3", 0, 4, target=0.1)
+    1
+    >>> stats.start_bin("wfc3", 0, 4, target=0.5), stats.start_bin("acs", 0, 4, target=0.1)
+    (0, 0)
+    """
+
+    def __init__(self, counts=None, min_samples=OOM_MIN_SAMPLES):
+        self.counts = counts or {}  # {"instrument/predicted_bin": {"bin": [attempts, ooms]}}
+        self.min_samples = min_samples
+
+    @staticmethod
+    def _key(instrument, predicted_bin):
+        return f"{instrument}/{'*' if predicted_bin is None else int(predicted_bin)}"
+
+    def add(self, instrument, predicted_bin, job_bin, oom):
+        """Record one attempt at `job_bin` which failed for lack of memory if `oom`."""
+        counts = self.counts.setdefault(self._key(instrument, predicted_bin), {}).setdefault(str(job_bin), [0, 0])
+        counts[0] += 1
+        counts[1] += int(bool(oom))
+
+    def add_job(self, instrument, predicted_bin, oom_bins, finished_bin=None):
+        """Record the attempts of one job which ran out of memory in each of `oom_bins`,
+        the bins its attempts actually ran in,  and if it finished,  succeeded in `finished_bin`.
+
+        A job predicted to need bin 0 but promoted to bin 1 by queue depth routing,  which ran
+        out of memory there and finished in bin 2,  never ran in bin 0:
+
+        >>> stats = OomStats()
+        >>> stats.add_job("acs", 0, oom_bins=[1], finished_bin=2)
+        >>> stats.counts
+        {'acs/0': {'1': [1, 1], '2': [1, 0]}}
+        """
+        for failed_bin in oom_bins:
+            self.add(instrument, predicted_bin, failed_bin, True)
+        if finished_bin is not None:
+            self.add(instrument, predicted_bin, finished_bin, False)
+
+    def add_required(self, instrument, required_bin, n_bins):
+        """Record a job which measurably needed `required_bin`,  i.e. would fail in any lower bin."""
+        for job_bin in range(min(required_bin + 1, n_bins)):
+            self.add(instrument, None, job_bin, job_bin < required_bin)
+
+    def failure_rate(self, instrument, predicted_bin, job_bin):
+        """Return the OOM rate at `job_bin` for jobs predicted to need `predicted_bin`,  falling
+        back to the instrument wide rate.   Return None if neither has min_samples attempts.
+        """
+        for key in [self._key(instrument, predicted_bin), self._key(instrument, None)]:
+            attempts, ooms = self.counts.get(key, {}).get(str(job_bin), (0, 0))
+            if attempts >= self.min_samples:
+                return ooms / attempts
+        return None
+
+    def start_bin(self, instrument, predicted_bin, n_bins, target=None):
+        """Return the lowest bin from `predicted_bin` up whose OOM rate is at most `target`,
+        default OOM_TARGET,  stopping at the first bin with too little history to judge.
+        """
+        target = OOM_TARGET if target is None else target
+        job_bin = predicted_bin
+        while job_bin + 1 < n_bins:
+            rate = self.failure_rate(instrument, predicted_bin, job_bin)
+            if rate is None or rate <= target:
+                break
+            job_bin += 1
+        return job_bin
+
+    def save(self, path):
+        with open(path + ".tmp", "w") as stats_file:
+            json.dump(self.counts, stats_file, sort_keys=True)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as stats_file:
+            return cls(json.load(stats_file))
+
+
+def build_oom_stats(metadatas=(), ingest_items=(), n_bins=None):
+    """Aggregate OomStats from control `metadatas`,  job.json dicts recording the predicted
+    "initial_bin",  the "job_bin" of the last attempt,  the "oom_bins" of every attempt which
+    ran out of memory,  any failure exit_code or container_reason of the last attempt,  and
+    whether the dataset "finished" processing,  and from `ingest_items`,  ingest table rows
+    recording each dataset's measured "mem_bin".
+
+    The last attempt counts as a success in job_bin if the dataset finished without it running
+    out of memory.   Otherwise it is still running or failed and only the OOMs are counted.
+    Records without oom_bins,  written before it was kept,  are assumed to have run out of
+    memory in the memory_retries bins just below job_bin,  and in job_bin if the last attempt did.
+
+    Returns OomStats
+    """
+    from . import exit_codes
+
+    n_bins = n_bins or len(_get_job_tables(os.environ["JOBDEFINITIONS"], os.environ["JOBQUEUES"])[0])
+    stats = OomStats()
+    for metadata in metadatas:
+        dataset = metadata.get("dataset", "")
+        if "initial_bin" not in metadata or "job_bin" not in metadata or not hst.IPPPSSOOT_RE.match(dataset):
+            continue
+        job_bin = metadata["job_bin"]
+        oom = "exit_code" in metadata and exit_codes.is_memory_error(metadata["exit_code"])
+        oom = oom or str(metadata.get("container_reason", "")).startswith("OutOfMemoryError")
+        if "oom_bins" in metadata:
+            oom_bins = metadata["oom_bins"]
+        else:
+            oom_bins = list(range(job_bin - metadata["memory_retries"], job_bin)) + ([job_bin] if oom else [])
+        finished_bin = job_bin if metadata.get("finished") and not oom else None
+        stats.add_job(hst.get_instrument(dataset), metadata["initial_bin"], oom_bins, finished_bin)
+    for item in ingest_items:
+        if hst.IPPPSSOOT_RE.match(item.get("ipst", "")) and item.get("mem_bin") is not None:
+            stats.add_required(hst.get_instrument(item["ipst"]), int(item["mem_bin"]), n_bins)
+    return stats
+
+
+def scan_oom_history(bucket, table_name=None):
+    """Generate the job.json metadata of every dataset under `bucket` and return
+    (metadatas,  ingest table items) for build_oom_stats().
+    """
+    from . import io
+
+    comm = io.get_io_bundle(bucket)
+    finished = set(comm.messages.ids(["processed", "ingesterror", "ingested"]))
+    metadatas = []
+    for s3_path in comm.xdata.list_s3("all"):
+        if s3_path.endswith("/job.json"):
+            dataset = s3_path.split("/")[-2]
+            with log.trap_exception("Reading metadata", s3_path):
+                metadatas.append(dict(comm.xdata.get(dataset), dataset=dataset, finished=dataset in finished))
+    items = []
+    if table_name:
+        table = get_dynamodb().Table(table_name)
+        params = dict(ProjectionExpression="ipst, mem_bin")
+        while True:
+            response = table.scan(**params)
+            items.extend(response["Items"])
+            if "LastEvaluatedKey" not in response:
+                break
+            params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    return metadatas, items
+
+
+_OOM_STATS = {}
+
+
+def get_oom_stats(path=None):
+    """Return the OomStats loaded from `path`,  default OOM_STATS,  once per process.
+    Returns None if no statistics are configured.
+    """
+    path = path or OOM_STATS
+    if not path:
+        return None
+    if path not in _OOM_STATS:
+        _OOM_STATS[path] = OomStats.load(path)
+    return _OOM_STATS[path]
+
+
+def oom_start_bin(instrument, predicted_bin, n_bins):
+    """Return the bin to start a job in based on historical OOM statistics,  if any,
+    rather than climbing from `predicted_bin` one failed job at a time.
+    """
+    stats = get_oom_stats()
+    if stats is None or not instrument:
+        return predicted_bin
+    start = stats.start_bin(instrument, predicted_bin, n_bins)
+    if start != predicted_bin:
+        log.info("Historical OOM rate escalates", instrument, "predicted bin", predicted_bin, "to", start)
+    return start
 
 
 # ----------------------------------------------------------------------
@@ -204,3 +838,9 @@ def test():
 if __name__ == "__main__":
     if sys.argv[1] == "test":
         print(test())
+    elif sys.argv[1] == "snapshot":  # python -m calcloud.plan snapshot latest.csv wallclock.snapshot
+        print(build_wallclock_snapshot(sys.argv[2], sys.argv[3]), "datasets written to", sys.argv[3])
+    elif sys.argv[1] == "oom-stats":  # python -m calcloud.plan oom-stats <bucket> oom_stats.json [<ingest table>]
+        history = scan_oom_history(sys.argv[2], sys.argv[4] if len(sys.argv) > 4 else None)
+        build_oom_stats(*history).save(sys.argv[3])
+        print(len(history[0]), "job records and", len(history[1]), "ingest records summarized in", sys.argv[3])
@@ -10,11 +10,17 @@ broken apart internally like this:
 
 import os
 import os.path
+import json
+import queue
+import urllib.parse
+import contextlib
 
 import boto3
+from botocore.exceptions import ClientError
 
 from calcloud import log
 from calcloud import common
+from calcloud import timing
 
 # -------------------------------------------------------------
 
@@ -23,15 +29,26 @@ __all__ = [
     "download_filepath",
     "upload_filepath",
     "download_objects",
-    # "upload_directory",
+    "upload_directory",
     "list_objects",
+    "list_directory",
     "get_object",
+    "get_object_if_changed",
+    "exists",
+    "exists_many",
     "put_object",
+    "is_precondition_failure",
+    "put_objects",
     "delete_object",
+    "delete_objects",
     "move_object",
     "copy_object",
     "get_default_client",
+    "borrow_client",
     "parse_s3_event",
+    "parse_s3_events",
+    "handle_s3_events",
+    "S3EventFailed",
     "DEFAULT_BUCKET",
 ]
 
@@ -48,10 +65,38 @@ def get_default_client():
     return DEFAULT_S3_CLIENT
 
 
+_CLIENT_POOL = queue.SimpleQueue()
+
+
+@contextlib.contextmanager
+def borrow_client():
+    """Lend the calling thread an S3 client for exclusive use inside a with-block.
+
+    Clients are returned to a process-wide pool and re-used by later transfers,
+    so a warm lambda or long running script pays client creation (~150 msec)
+    only once per worker thread.  Each new client is created from its own boto3
+    Session since Sessions are not thread safe.
+    """
+    try:
+        client = _CLIENT_POOL.get_nowait()
+    except queue.Empty:
+        client = boto3.session.Session().client("s3", config=common.retry_config)
+    try:
+        yield client
+    finally:
+        _CLIENT_POOL.put(client)
+
+
 DEFAULT_BUCKET = "s3://" + os.environ.get("BUCKET", "calcloud-UNDEFINED-bucket")
 
 MAX_LIST_OBJECTS = 10**7
 
+MAX_DELETE_KEYS = 1000  # S3 limit on keys per DeleteObjects request
+
+MAX_TRANSFER_THREADS = int(os.environ.get("CALCLOUD_S3_TRANSFER_THREADS", 16))
+
+MAX_PROBE_THREADS = int(os.environ.get("CALCLOUD_S3_PROBE_THREADS", 12))  # one per message type
+
 # -------------------------------------------------------------
 
 
@@ -188,42 +233,65 @@ def move_object(s3_filepath_from, s3_filepath_to, client=None):
 # -------------------------------------------------------------
 
 
-def download_objects(dirpath, s3_dirpath, max_objects=1000, client=None):
+def download_objects(dirpath, s3_dirpath, max_objects=1000, client=None, max_workers=MAX_TRANSFER_THREADS, stats=None):
     """Given `s3_dirpath` s3 directory to download, copy it to a local file system
     at `dirpath`.
 
+    Downloads begin as soon as the first objects are listed and are spread over
+    a pool of `max_workers` threads,  each using its own pooled S3 client unless
+    `client` is specified,  in which case every thread shares `client`.
+
     Parameters
     ----------
     dirpath : str
         Local filesystem path where s3 directory will be copied to.
-        e.g. /outputs/batch-1-2020-06-11T19-35-51/acs/j8cb010b0
+        e.g. /outputs/batch-1-2020-06-11T19-35-51/acs/j8cb010b0
     s3_dirpath : str
         Full s3 path to directory to download,  including the bucket prefix,
         e.g. s3://hstdp/batch-1-2020-06-11T19-35-51/data/acs/j8cb010b0
     client : get_default_client()
-        Optional boto3 s3 client to re-use for multiple files.
+        Optional boto3 s3 client used for listing and every download.
     max_objects : int
         Max number of files to list and download.
+    max_workers : int
+        Number of concurrent download threads,  1 downloads serially on `client`.
+    stats : timing.TimingStats
+        Optional stats object which accumulates "objects" and "bytes" counts.
 
     Returns
     ------
     downloads : list (str)
-       file paths of downloaded files.
+       file paths of downloaded files in order of completion.
     """
-    log.verbose("s3.download_objects", dirpath, s3_dirpath, max_objects)
+    log.verbose("s3.download_objects", dirpath, s3_dirpath, max_objects, max_workers)
+    shared = client is not None or max_workers <= 1
     client = client or get_default_client()
-    downloads = []
-    for s3_filepath in list_objects(s3_dirpath, max_objects=max_objects, client=client):
+    stats = stats or timing.TimingStats(output=log.verbose)
+
+    def download(s3_filepath):
         local_filepath = os.path.abspath(s3_filepath.replace(s3_dirpath, dirpath))
-        download_filepath(local_filepath, s3_filepath, client)
-        downloads.append(local_filepath)
+        if shared:
+            download_filepath(local_filepath, s3_filepath, client)
+        else:
+            with borrow_client() as thread_client:
+                download_filepath(local_filepath, s3_filepath, thread_client)
+        return local_filepath, timing.file_size(local_filepath)
+
+    s3_filepaths = list_objects(s3_dirpath, max_objects=max_objects, client=client)
+    downloads = _transfer_all(download, s3_filepaths, max_workers, stats)
+    stats.log_status("objects", "s3.download_objects " + s3_dirpath)
+    stats.log_status("bytes", "s3.download_objects " + s3_dirpath)
     return downloads
 
 
-def upload_directory(dirpath, s3_dirpath):
-    """Given `dirpath` local directory to download, copy it to s3
+def upload_directory(dirpath, s3_dirpath, client=None, max_workers=MAX_TRANSFER_THREADS, stats=None):
+    """Given `dirpath` local directory to upload, copy it to s3
     at `s3_dirpath`.
 
+    Uploads begin as soon as the first files are found and are spread over
+    a pool of `max_workers` threads,  each using its own pooled S3 client unless
+    `client` is specified,  in which case every thread shares `client`.
+
     Parameters
     ----------
     dirpath : str
@@ -232,12 +300,60 @@ def upload_directory(dirpath, s3_dirpath):
         Full s3 path to upload to, including the bucket prefix and object
         prefix.
         e.g. s3://hstdp/batch-1-2020-06-11T19-35-51/acs/j8cb010b0
+    client : get_default_client()
+        Optional boto3 s3 client used for every upload.
+    max_workers : int
+        Number of concurrent upload threads,  1 uploads serially on `client`.
+    stats : timing.TimingStats
+        Optional stats object which accumulates "objects" and "bytes" counts.
 
     Returns
     ------
-    None
+    uploads : list (str)
+       s3 paths of uploaded files in order of completion.
+    """
+    log.verbose("s3.upload_directory", dirpath, s3_dirpath, max_workers)
+    shared = client is not None or max_workers <= 1
+    client = client or get_default_client()
+    stats = stats or timing.TimingStats(output=log.verbose)
+    dirpath = os.path.abspath(dirpath)
+    s3_dirpath = s3_dirpath.rstrip("/")
+
+    def upload(filepath):
+        relpath = os.path.relpath(filepath, dirpath).replace(os.sep, "/")
+        s3_filepath = s3_dirpath + "/" + relpath
+        if shared:
+            upload_filepath(filepath, s3_filepath, client)
+        else:
+            with borrow_client() as thread_client:
+                upload_filepath(filepath, s3_filepath, thread_client)
+        return s3_filepath, timing.file_size(filepath)
+
+    def walk_files():
+        for root, _dirs, files in os.walk(dirpath):
+            for name in sorted(files):
+                yield os.path.join(root, name)
+
+    uploads = _transfer_all(upload, walk_files(), max_workers, stats)
+    stats.log_status("objects", "s3.upload_directory " + s3_dirpath)
+    stats.log_status("bytes", "s3.upload_directory " + s3_dirpath)
+    return uploads
+
+
+def _transfer_all(transfer, sources, max_workers, stats):
+    """Call `transfer` on each item of iterable `sources` using `max_workers` threads.
+
+    `transfer` returns (path, nbytes) which is tallied into `stats` as "objects" and
+    "bytes" from this thread only,  so TimingStats needs no locking.
+
+    Returns [path, ...] in order of completion.
     """
-    raise NotImplementedError("upload_directory hasn't been implemented yet.")
+    paths = []
+    for path, nbytes in timing.pipeline(transfer, sources, max_workers):
+        paths.append(path)
+        stats.increment("objects")
+        stats.increment("bytes", nbytes)
+    return paths
 
 
 def list_objects(s3_prefix, client=None, max_objects=MAX_LIST_OBJECTS):
@@ -270,6 +386,40 @@ def list_objects(s3_prefix, client=None, max_objects=MAX_LIST_OBJECTS):
                 yield "s3://" + bucket_name + "/" + result["Key"]
 
 
+def list_directory(s3_prefix, client=None, max_objects=MAX_LIST_OBJECTS):
+    """Given `s3_prefix` s3 bucket and prefix to list, yield the full s3 paths of
+    only the first level of the "directory tree" below the prefix,  i.e. list with
+    Delimiter="/" so each subdirectory is returned once as a CommonPrefix instead
+    of once for every object it contains.
+
+    Parameters
+    ----------
+    s3_prefix : str
+        Full s3 path to directory and prefix to list:
+        e.g. s3://hstdp/outputs/  or s3://hstdp/outputs/j8cb
+    client : get_default_client()
+        Optional boto3 s3 client to re-use for multiple files.
+    max_objects : int
+        Max number of S3 objects and subdirectories to return.
+
+    Iterates
+    ------
+    [ full_s3_path, ... ]  :  iter( [ str ] )
+        full s3 paths of subdirectories,  ending with "/",  and of objects
+        with no further "/" in the key after `s3_prefix`.
+    """
+    log.verbose("s3.list_directory", s3_prefix, max_objects)
+    client, bucket_name, prefix = _s3_setup(client, s3_prefix)
+    paginator = client.get_paginator("list_objects_v2")
+    config = {"MaxItems": max_objects, "PageSize": 1000}
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix, Delimiter="/", PaginationConfig=config):
+        for result in page.get("CommonPrefixes", []):
+            yield "s3://" + bucket_name + "/" + result["Prefix"]
+        for result in page.get("Contents", []):
+            if result["Key"]:
+                yield "s3://" + bucket_name + "/" + result["Key"]
+
+
 def get_object(s3_filepath, client=None, encoding="utf-8"):
     """Given `s3_dirpath_prefix` s3 bucket and prefix to list, return the full
     s3 paths of every object in the associated bucket which match the prefix.
@@ -297,16 +447,164 @@ def get_object(s3_filepath, client=None, encoding="utf-8"):
     return binary
 
 
-def put_object(string, s3_filepath, encoding="utf-8", client=None):
+def get_object_if_changed(s3_filepath, etag=None, client=None, encoding="utf-8"):
+    """Fetch the object at `s3_filepath` unless its ETag still matches `etag`,
+    in which case S3 replies 304 Not Modified and no contents are transferred.
+
+    Parameters
+    ----------
+    s3_filepath : str
+        Full s3 path to object to fetch
+    etag : str
+        ETag of a previously fetched copy,  or None to fetch unconditionally.
+    client : get_default_client()
+        Optional boto3 s3 client to re-use for multiple files.
+    encoding : str
+        Encoding to decode object contents with.  Default 'utf-8'.
+
+    Returns
+    ------
+    (object contents or None if unchanged,  current ETag) : (str or bytes or None, str)
+    """
+    log.verbose("s3.get_object_if_changed", s3_filepath, etag)
+    client, bucket_name, object_name = _s3_setup(client, s3_filepath)
+    params = dict(Bucket=bucket_name, Key=object_name)
+    if etag is not None:
+        params["IfNoneMatch"] = etag
+    try:
+        response = client.get_object(**params)
+    except ClientError as exc:
+        if exc.response.get("Error", {}).get("Code") in ("304", "NotModified"):
+            return None, etag
+        raise
+    binary = response["Body"].read()
+    if encoding:
+        binary = binary.decode(encoding)
+    return binary, response["ETag"]
+
+
+def exists(s3_filepath, client=None):
+    """Return True IFF the object at `s3_filepath` exists,  determined by a HeadObject
+    request which transfers no object contents.
+
+    Parameters
+    ----------
+    s3_filepath : str
+        Full s3 path to object to check,  including the bucket prefix,
+        e.g. s3://hstdp/inputs/j8cb010b0.tar.gz
+    client : get_default_client()
+        Optional boto3 s3 client to re-use for multiple files.
+
+    Returns
+    ------
+    bool
+    """
+    log.verbose("s3.exists", s3_filepath)
+    client, bucket_name, object_name = _s3_setup(client, s3_filepath)
+    try:
+        client.head_object(Bucket=bucket_name, Key=object_name)
+    except ClientError as exc:
+        if exc.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+    return True
+
+
+def exists_many(s3_filepaths, client=None, max_workers=MAX_PROBE_THREADS):
+    """Given iterable `s3_filepaths`,  determine which objects exist using one
+    HeadObject request per path issued concurrently on `max_workers` threads.
+
+    Parameters
+    ----------
+    s3_filepaths : iterable (str)
+        Full s3 paths of objects to check,  including the bucket prefix.
+    client : get_default_client()
+        Optional boto3 s3 client shared by every worker thread.   If omitted,  concurrent
+        checks use clients borrowed from the pool,  see borrow_client().
+    max_workers : int
+        Number of concurrent HeadObject requests,  1 checks serially.
+
+    Returns
+    ------
+    { s3_filepath : bool, ... }
+    """
+    log.verbose("s3.exists_many", max_workers)
+    shared = client is not None or max_workers <= 1
+    client = client or get_default_client()
+
+    def probe(s3_filepath):
+        if shared:
+            return s3_filepath, exists(s3_filepath, client=client)
+        with borrow_client() as thread_client:
+            return s3_filepath, exists(s3_filepath, client=thread_client)
+
+    return dict(timing.pipeline(probe, s3_filepaths, max_workers))
+
+
+def put_object(string, s3_filepath, encoding="utf-8", client=None, if_match=None, if_none_match=None):
     """Given `string` to upload, copy it to `s3_filepath` which effectively
     describes the full path of a file in S3 storage defining both bucket
     and object key.
+
+    If `if_match` is an ETag the put only succeeds if the object still has that
+    ETag.   If `if_none_match` is "*" the put only succeeds if the object does not
+    exist.   Otherwise S3 raises a ClientError,  see is_precondition_failure().
+
+    Returns the ETag of the new object.
     """
     log.verbose("s3.put_object", s3_filepath, "length", len(string))
     client, bucket_name, object_name = _s3_setup(client, s3_filepath)
     if encoding:
         string = string.encode(encoding)
-    client.put_object(Body=string, Bucket=bucket_name, Key=object_name)
+    params = dict(Body=string, Bucket=bucket_name, Key=object_name)
+    if if_match is not None:
+        params["IfMatch"] = if_match
+    if if_none_match is not None:
+        params["IfNoneMatch"] = if_none_match
+    return client.put_object(**params).get("ETag")
+
+
+def is_precondition_failure(exc):
+    """Return True IFF ClientError `exc` means a conditional put lost a race:  the
+    object changed (412),  was concurrently written (409),  or no longer exists.
+    """
+    code = exc.response.get("Error", {}).get("Code")
+    return code in ("PreconditionFailed", "412", "ConditionalRequestConflict", "409", "NoSuchKey", "404")
+
+
+def put_objects(strings, encoding="utf-8", client=None, max_workers=1, stop=None):
+    """Given dict `strings` mapping full s3 paths to the string to upload to each,
+    put every object using `max_workers` concurrent requests on the shared `client`.
+
+    Parameters
+    ----------
+    strings : dict (str: str or bytes)
+        {s3_filepath: contents, ...}
+    encoding : str
+        Encoding for contents,  None to upload bytes directly.
+    client : get_default_client()
+        Optional boto3 s3 client shared by every worker thread.   Size its
+        max_pool_connections to `max_workers` to avoid discarded connections.
+    max_workers : int
+        Number of concurrent PutObject requests,  1 puts serially.
+    stop : threading.Event
+        Optional event which,  once set,  causes remaining puts to be skipped.
+
+    Returns
+    ------
+    count : int
+        Number of objects actually put.
+    """
+    log.verbose("s3.put_objects", len(strings), max_workers)
+    client = client or get_default_client()
+
+    def put(item):
+        if stop is not None and stop.is_set():
+            return 0
+        put_object(item[1], item[0], encoding=encoding, client=client)
+        return 1
+
+    return sum(timing.pipeline(put, strings.items(), max_workers))
 
 
 def delete_object(s3_filepath, client=None):
@@ -328,20 +626,177 @@ def delete_object(s3_filepath, client=None):
     return client.delete_object(Bucket=bucket_name, Key=object_name)
 
 
+def delete_objects(s3_filepaths, client=None, max_workers=1):
+    """Given iterable `s3_filepaths`,  delete the corresponding objects issuing one
+    DeleteObjects request for every 1000 keys of the same bucket.
+
+    Parameters
+    ----------
+    s3_filepaths : iterable (str)
+        Full s3 paths of objects to delete,  including the bucket prefix,
+        e.g. s3://hstdp/batch-1-2020-06-11T19-35-51/acs/j8cb010b0/process.txt
+        Consumed lazily so a listing generator can be passed directly.
+    client : get_default_client()
+        Optional boto3 s3 client used for every request,  otherwise each worker
+        thread borrows a pooled client.
+    max_workers : int
+        Number of concurrent DeleteObjects requests,  1 deletes serially.
+
+    Returns
+    ------
+    errors : list (dict)
+        S3 error entries {"Key": ..., "Code": ..., "Message": ...} for keys which
+        could not be deleted,  empty if every key was deleted.
+    """
+    log.verbose("s3.delete_objects", max_workers)
+    shared = client is not None or max_workers <= 1
+    client = client or get_default_client()
+
+    def delete_chunk(chunk):
+        bucket_name, keys = chunk
+        if shared:
+            return _delete_chunk(client, bucket_name, keys)
+        with borrow_client() as thread_client:
+            return _delete_chunk(thread_client, bucket_name, keys)
+
+    errors = []
+    for chunk_errors in timing.pipeline(delete_chunk, _chunk_keys(s3_filepaths), max_workers):
+        errors.extend(chunk_errors)
+    return errors
+
+
+def _chunk_keys(s3_filepaths):
+    """Group `s3_filepaths` into (bucket_name, [key, ...]) chunks of at most
+    MAX_DELETE_KEYS keys from the same bucket.
+    """
+    chunk_bucket, keys = None, []
+    for s3_filepath in s3_filepaths:
+        bucket_name, object_name = s3_split_path(s3_filepath)
+        if keys and (bucket_name != chunk_bucket or len(keys) >= MAX_DELETE_KEYS):
+            yield chunk_bucket, keys
+            keys = []
+        chunk_bucket = bucket_name
+        keys.append(object_name)
+    if keys:
+        yield chunk_bucket, keys
+
+
+def _delete_chunk(client, bucket_name, keys):
+    """Delete `keys` from `bucket_name` with a single DeleteObjects request,
+    logging and returning any per-key errors.
+    """
+    log.verbose("s3.delete_objects chunk", bucket_name, len(keys), "keys")
+    response = client.delete_objects(
+        Bucket=bucket_name, Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True}
+    )
+    errors = response.get("Errors", [])
+    if errors:
+        log.error(
+            "s3.delete_objects failed for", len(errors), "of", len(keys), "keys in", bucket_name, "first:", errors[0]
+        )
+    return errors
+
+
 def parse_s3_event(event):
     """Decode the S3 `event` message generated by message write operations.
 
     See S3 docs: https://docs.aws.amazon.com/AmazonS3/latest/userguide/notification-content-structure.html
     See also the callers of this function.
 
+    Only the first record of `event` is decoded,  see parse_s3_events() for all of them.
+    Raises ValueError if `event` has no S3 records.
+
     Returns bucket_name, dataset
     """
     log.verbose("S3 Event:", event)
+    for record in iter_s3_records(event):
+        return parse_s3_record(record)
+    raise ValueError(f"S3 event has no S3 notification records: {event}")
+
 
-    message = event["Records"][0]["s3"]["object"]["key"]
-    bucket_name = event["Records"][0]["s3"]["bucket"]["name"]
-    dataset = "-".join(message.split("-")[1:])
+def parse_s3_events(event):
+    """Decode every S3 notification record of `event`,  which is either an S3 event or an
+    SQS event whose record bodies are S3 events.
 
-    log.info(f"received {message} : bucket = {bucket_name}, dataset = {dataset}")
+    Yields bucket_name, dataset  for each record as parse_s3_event() does for one.
+    """
+    log.verbose("S3 Event:", event)
+    for record in iter_s3_records(event):
+        yield parse_s3_record(record)
 
-    return "s3://" + bucket_name, dataset
+
+def iter_s3_records(event):
+    """Yield the S3 notification records of `event`,  unwrapping the bodies of SQS records.
+    Bodies without records,  e.g. the s3:TestEvent sent when a notification is configured,
+    yield nothing.
+    """
+    for record in event.get("Records", []):
+        if "body" in record:  # SQS message wrapping an S3 notification
+            yield from iter_s3_records(json.loads(record["body"]))
+        else:
+            yield record
+
+
+def parse_s3_record(record):
+    """Return "s3://" + bucket_name, dataset  for S3 notification `record` of a message key
+    like messages/<type>-<dataset>.
+    """
+    bucket_name, key = parse_s3_record_key(record)
+    dataset = "-".join(key.split("-")[1:])
+    log.info(f"received {key} : bucket = {bucket_name}, dataset = {dataset}")
+    return bucket_name, dataset
+
+
+def parse_s3_record_key(record):
+    """Return "s3://" + bucket_name, key  for S3 notification `record`,  decoding the URL
+    quoting S3 applies to keys in notifications.
+    """
+    key = urllib.parse.unquote_plus(record["s3"]["object"]["key"], encoding="utf-8")
+    return "s3://" + record["s3"]["bucket"]["name"], key
+
+
+class S3EventFailed(RuntimeError):
+    """Handling several records of a direct S3 event failed,  the `errors` attribute lists
+    (record key,  exception) for each failed record.
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(f"Failed handling {len(errors)} S3 event records,  first: {errors[0]}")
+
+
+def handle_s3_events(event, handler, parse=parse_s3_record):
+    """Call handler(*parse(record)) for every S3 notification record of `event` so one lambda
+    invocation can drain a burst of messages using the clients of one warm container.
+
+    Every record of a direct S3 event is handled even if some fail,  then the exception of
+    a single failed record is re-raised,  or S3EventFailed if several failed.   For an SQS
+    event the exception of each failing SQS record is logged and its messageId reported in
+    the returned SQS partial batch response so only failed records are redelivered.   Returns
+    None for S3 events.
+    """
+    log.verbose("S3 Event:", event)
+    records = event.get("Records", [])
+    if not any("body" in record for record in records):
+        errors = []
+        for record in iter_s3_records(event):
+            try:
+                handler(*parse(record))
+            except Exception as exc:
+                key = record.get("s3", {}).get("object", {}).get("key")
+                log.error("Failed handling S3 record", key, ":", repr(exc))
+                errors.append((key, exc))
+        if len(errors) == 1:
+            raise errors[0][1]
+        elif errors:
+            raise S3EventFailed(errors) from errors[0][1]
+        return None
+    failures = []
+    for record in records:
+        try:
+            for s3_record in iter_s3_records(dict(Records=[record])):
+                handler(*parse(s3_record))
+        except Exception as exc:
+            log.error("Failed handling SQS record", record.get("messageId"), ":", repr(exc))
+            failures.append({"itemIdentifier": record["messageId"]})
+    return {"batchItemFailures": failures}
@@ -1,15 +1,70 @@
-"""This module supports submitting job plan tuples to AWS Batch for processing."""
+"""This module supports submitting job plan tuples to AWS Batch for processing.
+
+Bulk submissions are made concurrently by submit_many() on up to SUBMIT_THREADS
+threads sharing one Batch client.   Calls are paced by a token bucket allowing
+SUBMIT_RATE submissions per second so that throughput for 10^4-10^5 plans is
+bounded by the Batch API quota rather than the latency of each call.   Throttled
+submissions are retried with exponential backoff.
+
+For mass placements,  submit_arrays() groups plans sharing a job queue and job
+definition into Batch array jobs,  replacing thousands of SubmitJob calls with one
+call per group.   The dataset of each array child is recorded in a manifest in the
+control/ directory named by the array job.   submit_packed() instead bin-packs
+datasets predicted to be short into jobs which process several datasets in turn,
+paying container start and CRDS setup once per job rather than once per dataset.
+Both record each dataset's control metadata and submit- message as lambda_submit does.
+
+Array and packed submission are only available from the command line,  e.g.
+python -m calcloud.submit --array-size or --pack-seconds.   The lambdas triggered by
+placed- and rescue- messages submit every dataset as a single job.
+"""
 
 import sys
 import ast
+import json
+import time
+import random
+import uuid
+import argparse
+import functools
 
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
 
 from . import plan
+from . import io
+from . import batch
 from . import common
+from . import timing
+from . import log
+from . import s3
+
+SUBMIT_THREADS = 16  # concurrent SubmitJob calls
+
+SUBMIT_RATE = 40  # average SubmitJob calls per second,  below the Batch account quota
+
+SUBMIT_RETRIES = 8  # attempts per plan when Batch throttles submissions
+
+ARRAY_MIN_SIZE = 2  # AWS Batch minimum array size,  smaller groups are submitted as single jobs
+
+THROTTLE_CODES = ("TooManyRequestsException", "ThrottlingException", "Throttling", "RequestLimitExceeded")
+
+_CLIENTS = {}
+
+
+def get_client(max_workers=1):
+    """Return a Batch client with a connection pool large enough for `max_workers`
+    threads,  allocated once per pool size.
+    """
+    pool_size = max(10, max_workers)
+    if pool_size not in _CLIENTS:
+        config = common.retry_config.merge(Config(max_pool_connections=pool_size))
+        _CLIENTS[pool_size] = boto3.client("batch", config=config)
+    return _CLIENTS[pool_size]
 
 
-def submit_job(plan_tuple):
+def submit_job(plan_tuple, client=None):
     """Given a job description `plan_tuple` from the planner,  submit a job to AWS batch."""
     info = plan.Plan(*plan_tuple)
     job = {
@@ -25,26 +80,356 @@ def submit_job(plan_tuple):
         },
         "timeout": {"attemptDurationSeconds": info.max_seconds},
     }
-    client = boto3.client("batch", config=common.retry_config)
+    client = client or get_client()
     return client.submit_job(**job)
 
 
-def submit_plans(plan_file):
+def record_submission(metadata, job_plan, job_id):
+    """Record in control `metadata` that `job_plan` was submitted as Batch job `job_id`,
+    with the predicted and actual memory bins for plan.build_oom_stats(),  dropping the
+    failure of any previous attempt which would otherwise be read as this attempt's.
+    """
+    info = plan.Plan(*job_plan)
+    metadata["job_id"] = job_id
+    metadata["initial_bin"] = info.initial_modeled_bin
+    metadata["job_bin"] = plan.get_job_bin(info)
+    for key in ["exit_code", "exit_reason", "status_reason", "container_reason"]:
+        metadata.pop(key, None)
+
+
+def read_plans(plan_file):
+    """Generate the job plan tuples defined one-per-line in `plan_file`,  or stdin
+    for "-",  reading one line at a time.   Blank lines are skipped.
+    """
+    f = sys.stdin if plan_file == "-" else open(plan_file)
+    try:
+        for line in f:
+            if line.strip():
+                yield plan.Plan(*ast.literal_eval(line))
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def _submit_with_retries(func, limiter, retries):
+    """Call `func` after acquiring a token from `limiter`,  retrying up to `retries`
+    attempts with jittered exponential backoff while Batch throttles the call.
+
+    Returns (response or None,  error str or None,  attempts)
+    """
+    for attempt in range(1, retries + 1):
+        limiter.acquire()
+        try:
+            return func(), None, attempt
+        except ClientError as exc:
+            code = exc.response.get("Error", {}).get("Code")
+            if code not in THROTTLE_CODES or attempt == retries:
+                return None, f"{code}: {exc}", attempt
+            time.sleep(min(2**attempt * 0.1, 10) * random.uniform(0.5, 1.0))
+        except Exception as exc:
+            return None, repr(exc), attempt
+
+
+def submit_many(plans, max_workers=SUBMIT_THREADS, rate=SUBMIT_RATE, retries=SUBMIT_RETRIES, client=None):
+    """Submit every plan tuple in iterable `plans` using `max_workers` threads sharing
+    one Batch client,  starting at most `rate` submissions per second on average.
+
+    Plans are consumed as they are submitted so `plans` can stream from read_plans().
+
+    Generates one result dict per plan in completion order:
+
+    {"dataset": ..., "job_name": ..., "job_queue": ..., "job_id": ... or None,
+     "status": "submitted" or "error", "attempts": ..., "seconds": ..., "error": ...}
+    """
+    client = client or get_client(max_workers)
+    limiter = timing.TokenBucket(rate)
+
+    def submit(plan_tuple):
+        info = plan.Plan(*plan_tuple)
+        started = time.monotonic()
+        response, error, attempts = _submit_with_retries(lambda: submit_job(info, client=client), limiter, retries)
+        result = dict(dataset=info.dataset, job_name=info.job_name, job_queue=info.job_queue, job_id=None)
+        if error is None:
+            result.update(status="submitted", job_id=response["jobId"])
+        else:
+            result.update(status="error", error=error)
+        result.update(attempts=attempts, seconds=round(time.monotonic() - started, 3))
+        return result
+
+    yield from timing.pipeline(submit, plans, max_workers)
+
+
+def _manifest_job(plans, job_name, comm=None, **job):
+    """Define one Batch job `job_name` for multi-dataset group `plans` sharing a job environment.
+
+    The datasets are recorded in order in a manifest stored in the control directory named
+    by the job.   The job runs the plan command with the dataset argument replaced by
+    "@" + the manifest S3 path and the output URI replaced by the outputs root.   Additional
+    SubmitJob parameters are given by `job`.
+
+    The manifest is written once here so that retrying the SubmitJob call for throttling
+    re-uses it rather than leaving a manifest behind for every attempt.
+
+    Returns (IoBundle of the manifest,  SubmitJob parameters dict)
+    """
+    plans = [plan.Plan(*p) for p in plans]
+    first = plans[0]
+    output_root = first.s3_output_uri.rsplit("/", 1)[0]
+    comm = comm or io.get_io_bundle(output_root.rsplit("/", 1)[0])
+    manifest = dict(
+        job_queue=first.job_queue,
+        job_definition=first.job_definition,
+        datasets=[p.dataset for p in plans],
+        plans=[list(p) for p in plans],
+    )
+    comm.control.put_array_manifest(job_name, manifest)
+    job.update(
+        {
+            "jobName": job_name,
+            "jobQueue": first.job_queue,
+            "jobDefinition": first.job_definition,
+            "containerOverrides": {
+                "command": [
+                    first.command,
+                    "@" + comm.control.array_manifest_path(job_name),
+                    first.input_path,
+                    output_root,
+                    first.crds_config,
+                ],
+            },
+        }
+    )
+    return comm, job
+
+
+def array_job(plans, comm=None):
+    """Define `plans`,  a group from plan.group_plans(),  as one Batch array job with
+    one child per plan.   The timeout is the longest of the plans.
+
+    Each child resolves its dataset from the manifest,  see _manifest_job(),  using
+    the AWS_BATCH_JOB_ARRAY_INDEX Batch defines.
+
+    Returns (IoBundle of the manifest,  SubmitJob parameters dict)
+    """
+    return _manifest_job(
+        plans,
+        batch.ARRAY_NAME_PREFIX + uuid.uuid4().hex[:16],
+        comm,
+        arrayProperties={"size": len(plans)},
+        timeout={"attemptDurationSeconds": max(plan.Plan(*p).max_seconds for p in plans)},
+    )
+
+
+def pack_job(plans, comm=None):
+    """Define `plans`,  a group from plan.pack_plans(),  as one Batch job which processes
+    every dataset of the manifest,  see _manifest_job(),  in order.   The timeout is
+    the total of the plans.
+
+    Returns (IoBundle of the manifest,  SubmitJob parameters dict)
+    """
+    return _manifest_job(
+        plans,
+        batch.PACK_NAME_PREFIX + uuid.uuid4().hex[:16],
+        comm,
+        timeout={"attemptDurationSeconds": sum(plan.Plan(*p).max_seconds for p in plans)},
+    )
+
+
+def submit_array_job(plans, client=None, comm=None):
+    """Submit `plans` as one Batch array job,  see array_job().
+
+    Returns (array job name,  submit_job() response)
+    """
+    comm, job = array_job(plans, comm)
+    return job["jobName"], (client or get_client()).submit_job(**job)
+
+
+def submit_pack_job(plans, client=None, comm=None):
+    """Submit `plans` as one packed Batch job,  see pack_job().
+
+    Returns (packed job name,  submit_job() response)
+    """
+    comm, job = pack_job(plans, comm)
+    return job["jobName"], (client or get_client()).submit_job(**job)
+
+
+def _submit_groups(groups, define_job, child_job_id, max_workers, rate, retries, client):
+    """Submit each group of two or more plans in `groups` as one job defined by `define_job`,
+    and the plans of smaller groups with submit_many(),  generating per-plan results.
+
+    define_job(group) writes the group manifest and returns (comm, SubmitJob parameters),
+    see array_job().   Only the SubmitJob call is retried so each group has one manifest,
+    which is deleted if the group cannot be submitted.
+
+    child_job_id(job_id, i) defines the job_id reported for plan i of a group submitted as `job_id`.
+    The control metadata and submit- message of each dataset of a submitted group are
+    written by _record_group().
+    """
+    limiter = timing.TokenBucket(rate)
+
+    def submit(group):
+        started = time.monotonic()
+        job_name = None
+        try:
+            comm, job = define_job(group)
+        except Exception as exc:
+            response, error, attempts = None, repr(exc), 0
+        else:
+            job_name = job["jobName"]
+            response, error, attempts = _submit_with_retries(lambda: client.submit_job(**job), limiter, retries)
+            if error is not None:
+                with log.trap_exception("Deleting manifest of unsubmitted job", job_name):
+                    comm.control.delete_array_manifest(job_name)
+            else:
+                _record_group(comm, group, [child_job_id(response["jobId"], i) for i in range(len(group))])
+        results = []
+        for i, info in enumerate(group):
+            result = dict(dataset=info.dataset, job_name=None, job_queue=info.job_queue, job_id=None, index=i)
+            if error is None:
+                result.update(status="submitted", job_name=job_name, job_id=child_job_id(response["jobId"], i))
+            else:
+                result.update(status="error", error=error)
+            result.update(attempts=attempts, seconds=round(time.monotonic() - started, 3))
+            results.append(result)
+        return results
+
+    multiples = [group for group in groups if len(group) >= ARRAY_MIN_SIZE]
+    singles = [group[0] for group in groups if len(group) < ARRAY_MIN_SIZE]
+    for results in timing.pipeline(submit, multiples, max_workers):
+        yield from results
+    yield from submit_many(singles, max_workers=max_workers, rate=rate, retries=retries, client=client)
+
+
+def _record_group(comm, group, job_ids, max_workers=s3.MAX_TRANSFER_THREADS):
+    """Write the control metadata and submit- message of each dataset of submitted `group`
+    as lambda_submit does for a single job,  recording plan i as Batch job `job_ids[i]`,  so
+    failure events,  rescue,  cancel,  and the blackboard find the group's datasets.
+    """
+
+    def record(item):
+        info, job_id = item
+        with log.trap_exception("Recording submission of", info.dataset, "as", job_id):
+            update = functools.partial(record_submission, job_plan=info, job_id=job_id)
+            comm.xdata.update(info.dataset, update, default=io.get_default_metadata())
+
+    list(timing.pipeline(record, zip(group, job_ids), max_workers))
+    datasets = [info.dataset for info in group]
+    with log.trap_exception("Sending submit messages for job", job_ids[0]):
+        comm.messages.delete([f"all-{dataset}" for dataset in datasets], check_exists=False, max_workers=max_workers)
+        comm.messages.put([f"submit-{dataset}" for dataset in datasets], max_workers=max_workers)
+
+
+def submit_arrays(
+    plans,
+    max_workers=SUBMIT_THREADS,
+    rate=SUBMIT_RATE,
+    retries=SUBMIT_RETRIES,
+    client=None,
+    max_size=plan.ARRAY_MAX_SIZE,
+):
+    """Like submit_many() but plans which can share a job environment are grouped into
+    Batch array jobs of up to `max_size` children,  one SubmitJob call per group,  see
+    array_job().   Plans which cannot be grouped are submitted individually.
+
+    All `plans` are read before submission begins.   Result dicts for array children
+    name the array job and have job_id <array job id>:<index>.
+    """
+    client = client or get_client(max_workers)
+    groups = plan.group_plans(plans, max(1, min(max_size, plan.ARRAY_MAX_SIZE)))
+    return _submit_groups(groups, array_job, lambda job_id, i: f"{job_id}:{i}", max_workers, rate, retries, client)
+
+
+def submit_packed(
+    plans,
+    max_workers=SUBMIT_THREADS,
+    rate=SUBMIT_RATE,
+    retries=SUBMIT_RETRIES,
+    client=None,
+    target_seconds=plan.PACK_TARGET_SECONDS,
+):
+    """Like submit_many() but small plans are bin-packed by plan.pack_plans() into jobs
+    running several datasets of up to `target_seconds` total,  see pack_job().
+
+    All `plans` are read before submission begins.   Result dicts for packed datasets
+    name the packed job and share its job_id.   Packing is only used by the command line,
+    rescues of packed datasets are submitted by lambda_submit as single jobs.
+    """
+    client = client or get_client(max_workers)
+    groups = plan.pack_plans(list(plans), target_seconds=target_seconds)
+    return _submit_groups(groups, pack_job, lambda job_id, i: job_id, max_workers, rate, retries, client)
+
+
+def submit_plans(
+    plan_file, max_workers=SUBMIT_THREADS, rate=SUBMIT_RATE, log_file=None, client=None, array_size=0, pack_seconds=0
+):
     """Given a file `plan_file` defining job plan tuples one-per-line,
-    submit each job and output the plan and submission response to stdout.
-    Plans are generated by the calcloud.plan module.
+    submit each job and output a JSON line describing each submission to
+    `log_file`,  default stdout.   Plans are generated by the calcloud.plan module.
+
+    If `array_size` is non-zero,  plans are grouped into array jobs of up to `array_size`
+    children using submit_arrays().   Otherwise if `pack_seconds` is non-zero,  small plans
+    are packed into multi-dataset jobs of up to `pack_seconds` using submit_packed().
+
+    Returns the number of plans which could not be submitted.
     """
-    if plan_file == "-":
-        f = sys.stdin
+    out = open(log_file, "w") if log_file else sys.stdout
+    failures = 0
+    if array_size:
+        results = submit_arrays(
+            read_plans(plan_file), max_workers=max_workers, rate=rate, client=client, max_size=array_size
+        )
+    elif pack_seconds:
+        results = submit_packed(
+            read_plans(plan_file), max_workers=max_workers, rate=rate, client=client, target_seconds=pack_seconds
+        )
     else:
-        f = open(plan_file)
-    for line in f.readlines():
-        job_plan = ast.literal_eval(line)
-        print(submit_job(job_plan))
+        results = submit_many(read_plans(plan_file), max_workers=max_workers, rate=rate, client=client)
+    try:
+        for result in results:
+            failures += result["status"] != "submitted"
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return failures
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Submit job plans generated by calcloud.plan to AWS Batch.")
+    parser.add_argument("plan_file", help="File of job plan tuples,  one per line,  or - for stdin.")
+    parser.add_argument(
+        "--threads", dest="threads", type=int, default=SUBMIT_THREADS, help="Number of concurrent submissions."
+    )
+    parser.add_argument(
+        "--rate", dest="rate", type=float, default=SUBMIT_RATE, help="Maximum average submissions per second."
+    )
+    parser.add_argument("--log", dest="log", default=None, help="JSON lines result log,  default stdout.")
+    grouping = parser.add_mutually_exclusive_group()
+    grouping.add_argument(
+        "--array-size",
+        dest="array_size",
+        type=int,
+        default=0,
+        help=f"Group plans into Batch array jobs of up to this many children,  at most {plan.ARRAY_MAX_SIZE}.",
+    )
+    grouping.add_argument(
+        "--pack-seconds",
+        dest="pack_seconds",
+        type=int,
+        default=0,
+        help=f"Pack plans with max_seconds <= {plan.PACK_SMALL_SECONDS} into jobs of up to this many seconds.",
+    )
+    parsed = parser.parse_args(args)
+    return submit_plans(
+        parsed.plan_file,
+        max_workers=parsed.threads,
+        rate=parsed.rate,
+        log_file=parsed.log,
+        array_size=parsed.array_size,
+        pack_seconds=parsed.pack_seconds,
+    )
 
 
 if __name__ == "__main__":
-    if len(sys.argv) == 2:
-        submit_plans(sys.argv[1])
-    else:
-        print("usage:  python -m calcloud.submit [<plan_file> | - ]", file=sys.stderr)
+    sys.exit(1 if main() else 0)
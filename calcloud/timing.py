@@ -5,6 +5,9 @@ rate metrics.
 from collections import Counter
 import datetime
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 from calcloud import log
 
@@ -109,6 +112,123 @@ class TimingStats:
 # ===================================================================
 
 
+class TokenBucket:
+    """Thread-safe token bucket limiting callers to `rate` acquisitions per second
+    on average,  allowing bursts of up to `burst` back-to-back acquisitions.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available and consume it.  Return seconds waited."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return waited
+                delay = (1.0 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+def pipeline(func, items, max_workers):
+    """Call `func` on each of iterable `items` using `max_workers` threads,  yielding each
+    result in order of completion.
+
+    Work is submitted as `items` is consumed so that producing items (e.g. paging through
+    an S3 listing or reading a plan file) overlaps with the work.   At most 2 * `max_workers`
+    calls are outstanding at any time,  bounding memory for very large inputs.   Callers
+    rate limit `func` itself,  e.g. with a TokenBucket shared by every call.
+
+    For `max_workers` <= 1 `func` is called serially in the calling thread.
+
+    >>> sorted(pipeline(lambda x: x * x, iter(range(5)), 3))
+    [0, 1, 4, 9, 16]
+    """
+    if max_workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = set()
+        for item in items:
+            pending.add(pool.submit(func, item))
+            if len(pending) >= 2 * max_workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in wait(pending).done:
+            yield future.result()
+
+
+# ===================================================================
+
+
+class LatencyHistogram:
+    """Thread-safe histogram of call latencies in power-of-2 millisecond buckets."""
+
+    def __init__(self, name="calls", output=None):
+        self.name = name
+        self.buckets = Counter()
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.lock = threading.Lock()
+        self.output = log.info if output is None else output
+
+    @staticmethod
+    def bucket(seconds):
+        """Return the upper bound in ms of the power-of-2 bucket holding `seconds`.
+
+        >>> LatencyHistogram.bucket(0.0005), LatencyHistogram.bucket(0.003), LatencyHistogram.bucket(0.25)
+        (1, 4, 256)
+        """
+        limit = 1
+        while limit < seconds * 1000:
+            limit *= 2
+        return limit
+
+    def record(self, seconds):
+        """Add one call which took `seconds` to the histogram."""
+        with self.lock:
+            self.buckets[self.bucket(seconds)] += 1
+            self.count += 1
+            self.total += seconds
+            self.maximum = max(self.maximum, seconds)
+
+    def timed(self, func, *args, **keys):
+        """Call func(*args, **keys),  record its latency,  and return its result."""
+        started = time.monotonic()
+        try:
+            return func(*args, **keys)
+        finally:
+            self.record(time.monotonic() - started)
+
+    def report(self):
+        """Output the call count,  mean and max latency,  and a line per bucket."""
+        if not self.count:
+            self.output(self.name, "latency:  no calls", eol="")
+            return
+        mean_ms = self.total / self.count * 1000
+        self.output(
+            self.name, f"latency:  {self.count} calls  mean {mean_ms:0.1f} ms  max {self.maximum*1000:0.1f} ms", eol=""
+        )
+        for limit in sorted(self.buckets):
+            self.output(self.name, f"  <= {limit:>6} ms: {self.buckets[limit]}", eol="")
+
+
+# ===================================================================
+
+
 def total_size(filepaths):
     """Return the total size of all files in `filepaths` as an integer."""
     return sum([os.stat(filename).st_size for filename in filepaths])
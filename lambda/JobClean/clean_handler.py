@@ -9,8 +9,11 @@ from calcloud import s3
 
 
 def lambda_handler(event, context):
-    bucket_name, dataset = s3.parse_s3_event(event)
+    return s3.handle_s3_events(event, clean)
 
+
+def clean(bucket_name, dataset):
+    """Handle the clean-`dataset` message written to `bucket_name`."""
     comm = io.get_io_bundle(bucket_name)
 
     if dataset == "all":
@@ -1,11 +1,19 @@
 """This lambda handles job terminations based on cancel-all or cancel-dataset
 S3 trigger messages.
 
-For cancel-all,  the lambda first determines the job id's of all jobs in a killable
-state,  then broadcasts the cancel-job_id form of single job kill message.
+For cancel-all,  the lambda lists the job id's and names of all jobs in a killable
+state and cancels them in bulk,  CANCEL_ALL_CHUNK jobs at a time:  the datasets of
+every job are determined from its listed name,  their control metadata and messages
+are updated concurrently with bulk message deletes,  and the jobs are terminated by a
+rate limited thread pool.   Progress and throughput are reported after each chunk.
+Jobs which could not be terminated,  or were not reached before the lambda neared
+its time limit,  are broadcast as the cancel-job_id form of single job kill message.
 
 For cancel-job_id,  the lambda determines the dataset from the job name,  kills
-the job,  and adjusts messages and the control file based on the dataset.
+the job,  and adjusts messages and the control file based on the dataset.   For
+array and packed jobs the datasets come from the job manifest:  one dataset for a
+child job_id of the form <array id>:<index>,  or every dataset for the parent
+array or packed job.
 
 For cancel-dataset,  the lambda determines the job_id from the control file,  kills
 the job,  and adjusts messages and the control file based on the dataset.
@@ -16,42 +24,55 @@ the job,  and adjusts messages and the control file based on the dataset.
 4. The terminated-dataset message is sent.
 
 The control metadata of the cancelled dataset is updated,  not deleted, in
-order to short circuit memory based retries on subsequent rescues.
+order to short circuit memory based retries on subsequent rescues.   Updates
+use If-Match so a racing batch event or rescue cannot overwrite the flag.
 """
 
+import os
+import time
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
 from calcloud import batch
 from calcloud import io
 from calcloud import s3
 from calcloud import log
 from calcloud import hst
+from calcloud import timing
+
+CANCEL_ALL_CHUNK = int(os.environ.get("CANCEL_ALL_CHUNK", 1000))  # jobs cancelled per bulk step
+
+CANCEL_ALL_MARGIN = 60  # seconds of lambda time reserved for broadcasting unfinished cancels
+
+CANCEL_THREADS = int(os.environ.get("CANCEL_THREADS", batch.TERMINATE_THREADS))
 
 
 def lambda_handler(event, context):
-    bucket_name, dataset = s3.parse_s3_event(event)
+    return s3.handle_s3_events(event, functools.partial(cancel, context=context))
+
 
+def cancel(bucket_name, dataset, context=None):
+    """Handle the cancel-`dataset` message written to `bucket_name`."""
     comm = io.get_io_bundle(bucket_name)
 
     if dataset == "all":
         # Delete exactly the cancel-all message,  not every dataset
         comm.messages.delete_literal("cancel-all")
-        # Cancel all jobs in a killable state broadcasting cancel over job_ids
-        job_ids = batch.get_job_ids()
-        comm.messages.broadcast("cancel", job_ids)
+        cancel_all(comm, bucket_name, _deadline(context))
     elif batch.JOB_ID_RE.match(dataset):
         job_id, dataset = dataset, "unknown"  # kill one job, dataset = job_id
         print("Cancelling job_id", job_id)
         comm.messages.delete_literal(f"cancel-{job_id}")
         with log.trap_exception("Handling messages + control for", job_id):
-            dataset = batch.get_job_name(job_id)
-            print("Handling messages and control for", dataset)
-            comm.messages.delete(f"all-{dataset}")
-            comm.messages.put(f"terminated-{dataset}", "cancel lambda " + bucket_name)
-            try:
-                metadata = comm.xdata.get(dataset)
-            except comm.xdata.client.exceptions.NoSuchKey:
-                metadata = dict(job_id=job_id, cancel_type="job_id")
-            metadata["terminated"] = True
-            comm.xdata.put(dataset, metadata)
+            for dataset in _job_datasets(comm, job_id):
+                print("Handling messages and control for", dataset)
+                comm.messages.delete(f"all-{dataset}")
+                comm.messages.put(f"terminated-{dataset}", "cancel lambda " + bucket_name)
+                comm.xdata.update(
+                    dataset,
+                    lambda metadata: metadata.update(terminated=True),
+                    default=dict(job_id=job_id, cancel_type="job_id"),
+                )
         # Do last so terminate flag is set if possible.
         print("Terminating", job_id)
         batch.terminate_job(job_id, "Operator cancelled")
@@ -59,13 +80,116 @@ def lambda_handler(event, context):
         print("Cancelling dataset", dataset)
         comm.messages.delete(f"all-{dataset}")
         comm.messages.put(f"terminated-{dataset}", "cancel lambda " + bucket_name)
-        metadata = comm.xdata.get(dataset)
-        metadata["terminated"] = True
-        metadata["cancel_type"] = "dataset"
-        comm.xdata.put(dataset, metadata)
-        job_id = metadata["job_id"]
+        job_id = comm.xdata.update(dataset, _terminate_dataset)
         with log.trap_exception("Terminating", job_id):
             print("Terminating", job_id)
             batch.terminate_job(job_id, "Operator cancelled")
     else:
         raise ValueError("Bad cancel ID", dataset)
+
+
+def _deadline(context):
+    """Return the time.time() after which cancel-all should stop terminating jobs itself,
+    or None if lambda `context` does not define the remaining time.
+    """
+    if not hasattr(context, "get_remaining_time_in_millis"):
+        return None
+    return time.time() + context.get_remaining_time_in_millis() / 1000 - CANCEL_ALL_MARGIN
+
+
+def cancel_all(comm, bucket_name, deadline=None):
+    """Cancel every job in a killable state on the queues defined by JOBQUEUES in chunks
+    of CANCEL_ALL_CHUNK jobs,  broadcasting cancel-job_id for the jobs which failed or
+    were not reached by time.time() `deadline`.
+
+    Returns the list of broadcast job_ids.
+    """
+    jobs = [
+        (job["jobId"].replace("-", "_"), job["jobName"])
+        for job in batch.iter_jobs(batch.get_queues(), batch.KILL_STATUSES, formatted=False)
+    ]
+    print("Cancelling", len(jobs), "jobs in a killable state.")
+    rate_limiter = timing.TokenBucket(batch.TERMINATE_RATE)
+    client = batch.get_terminate_client(CANCEL_THREADS)
+    start, unfinished = time.time(), []
+    for i in range(0, len(jobs), CANCEL_ALL_CHUNK):
+        if deadline is not None and time.time() > deadline:
+            print("Out of time after cancelling", i, "of", len(jobs), "jobs.")
+            unfinished.extend(job_id for job_id, _job_name in jobs[i:])
+            break
+        chunk = jobs[i : i + CANCEL_ALL_CHUNK]
+        unfinished.extend(_cancel_jobs(comm, bucket_name, chunk, rate_limiter, client))
+        done, elapsed = i + len(chunk), time.time() - start
+        print(
+            f"Cancelled {done} of {len(jobs)} jobs in {elapsed:.1f} seconds, "
+            f"{done / max(elapsed, 1e-3):.1f} jobs/sec, {len(unfinished)} failed."
+        )
+    if unfinished:
+        print("Broadcasting cancel for", len(unfinished), "unfinished jobs.")
+        comm.messages.broadcast("cancel", unfinished)
+    return unfinished
+
+
+def _cancel_jobs(comm, bucket_name, jobs, rate_limiter, client):
+    """Cancel `jobs`,  a list of (job_id, job_name),  handling the messages and control
+    metadata of all their datasets concurrently before terminating the jobs.
+
+    Returns the job_ids which could not be terminated.
+    """
+
+    def datasets_of(job):
+        job_id, job_name = job
+        with log.trap_exception("Determining datasets for", job_id):
+            return [(job_id, dataset) for dataset in _job_datasets(comm, job_id, job_name)]
+        return []
+
+    def mark_terminated(job_dataset):
+        job_id, dataset = job_dataset
+        with log.trap_exception("Handling control for", dataset):
+            comm.xdata.update(
+                dataset,
+                lambda metadata: metadata.update(terminated=True),
+                default=dict(job_id=job_id, cancel_type="job_id"),
+            )
+
+    with ThreadPoolExecutor(max_workers=CANCEL_THREADS) as pool:
+        job_datasets = [pair for pairs in pool.map(datasets_of, jobs) for pair in pairs]
+        with log.trap_exception(f"Handling messages for {len(job_datasets)} datasets"):
+            datasets = [dataset for _job_id, dataset in job_datasets]
+            comm.messages.delete(
+                [f"all-{dataset}" for dataset in datasets], check_exists=False, max_workers=CANCEL_THREADS
+            )
+            comm.messages.put(
+                {f"terminated-{dataset}": "cancel lambda " + bucket_name for dataset in datasets},
+                max_workers=CANCEL_THREADS,
+            )
+        list(pool.map(mark_terminated, job_datasets))
+    # Do last so terminate flag is set if possible.
+    failures = batch.terminate_jobs(
+        [job_id for job_id, _job_name in jobs], "Operator cancelled", CANCEL_THREADS, rate_limiter, client
+    )
+    for job_id, error in failures.items():
+        print("Failed terminating", job_id, ":", error)
+    return list(failures)
+
+
+def _job_datasets(comm, job_id, job_name=None):
+    """Return the datasets processed by Batch job `job_id`:  the job name of a single
+    dataset job,  the manifest dataset of an array child <array id>:<index>,  or every
+    manifest dataset of an array parent or packed job.   `job_name` is looked up
+    if not specified.
+    """
+    job_name = job_name or batch.get_job_name(job_id)
+    if not batch.is_manifest_name(job_name):
+        return [job_name]
+    _parent, index = batch.split_job_id(job_id)
+    if index is None:
+        return comm.control.get_array_manifest(job_name)["datasets"]
+    return [comm.control.get_array_dataset(job_name, index)]
+
+
+def _terminate_dataset(metadata):
+    """Mark control `metadata` as terminated by cancel-dataset and return its job_id."""
+    metadata["terminated"] = True
+    metadata["cancel_type"] = "dataset"
+    return metadata["job_id"]
@@ -5,18 +5,38 @@
 # 4 - return preds as json to parent lambda function
 """
 
+import os
+import hashlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
 import boto3
 import numpy as np
-from sklearn.preprocessing import PowerTransformer
-import tensorflow as tf
 from botocore.config import Config
 import json
 
+try:
+    from calcloud import features as feature_encoder
+except ImportError:  # JobPredict image,  calcloud/features.py is copied next to this module
+    import features as feature_encoder
+
 # mitigation of potential API rate restrictions (esp for Batch API)
 retry_config = Config(retries={"max_attempts": 5, "mode": "standard"})
-s3 = boto3.resource("s3", config=retry_config)
 client = boto3.client("s3", config=retry_config)
 
+MODEL_DIR = os.environ.get("MODEL_DIR", "./models")
+
+# "numpy" runs models exported to <model>.npz without importing TensorFlow,  "keras" loads the SavedModels
+# and requires TensorFlow,  installed in the image only when built with --build-arg MODEL_ENGINE=keras
+MODEL_ENGINE = os.environ.get("MODEL_ENGINE", "numpy")
+
+FETCH_THREADS = int(os.environ.get("PREDICT_FETCH_THREADS", 16))  # concurrent feature file downloads per batch
+
+Models = namedtuple("Models", ["clf", "mem_reg", "wall_reg", "pt_data"])
+
+# models loaded once per container,  reloaded when the signature of their directory changes
+_MODEL_CACHE = {"signature": None, "models": None}
+
 
 def load_pt_data(pt_file):
     with open(pt_file, "r") as j:
@@ -26,10 +46,111 @@ def load_pt_data(pt_file):
 
 def get_model(model_path):
     """Loads pretrained Keras functional model"""
+    try:
+        import tensorflow as tf  # deferred,  only needed when MODEL_ENGINE is "keras"
+    except ImportError as exc:
+        raise ImportError(
+            "MODEL_ENGINE=keras requires TensorFlow,  build the JobPredict image with --build-arg MODEL_ENGINE=keras."
+        ) from exc
+
     model = tf.keras.models.load_model(model_path)
     return model
 
 
+def softmax(x):
+    """Row-wise softmax of 2D array `x`."""
+    e = np.exp(x - np.max(x, axis=-1, keepdims=True))
+    return e / np.sum(e, axis=-1, keepdims=True)
+
+
+class DenseModel:
+    """NumPy-only forward pass of a stack of Dense layers exported by modeling.train.export_npz(),
+    computed in float32 like Keras so predictions match the SavedModel within round-off.
+    """
+
+    activation_functions = {
+        "relu": lambda x: np.maximum(x, 0),
+        "linear": lambda x: x,
+        "softmax": softmax,
+    }
+
+    def __init__(self, npz_path):
+        with np.load(npz_path, allow_pickle=False) as npz:
+            self.layers = [
+                (npz[f"W{i}"], npz[f"b{i}"], self.activation_functions[str(activation)])
+                for i, activation in enumerate(npz["activations"])
+            ]
+
+    def predict(self, data):
+        """Return the model outputs for the N x 9 input array `data` as an N x outputs float32 array."""
+        x = np.asarray(data, dtype=np.float32).reshape(-1, self.layers[0][0].shape[0])
+        for W, b, activation in self.layers:
+            x = activation(x @ W + b)
+        return x
+
+
+def get_dense_model(model_path):
+    """Loads pretrained model weights exported to `model_path`.npz for the NumPy engine."""
+    return DenseModel(model_path + ".npz")
+
+
+def yeo_johnson(x, lmbda):
+    """Return the Yeo-Johnson transform of array `x` for power `lmbda`,  as computed by
+    sklearn.preprocessing.PowerTransformer(standardize=False).transform().
+    """
+    x = np.asarray(x, dtype=float)
+    out = np.zeros_like(x)
+    pos = x >= 0
+    eps = np.spacing(1.0)
+    if abs(lmbda) < eps:
+        out[pos] = np.log1p(x[pos])
+    else:
+        out[pos] = (np.power(x[pos] + 1, lmbda) - 1) / lmbda
+    if abs(lmbda - 2) > eps:
+        out[~pos] = -(np.power(-x[~pos] + 1, 2 - lmbda) - 1) / (2 - lmbda)
+    else:
+        out[~pos] = -np.log1p(-x[~pos])
+    return out
+
+
+def model_dir_signature(model_dir):
+    """Return a hash of the relative path, size, and mtime of every file under `model_dir`."""
+    sig = hashlib.sha1(usedforsecurity=False)
+    for root, dirs, files in os.walk(model_dir):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            sig.update(f"{os.path.relpath(path, model_dir)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return sig.hexdigest()
+
+
+def get_models(model_dir=None):
+    """Return the Models loaded from `model_dir` (default MODEL_DIR),  loading them on first
+    use and afterwards only if the files under `model_dir` have changed.   Warm invocations
+    of the lambda re-use the models loaded by the first invocation in the container.
+    """
+    model_dir = model_dir or MODEL_DIR
+    signature = (model_dir, MODEL_ENGINE, model_dir_signature(model_dir))
+    if _MODEL_CACHE["signature"] != signature:
+        print(f"Loading {MODEL_ENGINE} models from {model_dir}")
+        loader = get_dense_model if MODEL_ENGINE == "numpy" else get_model
+        _MODEL_CACHE["models"] = Models(
+            clf=loader(os.path.join(model_dir, "mem_clf")),
+            mem_reg=loader(os.path.join(model_dir, "mem_reg")),
+            wall_reg=loader(os.path.join(model_dir, "wall_reg")),
+            pt_data=load_pt_data(os.path.join(model_dir, "pt_transform")),
+        )
+        _MODEL_CACHE["signature"] = signature
+    return _MODEL_CACHE["models"]
+
+
+def invalidate_models():
+    """Discard any cached models so the next get_models() reloads them."""
+    _MODEL_CACHE["signature"] = None
+    _MODEL_CACHE["models"] = None
+
+
 def classifier(model, data):
     """Returns class prediction"""
     pred_proba = model.predict(data)
@@ -43,6 +164,30 @@ def regressor(model, data):
     return pred
 
 
+def import_features(bucket_name, key):
+    """Return the key=value dict of job metadata in feature file `key` of `bucket_name`.
+
+    Uses the thread safe S3 client so feature files for a batch can be fetched concurrently.
+    """
+    body = client.get_object(Bucket=bucket_name, Key=key)["Body"].read()
+    return feature_encoder.parse_features(body)
+
+
+def transform(inputs, pt_data):
+    """Apply the yeo-johnson power transform and normalization to columns 0 and 1 (n_files, total_mb)
+    of the N x 9 feature array `inputs` using the lambdas, means and standard deviations in `pt_data`.
+
+    Returns: N x 9 float array of X inputs for generating predictions
+    """
+    inputs = np.asarray(inputs).reshape(-1, 9)
+    files = yeo_johnson(inputs[:, 0], pt_data["f_lambda"])
+    size = yeo_johnson(inputs[:, 1], pt_data["s_lambda"])
+    # normalization (zero mean, unit variance)
+    x_files = np.round(((files - pt_data["f_mean"]) / pt_data["f_sigma"]), 5)
+    x_size = np.round(((size - pt_data["s_mean"]) / pt_data["s_sigma"]), 5)
+    return np.column_stack([x_files, x_size, inputs[:, 2:]]).astype(float)
+
+
 class Preprocess:
     def __init__(self, ipppssoot, bucket_name, key):
         self.ipppssoot = ipppssoot
@@ -53,99 +198,46 @@ class Preprocess:
 
     def import_data(self):
         """import job metadata file from s3 bucket"""
-        bucket = s3.Bucket(self.bucket_name)
-        obj = bucket.Object(self.key)
-        input_data = {}
-        body = obj.get()["Body"].read().splitlines()
-        for line in body:
-            k, v = str(line).strip("b'").split("=")
-            input_data[k] = v
-        return input_data
+        return import_features(self.bucket_name, self.key)
 
     def scrub_keys(self):
-        n_files = 0
-        total_mb = 0
-        detector = 0
-        subarray = 0
-        drizcorr = 0
-        pctecorr = 0
-        crsplit = 0
-
-        for k, v in self.input_data.items():
-            if k == "n_files":
-                n_files = int(v)
-            if k == "total_mb":
-                total_mb = int(np.round(float(v), 0))
-            if k == "DETECTOR":
-                if v in ["UVIS", "WFC"]:
-                    detector = 1
-                else:
-                    detector = 0
-            if k == "SUBARRAY":
-                if v == "True":
-                    subarray = 1
-                else:
-                    subarray = 0
-            if k == "DRIZCORR":
-                if v == "PERFORM":
-                    drizcorr = 1
-                else:
-                    drizcorr = 0
-            if k == "PCTECORR":
-                if v == "PERFORM":
-                    pctecorr = 1
-                else:
-                    pctecorr = 0
-            if k == "CRSPLIT":
-                if v == "NaN":
-                    crsplit = 0
-                elif v in ["1.0", "1"]:
-                    crsplit = 1
-                else:
-                    crsplit = 2
-
-        i = self.ipppssoot
-        # dtype (asn or singleton)
-        if i[-1] == "0":
-            dtype = 1
-        else:
-            dtype = 0
-        # instr encoding cols
-        if i[0] == "j":
-            instr = 0
-        elif i[0] == "l":
-            instr = 1
-        elif i[0] == "o":
-            instr = 2
-        elif i[0] == "i":
-            instr = 3
-
-        inputs = np.array([n_files, total_mb, drizcorr, pctecorr, crsplit, subarray, detector, dtype, instr])
-        return inputs
+        return np.array(feature_encoder.encode(self.ipppssoot, self.input_data))
 
     def transformer(self, pt_data):
         """applies yeo-johnson power transform to first two indices of array (n_files, total_mb) using lambdas, mean and standard deviation calculated for each variable prior to model training.
 
         Returns: X inputs as 2D-array for generating predictions
         """
-        X = self.inputs
-        n_files = X[0]
-        total_mb = X[1]
-        # apply power transformer normalization to continuous vars
-        x = np.array([[n_files], [total_mb]]).reshape(1, -1)
-        pt = PowerTransformer(standardize=False)
-        pt.lambdas_ = np.array([pt_data["f_lambda"], pt_data["s_lambda"]])
-        # pt.lambdas_ = np.array([-1.05989146, 0.1691683])
-        xt = pt.transform(x)
-        # normalization (zero mean, unit variance)
-        f_mean, f_sigma = pt_data["f_mean"], pt_data["f_sigma"]
-        s_mean, s_sigma = pt_data["s_mean"], pt_data["s_sigma"]
-        # f_mean, f_sigma = 0.7313458816815209, 0.09209684806404451
-        # s_mean, s_sigma = 4.18491577280472, 2.4467903663338366
-        x_files = np.round(((xt[0, 0] - f_mean) / f_sigma), 5)
-        x_size = np.round(((xt[0, 1] - s_mean) / s_sigma), 5)
-        X = np.array([x_files, x_size, X[2], X[3], X[4], X[5], X[6], X[7], X[8]]).reshape(1, -1)
-        return X
+        return transform(self.inputs, pt_data)
+
+
+def predict_batch(bucket_name, items, models):
+    """Fetch and encode the feature files of every {"Key", "Ipppssoot"} in `items` concurrently,
+    then run each model once over the resulting N x 9 input matrix.
+
+    Returns [{"ipppssoot", "memBin", "memVal", "clockTime"}, ...] in the order of `items`.
+    """
+
+    with ThreadPoolExecutor(max_workers=max(1, min(FETCH_THREADS, len(items)))) as pool:
+        fields = list(pool.map(lambda item: import_features(bucket_name, item["Key"]), items))
+    inputs = feature_encoder.encode_many([item["Ipppssoot"] for item in items], fields)
+    X = transform(inputs, models.pt_data)
+    pred_proba = models.clf.predict(X)
+    membins = np.argmax(pred_proba, axis=-1)
+    memvals = models.mem_reg.predict(X).reshape(-1)
+    clocktimes = models.wall_reg.predict(X).reshape(-1)
+    results = []
+    for i, item in enumerate(items):
+        results.append(
+            {
+                "ipppssoot": item["Ipppssoot"],
+                "memBin": int(membins[i]),
+                "memVal": np.round(float(memvals[i]), 2),
+                "clockTime": int(clocktimes[i]),
+            }
+        )
+        print(f"ipppssoot: {item['Ipppssoot']} features: {inputs[i]} X: {X[i]} probabilities: {pred_proba[i]}")
+    return results
 
 
 def lambda_handler(event, context):
@@ -162,15 +254,18 @@ def lambda_handler(event, context):
     WALLCLOCK REGRESSION: regression generates estimate for specific number of seconds needed to process the dataset using the same input data. This number is then tripled in Calcloud for the sake of creating an extra buffer of overhead in order to prevent larger jobs from being killed unnecessarily.
 
     MEMORY REGRESSION: A third regression model is used to estimate the actual value of memory needed for the job. This is mainly for the purpose of logging/future analysis and is not currently being used for allocating memory in calcloud jobs.
+
+    BATCH EVENTS: an event of the form {"Bucket": ..., "Items": [{"Key": ..., "Ipppssoot": ...}, ...]} predicts every
+    item with one call to each model and returns {"Results": [{"ipppssoot", "memBin", "memVal", "clockTime"}, ...]}.
     """
     bucket_name = event["Bucket"]
-    # load models
-    clf = get_model("./models/mem_clf/")
-    mem_reg = get_model("./models/mem_reg/")
-    wall_reg = get_model("./models/wall_reg/")
+    # load models,  or re-use those already loaded by this container
+    models = get_models()
+    if "Items" in event:
+        return {"Results": predict_batch(bucket_name, event["Items"], models) if event["Items"] else []}
+    clf, mem_reg, wall_reg, pt_data = models.clf, models.mem_reg, models.wall_reg, models.pt_data
     key = event["Key"]
     ipppssoot = event["Ipppssoot"]
-    pt_data = load_pt_data("./models/pt_transform")
     print(f"pt_data: {pt_data}")
     prep = Preprocess(ipppssoot, bucket_name, key)
     prep.input_data = prep.import_data()
@@ -17,8 +17,11 @@ MAX_PER_LAMBDA = 100
 
 
 def lambda_handler(event, context):
-    bucket_name, dataset = s3.parse_s3_event(event)
+    return s3.handle_s3_events(event, rescue)
 
+
+def rescue(bucket_name, dataset):
+    """Handle the rescue-`dataset` message written to `bucket_name`."""
     comm = io.get_io_bundle(bucket_name)
 
     overrides = comm.messages.get(f"rescue-{dataset}")
@@ -1,15 +1,18 @@
 import os
-import urllib.parse
 from calcloud import model_ingest
 from calcloud import hst
+from calcloud import s3
 
 
 def lambda_handler(event, context=None):
+    return s3.handle_s3_events(event, ingest, parse=s3.parse_s3_record_key)
+
+
+def ingest(bucket_name, key):
+    """Ingest the model features of the dataset named by trigger `key` in `bucket_name`."""
     table_name = os.environ.get("DDBTABLE", "calcloud-model-sb")
-    bucket_name = event["Records"][0]["s3"]["bucket"]["name"]
-    key = urllib.parse.unquote_plus(
-        event["Records"][0]["s3"]["object"]["key"], encoding="utf-8"
-    )  # messages/processed-iaao11ofq.trigger
+    bucket_name = bucket_name.replace("s3://", "")
+    # key = messages/processed-iaao11ofq.trigger
     # ipst = key.split("-")[-1].split(".")[0]
     # model_ingest.ddb_ingest(ipst, bucket_name, table_name)
     dataset = "-".join(key.split("-")[1:]).split(".")[0]
@@ -9,30 +9,136 @@ memory related failures results in automatic retries if:
 2. The job control memory_retries count hasn't exceeded the maximum.
 
 Job control data is updated with a new retry count and other information from
-the Batch event.
+the Batch event.  The update is conditional on the control data not changing
+concurrently,  e.g. by a cancel,  and is recomputed if it does.
+
+Failures of Batch array job children are attributed to the dataset recorded at
+the child's index in the array manifest.   Events for array parents are ignored
+since every failed child reports its own event.
+
+Packed jobs process the datasets of their manifest in turn.   When one fails,  the
+first dataset without a processed or ingest message is handled as the failed dataset and
+the datasets after it,  which never ran,  are rescued without counting a retry.
 
 All messages for the failed dataset are deleted.
 
+Datasets without control metadata,  e.g. submitted before array and packed jobs
+recorded it,  are logged and handled starting from the default metadata.
+
+Each failure is recorded once per Batch job:  the job id and continuation message are
+kept in the control metadata so a redelivered event re-sends the same message without
+counting another retry,  or does nothing if the dataset has been resubmitted since.
+
 A rescue message is sent to trigger the rescue lambda for qualifying
 memory related failures, otherwise an error-dataset message is sent.
+
+lambda_handler() processes one event as delivered directly by CloudWatch.
+sqs_handler() processes a batch of events queued in SQS,  e.g. when thousands of
+jobs fail together due to a spot reclamation,  coalescing events for the same
+dataset,  applying metadata updates and message writes concurrently,  and
+reporting the records which failed as an SQS partial batch response.
 """
 
 import os
+import json
+import functools
+from concurrent.futures import ThreadPoolExecutor
 
 from calcloud import io
+from calcloud import s3
+from calcloud import batch
 from calcloud import exit_codes
 
+# messages showing a packed dataset ran to completion,  processed- moves on to an ingest state
+FINISHED_TYPES = ["processed", "ingesterror", "ingested"]
+
+MAX_WORKERS = int(os.environ.get("BATCH_EVENT_THREADS", s3.MAX_TRANSFER_THREADS))
+
 
 def lambda_handler(event, context):
     print(event)
+    comm, updates = _failure_updates(event)
+    for dataset, update in updates:
+        # XXXX Since retry count used in planning, control output must precede rescue message
+        continuation_msg = comm.xdata.update(dataset, update, default=io.get_default_metadata())
+        if continuation_msg:
+            comm.messages.delete("all-" + dataset)
+            comm.messages.put(continuation_msg)
+
+
+def sqs_handler(event, context):
+    """Process an SQS batch of Batch failure events,  one CloudWatch event per record body.
+
+    Events naming the same dataset are coalesced,  the last one received wins.   The
+    metadata updates of all datasets are applied concurrently,  then the stale messages
+    of every dataset are removed with bulk DeleteObjects requests and the continuation
+    messages are put concurrently.
+
+    Returns the SQS partial batch response listing the records which failed so only
+    those are redelivered.   Datasets of a redelivered record which were already updated
+    only have their continuation messages sent again.
+    """
+    failed = set()
+    work = {}  # (bucket, dataset) -> (comm, update, [message ids])
+    for record in event["Records"]:
+        try:
+            comm, updates = _failure_updates(json.loads(record["body"]))
+        except Exception as exc:
+            print("Failed handling record", record.get("messageId"), ":", repr(exc))
+            failed.add(record["messageId"])
+            continue
+        for dataset, update in updates:
+            key = (comm.bucket, dataset)
+            message_ids = work.pop(key, (None, None, []))[2] + [record["messageId"]]
+            work[key] = (comm, update, message_ids)
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        futures = {
+            key: pool.submit(comm.xdata.update, key[1], update, default=io.get_default_metadata())
+            for key, (comm, update, _ids) in work.items()
+        }
+    continuations = {}  # bucket -> (comm, {dataset: continuation message})
+    for key, future in futures.items():
+        comm, _update, message_ids = work[key]
+        try:
+            # XXXX Since retry count used in planning, control output must precede rescue message
+            continuation_msg = future.result()
+            if continuation_msg:
+                continuations.setdefault(key[0], (comm, {}))[1][key[1]] = continuation_msg
+        except Exception as exc:
+            print("Failed updating metadata for", key[1], ":", repr(exc))
+            failed.update(message_ids)
+
+    for bucket, (comm, messages) in continuations.items():
+        try:
+            comm.messages.delete(
+                ["all-" + dataset for dataset in messages], check_exists=False, max_workers=MAX_WORKERS
+            )
+            comm.messages.put(list(messages.values()), max_workers=MAX_WORKERS)
+        except Exception as exc:
+            print("Failed sending continuation messages for", bucket, ":", repr(exc))
+            for dataset in messages:
+                failed.update(work[(bucket, dataset)][2])
 
+    return {"batchItemFailures": [{"itemIdentifier": message_id} for message_id in sorted(failed)]}
+
+
+def _failure_updates(event):
+    """Interpret Batch failure `event` returning the IoBundle of its bucket and a list of
+    (dataset, update) pairs where update(metadata) records the failure in the dataset's
+    control metadata and returns its continuation message.
+    """
     detail = event["detail"]
     job_id = detail["jobId"]
-    job_name = detail["jobName"]  # appears to be dataset
+    job_name = detail["jobName"]  # appears to be dataset,  or array job name
     status_reason = detail.get("statusReason", "undefined")
+    array_properties = detail.get("arrayProperties", {})
+
+    if batch.is_array_name(job_name) and "index" not in array_properties:
+        print("Skipping array parent event for", job_id, "each failed child has its own event.")
+        return None, []
 
     container = event["detail"]["container"]
-    dataset = container["command"][1]
     bucket = container["command"][2].split("/")[2]
     container_reason = container.get("reason", "undefined")
     exit_code = container.get("exitCode", "undefined")
@@ -40,54 +146,113 @@ def lambda_handler(event, context):
 
     comm = io.get_io_bundle(bucket)
 
-    metadata = comm.xdata.get(dataset)
-    metadata["dataset"] = dataset
-    metadata["bucket"] = bucket
-    metadata["job_id"] = job_id
-    metadata["job_name"] = job_name
-    metadata["exit_code"] = exit_code
-    metadata["exit_reason"] = exit_reason
-    metadata["status_reason"] = status_reason
-    metadata["container_reason"] = container_reason
-
-    if exit_reason != "undefined":
-        combined_reason = exit_reason
-    elif container_reason != "undefined":
-        combined_reason = container_reason
+    if "index" in array_properties:  # array child,  dataset argument is "@" + manifest path
+        datasets = [comm.control.get_array_dataset(job_name, array_properties["index"])]
+    elif batch.is_pack_name(job_name):
+        datasets = _unfinished_pack_datasets(comm, job_name)
     else:
-        combined_reason = status_reason
+        datasets = [container["command"][1]]
 
-    continuation_msg = "error-" + dataset
+    def update_metadata(metadata, dataset):
+        """Record the failure in control `metadata` and return the continuation message,
+        re-run by xdata.update() if a concurrent cancel or rescue changes the metadata first.
+        """
+        metadata["dataset"] = dataset
+        metadata["bucket"] = bucket
+        metadata["job_id"] = job_id
+        metadata["job_name"] = job_name
+        metadata["exit_code"] = exit_code
+        metadata["exit_reason"] = exit_reason
+        metadata["status_reason"] = status_reason
+        metadata["container_reason"] = container_reason
 
-    if exit_codes.is_memory_error(exit_code) or container_reason.startswith("OutOfMemoryError: Container killed"):
-        if not metadata["terminated"] and metadata["memory_retries"] < int(os.environ["MAX_MEMORY_RETRIES"]):
-            metadata["memory_retries"] += 1
-            continuation_msg = "rescue-" + dataset
-            print("Automatic OutOfMemory rescue of", dataset, "with memory retry count", metadata["memory_retries"])
+        if exit_reason != "undefined":
+            combined_reason = exit_reason
+        elif container_reason != "undefined":
+            combined_reason = container_reason
         else:
-            print("Automatic OutOfMemory retries for", dataset, "exhausted at", metadata["memory_retries"])
-    elif container_reason.startswith("CannotInspectContainer"):
-        if not metadata["terminated"] and metadata["retries"] < int(os.environ["MAX_DOCKER_RETRIES"]):
-            metadata["retries"] += 1
-            continuation_msg = "rescue-" + dataset
-            print("Automatic CannotInspectContainer rescue for", dataset, "with retry count", metadata["retries"])
-        else:
-            print("Automatic CannotInspectContainer retries for", dataset, "exhausted at", metadata["retries"])
-    elif container_reason.startswith("DockerTimeoutError"):
-        if not metadata["terminated"] and metadata["retries"] < int(os.environ["MAX_DOCKER_RETRIES"]):
-            metadata["retries"] += 1
-            continuation_msg = "rescue-" + dataset
-            print("Automatic DockerTimeoutError rescue for", dataset, "with retry count", metadata["retries"])
+            combined_reason = status_reason
+
+        continuation_msg = "error-" + dataset
+
+        if exit_codes.is_memory_error(exit_code) or container_reason.startswith("OutOfMemoryError: Container killed"):
+            if "job_bin" in metadata:  # bins which actually ran out of memory,  for plan.build_oom_stats()
+                metadata["oom_bins"] = metadata.get("oom_bins", []) + [metadata["job_bin"]]
+            if not metadata["terminated"] and metadata["memory_retries"] < int(os.environ["MAX_MEMORY_RETRIES"]):
+                metadata["memory_retries"] += 1
+                continuation_msg = "rescue-" + dataset
+                print("Automatic OutOfMemory rescue of", dataset, "with memory retry count", metadata["memory_retries"])
+            else:
+                print("Automatic OutOfMemory retries for", dataset, "exhausted at", metadata["memory_retries"])
+        elif container_reason.startswith("CannotInspectContainer"):
+            if not metadata["terminated"] and metadata["retries"] < int(os.environ["MAX_DOCKER_RETRIES"]):
+                metadata["retries"] += 1
+                continuation_msg = "rescue-" + dataset
+                print("Automatic CannotInspectContainer rescue for", dataset, "with retry count", metadata["retries"])
+            else:
+                print("Automatic CannotInspectContainer retries for", dataset, "exhausted at", metadata["retries"])
+        elif container_reason.startswith("DockerTimeoutError"):
+            if not metadata["terminated"] and metadata["retries"] < int(os.environ["MAX_DOCKER_RETRIES"]):
+                metadata["retries"] += 1
+                continuation_msg = "rescue-" + dataset
+                print("Automatic DockerTimeoutError rescue for", dataset, "with retry count", metadata["retries"])
+            else:
+                print("Automatic DockerTimeoutError retries for", dataset, "exhausted at", metadata["retries"])
+        elif status_reason.startswith("Operator cancelled"):
+            print("Operator cancelled job", job_id, "for", dataset, "no automatic retry.")
+            continuation_msg = "terminated-" + dataset
         else:
-            print("Automatic DockerTimeoutError retries for", dataset, "exhausted at", metadata["retries"])
-    elif status_reason.startswith("Operator cancelled"):
-        print("Operator cancelled job", job_id, "for", dataset, "no automatic retry.")
-        continuation_msg = "terminated-" + dataset
-    else:
-        print("Failure for", dataset, "no automatic retry for", combined_reason)
+            print("Failure for", dataset, "no automatic retry for", combined_reason)
+
+        print(metadata)
+        return continuation_msg
+
+    def requeue_metadata(metadata, dataset):
+        """Record that packed `dataset` never ran because an earlier dataset of the job failed
+        and return the continuation message,  rescue without counting a retry unless cancelled.
+        """
+        metadata["dataset"] = dataset
+        metadata["bucket"] = bucket
+        metadata["job_id"] = job_id
+        metadata["job_name"] = job_name
+        metadata["status_reason"] = status_reason
+        if metadata["terminated"] or status_reason.startswith("Operator cancelled"):
+            print("Packed dataset", dataset, "of cancelled job", job_id, "no automatic retry.")
+            return "terminated-" + dataset
+        print("Automatic rescue of packed dataset", dataset, "not run by failed job", job_id)
+        return "rescue-" + dataset
+
+    def record_once(update, metadata, dataset):
+        """Apply `update` unless the failure of `job_id` is already recorded in `metadata`,
+        in which case return its continuation message again,  or None if `dataset` has been
+        resubmitted since.
+        """
+        if metadata["job_id"] == "undefined":
+            print("No submission recorded for", dataset, "of failed job", job_id, "using default metadata.")
+        if metadata.get("failure_job_id") == job_id:
+            if metadata["job_id"] != job_id:
+                print("Ignoring repeated failure of", job_id, "for resubmitted", dataset)
+                return None
+            print("Failure of", job_id, "already recorded for", dataset, "resending", metadata["failure_message"])
+            return metadata["failure_message"]
+        continuation_msg = update(metadata, dataset)
+        metadata["failure_job_id"] = job_id
+        metadata["failure_message"] = continuation_msg
+        return continuation_msg
+
+    if not datasets:
+        print("No unfinished datasets for failed job", job_id)
+    # the first unfinished dataset of a packed job is the one which failed
+    return comm, [
+        (dataset, functools.partial(record_once, update_metadata if i == 0 else requeue_metadata, dataset=dataset))
+        for i, dataset in enumerate(datasets)
+    ]
+
 
-    # XXXX Since retry count used in planning, control output must precede rescue message
-    print(metadata)
-    comm.xdata.put(dataset, metadata)
-    comm.messages.delete("all-" + dataset)
-    comm.messages.put(continuation_msg)
+def _unfinished_pack_datasets(comm, job_name):
+    """Return the datasets of packed job `job_name` in processing order which have no
+    FINISHED_TYPES message,  i.e. the failed dataset followed by those never run.
+    """
+    datasets = comm.control.get_array_manifest(job_name)["datasets"]
+    found = comm.messages.exists([f"{kind}-{dataset}" for dataset in datasets for kind in FINISHED_TYPES])
+    return [dataset for dataset in datasets if not any(found[f"{kind}-{dataset}"] for kind in FINISHED_TYPES)]
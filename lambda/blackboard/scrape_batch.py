@@ -6,6 +6,9 @@ def lambda_handler(event, context):
     from calcloud import batch
     from calcloud import common
     from calcloud import hst
+    from calcloud import io
+    from calcloud import log
+    from calcloud import timing
 
     # various metadata definitions
     jobStatuses = ["FAILED", "SUBMITTED", "PENDING", "RUNNABLE", "STARTING", "RUNNING", "SUCCEEDED"]
@@ -38,84 +41,99 @@ def lambda_handler(event, context):
     # we need s3 to upload the snapshot, and storagegateway to refresh the cache
     s3 = boto3.client("s3", config=common.retry_config)
 
+    # array and packed job manifests list the datasets of a job
+    comm = io.get_io_bundle(os.environ["BUCKET"])
+
+    def format_row(j, dataset):
+        """Return the blackboard line for job summary `j` which processed `dataset`."""
+        jobId = j["jobId"]
+
+        submitDate = int(j.get("createdAt", default_timestamp) / 1000.0)
+
+        jobStartDate = int(j.get("startedAt", default_timestamp) / 1000.0)
+        completionDate = int(j.get("stoppedAt", default_timestamp) / 1000.0)
+
+        # if the job hasn't completed yet, set duration to 0 so it's not -50 years
+        # we check for the stoppedAt attribute, and default to startDate
+        durationCheck = int(j.get("stoppedAt", j.get("startedAt", default_timestamp)) / 1000.0)
+        jobDuration = int(durationCheck - jobStartDate)
+
+        # imageSize currently not implemented. could be pulled from metrics file
+        imageSize = 0
+        jobState = j["status"]
+
+        # if the job hasn't started container doesn't seem to be in the keys
+        container = j.get("container", {})
+        exitCode = container.get("exitCode", 0)
+
+        containerReason = container.get("reason", "None")
+        jobReason = j.get("statusReason", "None")
+        if jobReason.startswith("Essential"):
+            exitReason = containerReason[:120] + "; " + jobReason[:120]
+        else:
+            exitReason = container.get("reason", j.get("statusReason", "None"))[:255]
+
+        # getting the LogStream requires calling describe_jobs which is very slow.
+        # for the time being we provide a None value, in the hopes we can find
+        # a way to get it into the metadata in the future.
+        LogStream = "None"
+        # writing out the status of the job
+        s3Path = f"{os.environ['BUCKET']}/outputs/{dataset}/"
+        out_list = [
+            jobId,
+            submitDate,
+            jobStartDate,
+            completionDate,
+            jobDuration,
+            imageSize,
+            jobState,
+            exitCode,
+            exitReason,
+            dataset,
+            LogStream,
+            s3Path,
+        ]
+        return "|".join(map(str, out_list)).replace("\n", " ") + "\n"
+
     with os.fdopen(fd, "w") as fout:
         # write the header
         out_str = "|".join(header_names) + "\n"
         fout.write(out_str)
-        # must loop over job statuses and queues
-        for q in queues:
-            for jobStatus in jobStatuses:
-                jobs_iterator = batch._list_jobs_iterator(q, jobStatus, PageSize=maxJobResults)
-
-                for page in jobs_iterator:
-                    jobs = page["jobSummaryList"]
-                    print(f"handling {len(jobs)} jobs from {q} in {jobStatus} status...")
-                    for j in jobs:
-                        print(j)
-                        jobId = j["jobId"]
-
-                        submitDate = int(j.get("createdAt", default_timestamp) / 1000.0)
-
-                        jobStartDate = int(j.get("startedAt", default_timestamp) / 1000.0)
-                        completionDate = int(j.get("stoppedAt", default_timestamp) / 1000.0)
-
-                        # if the job hasn't completed yet, set duration to 0 so it's not -50 years
-                        # we check for the stoppedAt attribute, and default to startDate
-                        durationCheck = int(j.get("stoppedAt", j.get("startedAt", default_timestamp)) / 1000.0)
-                        jobDuration = int(durationCheck - jobStartDate)
-
-                        # imageSize currently not implemented. could be pulled from metrics file
-                        imageSize = 0
-                        jobState = jobStatus
-
-                        # if the job hasn't started container doesn't seem to be in the keys
-                        container = j.get("container", {})
-                        exitCode = container.get("exitCode", 0)
-
-                        containerReason = container.get("reason", "None")
-                        jobReason = j.get("statusReason", "None")
-                        if jobReason.startswith("Essential"):
-                            exitReason = containerReason[:120] + "; " + jobReason[:120]
-                        else:
-                            exitReason = container.get("reason", j.get("statusReason", "None"))[:255]
-
-                        # dataset = j["jobName"].split("-")[-1]
-                        jobname = j["jobName"]
-                        if hst.IPPPSSOOT_RE.match(jobname) or hst.SVM_RE.match(jobname) or hst.MVM_RE.match(jobname):
-                            dataset = jobname
-                        else:
-                            splitname = "-".join(jobname.split("-")[1:])
-                            if (
-                                hst.IPPPSSOOT_RE.match(splitname)
-                                or hst.SVM_RE.match(splitname)
-                                or hst.MVM_RE.match(splitname)
-                            ):
-                                dataset = splitname
-                            else:
-                                raise Exception("No valid dataset name found in jobName")
-
-                        # getting the LogStream requires calling describe_jobs which is very slow.
-                        # for the time being we provide a None value, in the hopes we can find
-                        # a way to get it into the metadata in the future.
-                        LogStream = "None"
-                        # writing out the status of the job
-                        s3Path = f"{os.environ['BUCKET']}/outputs/{dataset}/"
-                        out_list = [
-                            jobId,
-                            submitDate,
-                            jobStartDate,
-                            completionDate,
-                            jobDuration,
-                            imageSize,
-                            jobState,
-                            exitCode,
-                            exitReason,
-                            dataset,
-                            LogStream,
-                            s3Path,
-                        ]
-                        line = "|".join(map(str, out_list)).replace("\n", " ")
-                        fout.write(line + "\n")
+        # list every queue and job status concurrently,  jobs from different listings interleave
+        histogram = timing.LatencyHistogram("ListJobs")
+        jobs = batch.iter_jobs(queues, jobStatuses, histogram=histogram, formatted=False, page_size=maxJobResults)
+        for j in jobs:
+            print(j)
+            jobname = j["jobName"]
+            if batch.is_manifest_name(jobname):
+                # a manifest removed by e.g. clean-all only drops the rows of its job
+                datasets = None
+                with log.trap_exception("Reading manifest of job", jobname):
+                    datasets = comm.control.get_array_manifest(jobname)["datasets"]
+                if datasets is None:
+                    continue
+            if batch.is_array_name(jobname):
+                # array parents only summarize their children,  report one row per child dataset
+                # children are listed once per parent so every child status is collected
+                for child in batch.iter_array_children(j["jobId"], jobStatuses, page_size=maxJobResults):
+                    fout.write(format_row(child, datasets[child["arrayProperties"]["index"]]))
+                continue
+            if batch.is_pack_name(jobname):
+                # packed jobs report their state for each of their datasets
+                for dataset in datasets:
+                    fout.write(format_row(j, dataset))
+                continue
+            # dataset = j["jobName"].split("-")[-1]
+            if hst.IPPPSSOOT_RE.match(jobname) or hst.SVM_RE.match(jobname) or hst.MVM_RE.match(jobname):
+                dataset = jobname
+            else:
+                splitname = "-".join(jobname.split("-")[1:])
+                if hst.IPPPSSOOT_RE.match(splitname) or hst.SVM_RE.match(splitname) or hst.MVM_RE.match(splitname):
+                    dataset = splitname
+                else:
+                    raise Exception("No valid dataset name found in jobName")
+            fout.write(format_row(j, dataset))
+        histogram.report()
 
     with open(temppath, "rb") as f:
         s3.upload_fileobj(f, os.environ["BUCKET"], "blackboard/blackboardAWS.snapshot")
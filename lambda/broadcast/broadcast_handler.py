@@ -5,21 +5,53 @@ The purpose of the broadcast lambda is to avoid the latency of
 sending thousands of messages serially.   Imagine for instance trying
 to cancel 100k jobs.
 
-For large payloads the broadcast message is first deleted and two new
-broadcast messages are sent each containing half the original payload.
+For large payloads the broadcast message is first deleted and BROADCAST_FANOUT
+new broadcast messages are sent each containing a fraction of the original
+payload,  so N messages are sent after ~log_fanout(N / BROADCAST_LEAF_SIZE)
+generations of broadcast lambdas.
 
-For small payloads,  the broadcast message iterates over the payload
-and directly putting each message.
+For payloads of up to BROADCAST_LEAF_SIZE messages,  the broadcast message
+puts every message concurrently using BROADCAST_THREADS threads sharing
+one S3 client.   While putting,  a watcher thread polls for broadcast-kill
+and stops any remaining puts when it appears.
 """
 
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
 from calcloud import io
 from calcloud import s3
+from calcloud import common
+
+BROADCAST_LEAF_SIZE = int(os.environ.get("BROADCAST_LEAF_SIZE", 1000))  # max messages put directly
+BROADCAST_FANOUT = int(os.environ.get("BROADCAST_FANOUT", 10))  # child broadcasts sent for larger payloads
+BROADCAST_THREADS = int(os.environ.get("BROADCAST_THREADS", 32))  # concurrent puts per lambda
+KILL_POLL_SECONDS = 1.0  # interval between broadcast-kill checks while putting
+
+BROADCAST_CLIENT = None
+
+
+def get_broadcast_client():
+    """Return an S3 client with a connection pool sized for BROADCAST_THREADS,
+    allocated once per lambda container.
+    """
+    global BROADCAST_CLIENT
+    if BROADCAST_CLIENT is None:
+        config = common.retry_config.merge(Config(max_pool_connections=BROADCAST_THREADS))
+        BROADCAST_CLIENT = boto3.client("s3", config=config)
+    return BROADCAST_CLIENT
 
 
 def lambda_handler(event, context):
-    bucket_name, serial = s3.parse_s3_event(event)
+    return s3.handle_s3_events(event, broadcast)
+
 
-    comm = io.get_io_bundle(bucket_name)
+def broadcast(bucket_name, serial):
+    """Handle the broadcast-`serial` message written to `bucket_name`."""
+    comm = io.get_io_bundle(bucket_name, get_broadcast_client())
 
     if check_for_kill(comm, "Detected broadcast-kill on entry."):
         return
@@ -28,21 +60,36 @@ def lambda_handler(event, context):
 
     broadcasted, payload = bmsg["messages"], bmsg["payload"]
 
-    if len(broadcasted) > 100:  # split broadcast into two new broadcasts
-        comm.messages.bifurcate_broadcast(broadcasted, payload)
-    else:  # iteratively send payload to each message in broadcasted
-        for i, msg in enumerate(broadcasted):
-            if not i % 10:
-                if check_for_kill(comm, "Detected broadcast-kill in put loop"):
-                    return
-            comm.messages.put(msg, payload)
+    if len(broadcasted) > BROADCAST_LEAF_SIZE:  # split broadcast into BROADCAST_FANOUT new broadcasts
+        comm.messages.fanout_broadcast(broadcasted, payload, fanout=BROADCAST_FANOUT, max_workers=BROADCAST_THREADS)
+    else:  # concurrently send payload to each message in broadcasted
+        put_until_killed(comm, broadcasted, payload)
+
+
+def put_until_killed(comm, broadcasted, payload):
+    """Put every message in `broadcasted` with `payload` concurrently,  skipping any
+    messages not yet written once broadcast-kill is detected by a watcher thread.
+    """
+    killed, finished = threading.Event(), threading.Event()
+
+    def watch_for_kill():
+        while not finished.wait(KILL_POLL_SECONDS):
+            if check_for_kill(comm, "Detected broadcast-kill in put loop"):
+                killed.set()
+                return
+
+    watcher = threading.Thread(target=watch_for_kill, daemon=True)
+    watcher.start()
+    try:
+        comm.messages.put(broadcasted, payload, max_workers=BROADCAST_THREADS, stop=killed)
+    finally:
+        finished.set()
+        watcher.join()
 
 
 def check_for_kill(comm, message):
     """Return True IFF a broadcast-kill message has been written to S3."""
-    try:
-        comm.messages.get("broadcast-kill")  # 12x cheaper than listl
+    if comm.messages.exists("broadcast-kill"):  # HEAD,  no payload transfer
         print(message)
         return True
-    except comm.messages.client.exceptions.NoSuchKey:
-        return False
+    return False
@@ -4,8 +4,11 @@ from calcloud import s3
 
 
 def lambda_handler(event, context):
-    bucket_name, dataset = s3.parse_s3_event(event)
+    return s3.handle_s3_events(event, submit_placed)
 
+
+def submit_placed(bucket_name, dataset):
+    """Handle the placed-`dataset` message written to `bucket_name`."""
     comm = io.get_io_bundle(bucket_name)
 
     overrides = comm.messages.get(f"placed-{dataset}")
@@ -15,3 +18,23 @@ def lambda_handler(event, context):
     # comm.messages.delete(f"placed-{dataset}")
 
     lambda_submit.main(comm, dataset, bucket_name, overrides)
+
+
+def inputs_handler(event, context):
+    """Handle the S3 events for arriving inputs/<dataset>.tar.gz and
+    control/<dataset>/<dataset>_MemModelFeatures.txt files when SUBMIT_DEFER_INPUTS
+    is set,  retriggering the deferred submission once both inputs exist.
+    """
+    return s3.handle_s3_events(event, retrigger_inputs, parse=s3.parse_s3_record_key)
+
+
+def retrigger_inputs(bucket_name, key):
+    """Retrigger the deferred submission of the dataset whose input `key` arrived in `bucket_name`."""
+    if key.startswith("inputs/"):
+        dataset = key[len("inputs/") :].split(".")[0]
+    else:
+        dataset = key.split("/")[1]
+
+    comm = io.get_io_bundle(bucket_name)
+
+    lambda_submit.retrigger_if_ready(comm, dataset)
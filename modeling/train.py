@@ -119,6 +119,7 @@ def save_model(model, name="Sequential", weights=True):
     model.save(model_path)
     if weights is True:
         model.save_weights(weights_path)
+    export_npz(model, f"{model_path}.npz")
     for root, _, files in os.walk(model_path):
         indent = "    " * root.count(os.sep)
         print("{}{}/".format(indent, os.path.basename(root)))
@@ -126,6 +127,23 @@ def save_model(model, name="Sequential", weights=True):
             print("{}{}".format(indent + "    ", filename))
 
 
+def export_npz(model, npz_path):
+    """Export the Dense layer weights and activations of `model` to `npz_path` for the NumPy-only
+    inference engine in the JobPredict lambda,  which then has no need to import TensorFlow.
+
+    Layer i is stored as arrays W{i} and b{i} with activation name activations[i].
+    """
+    arrays, activations = {}, []
+    for layer in model.layers:
+        if isinstance(layer, Dense):
+            W, b = layer.get_weights()
+            arrays[f"W{len(activations)}"] = W.astype("float32")
+            arrays[f"b{len(activations)}"] = b.astype("float32")
+            activations.append(tf.keras.activations.serialize(layer.activation))
+    np.savez(npz_path, activations=np.array(activations), **arrays)
+    print(f"Exported {len(activations)} dense layers to {npz_path}")
+
+
 """ ----- EVALUATION ----- """
 
 
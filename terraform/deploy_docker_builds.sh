@@ -31,6 +31,7 @@ fi
 
 # jobPredict lambda env
 cd ${CALCLOUD_BUILD_DIR}/lambda/JobPredict
+cp ${CALCLOUD_BUILD_DIR}/calcloud/features.py .  # shared feature encoder
 source hst_admin_role_shim.sh cert-update
 set -o pipefail && docker build -f Dockerfile -t ${PREDICT_DOCKER_IMAGE} .
 model_docker_build_status=$?
@@ -55,6 +55,16 @@ os.environ["JOBPREDICTLAMBDA"] = "job_predict_lambda"
 os.environ["DDBTABLE"] = "mock_ddb_table"
 
 
+@pytest.fixture(autouse=True)
+def clear_wallclock_cache():
+    """Keep wallclock stats and queue depths cached by calcloud.plan in one test from leaking into the next."""
+    plan = sys.modules.get("calcloud.plan")
+    if plan is not None:
+        plan.clear_wallclock_cache()
+        plan.clear_queue_depths()
+    yield
+
+
 @pytest.fixture(scope="function")
 def aws_credentials():
     """Mocked AWS Credentials for moto."""
@@ -210,6 +220,8 @@ def job_predict_mock_source_code(memBin=0, clockTime=10):
 import json
 def lambda_handler(event, context):
     response = {{"memBin":{memBin}, "clockTime":{clockTime}, "memVal": 2}}
+    if "Items" in event:
+        return {{"Results": [dict(response, ipppssoot=item["Ipppssoot"]) for item in event["Items"]]}}
     return response
 """
     return code
@@ -0,0 +1,87 @@
+import asyncio
+import time
+
+from . import conftest
+
+
+def test_aio_mock(s3_client):
+    """Doctest for aio.py"""
+    import doctest
+    from calcloud import aio
+
+    doctest_result = doctest.testmod(aio)
+    assert doctest_result[0] == 0, "More than zero doctest errors occurred."  # test errors
+    assert doctest_result[1] > 0, "Too few tests ran,  something is wrong with testing."  # tests run
+
+
+def _submit_bookkeeping(comm, dataset):
+    """The S3 operations of lambda_submit.main() for `dataset`,  one after another."""
+    from calcloud import io
+
+    comm.messages.listl(f"terminated-{dataset}")
+    comm.messages.delete(f"all-{dataset}")
+    comm.outputs.delete(f"{dataset}")
+    try:
+        metadata = comm.xdata.get(dataset)
+    except comm.xdata.client.exceptions.NoSuchKey:
+        metadata = io.get_default_metadata()
+    metadata["job_id"] = f"job-{dataset}"
+    comm.xdata.put(dataset, metadata)
+    comm.messages.put(f"submit-{dataset}")
+
+
+async def _submit_bookkeeping_async(acomm, dataset):
+    """The S3 operations of lambda_submit.main() for `dataset` with independent calls gathered."""
+    from calcloud import io
+
+    async def get_metadata():
+        try:
+            return await acomm.xdata.get(dataset)
+        except acomm.client.exceptions.NoSuchKey:
+            return io.get_default_metadata()
+
+    _terminated, _deleted, _outputs, metadata = await asyncio.gather(
+        acomm.messages.listl(f"terminated-{dataset}"),
+        acomm.messages.delete(f"all-{dataset}"),
+        acomm.outputs.delete(f"{dataset}"),
+        get_metadata(),
+    )
+    metadata["job_id"] = f"job-{dataset}"
+    await asyncio.gather(acomm.xdata.put(dataset, metadata), acomm.messages.put(f"submit-{dataset}"))
+
+
+def _setup_placed(comm, datasets):
+    comm.messages.put([f"placed-{dataset}" for dataset in datasets])
+    comm.outputs.put({f"{dataset}/process_metrics.txt": "" for dataset in datasets})
+
+
+def test_aio_submit_benchmark(s3_client):
+    """Compare end-to-end latency of the submit path S3 bookkeeping for the sync and async bundles."""
+    from calcloud import io
+    from calcloud import aio
+
+    datasets = [f"ipppss{i:02d}q" for i in range(20)]
+
+    comm = io.get_io_bundle(conftest.BUCKET, client=s3_client)
+    _setup_placed(comm, datasets)
+    start = time.perf_counter()
+    for dataset in datasets:
+        _submit_bookkeeping(comm, dataset)
+    sync_seconds = time.perf_counter() - start
+    sync_state = comm.list_s3(), comm.xdata.get(datasets)
+    comm.clean("all")
+
+    async def submit_all():
+        async with aio.get_async_io_bundle(conftest.BUCKET, client=s3_client) as acomm:
+            await asyncio.gather(*[_submit_bookkeeping_async(acomm, dataset) for dataset in datasets])
+
+    _setup_placed(comm, datasets)
+    start = time.perf_counter()
+    asyncio.run(submit_all())
+    async_seconds = time.perf_counter() - start
+    async_state = comm.list_s3(), comm.xdata.get(datasets)
+    comm.clean("all")
+
+    print(f"submit bookkeeping for {len(datasets)} datasets:  sync {sync_seconds:.2f}s  async {async_seconds:.2f}s")
+    assert sorted(async_state[0]) == sorted(sync_state[0])
+    assert async_state[1] == sync_state[1]
@@ -3,6 +3,7 @@ import time
 from . import conftest
 
 from calcloud import batch
+from calcloud import timing
 
 jobStatuses = batch.JOB_STATUSES
 
@@ -43,6 +44,11 @@ def test_batch_mock(batch_client, s3_client, iam_client):
         assert n_jobs_in_queue == 1
         # To Check: What if a job changes status during the test (e.g. from SUBMITTED to RUNNABLE)?
 
+    # check that the concurrent lister finds the same jobs as the serial one
+    serial_ids = [job["jobId"] for job in batch.list_jobs(queues, client=batch_client)]
+    concurrent_ids = [job["jobId"] for job in batch.iter_jobs(queues)]
+    assert sorted(concurrent_ids) == sorted(serial_ids) == sorted(jobIds)
+
     # check that job_ids from batch.get_job_ids match those submitted
     returned_job_ids = batch.get_job_ids()
     returned_job_ids = [job_id.replace("_", "-") for job_id in returned_job_ids]  # deal with the '-' to '_' hack
@@ -76,3 +82,61 @@ def test_batch_mock(batch_client, s3_client, iam_client):
     time.sleep(10)  # wait a while for job to stop
     description = batch.describe_job(cancel_jobId)
     assert description["status"] == "FAILED"
+
+
+class PagedBatchClient:
+    """Stand-in for a Batch client whose list_jobs() returns `pages` pages of one job each."""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = []
+
+    def list_jobs(self, **params):
+        self.calls.append(dict(params))
+        page = int(params.get("nextToken", 0))
+        response = {"jobSummaryList": [{"jobId": f"{params['jobQueue']}-{page}", "createdAt": 0}]}
+        if page + 1 < self.pages:
+            response["nextToken"] = str(page + 1)
+        return response
+
+
+def test_batch_iter_job_pages():
+    """Tests ListJobs pagination,  rate limiting,  and the latency histogram used by batch.iter_jobs"""
+    client = PagedBatchClient(pages=5)
+    limiter = timing.TokenBucket(rate=1000, burst=2)
+    histogram = timing.LatencyHistogram("ListJobs", output=lambda *args, **keys: None)
+
+    pages = list(batch._iter_job_pages("q1", "RUNNING", client, limiter, histogram, page_size=1))
+
+    assert [job["jobId"] for page in pages for job in page] == [f"q1-{i}" for i in range(5)]
+    assert [call.get("nextToken") for call in client.calls] == [None, "1", "2", "3", "4"]
+    assert all(call["maxResults"] == 1 for call in client.calls)
+    assert histogram.count == 5 and sum(histogram.buckets.values()) == 5
+    histogram.report()
+
+
+def test_batch_token_bucket():
+    """Tests that the token bucket allows a burst and then spaces calls at the configured rate"""
+    limiter = timing.TokenBucket(rate=50, burst=5)
+    started = time.monotonic()
+    waits = [limiter.acquire() for _ in range(15)]
+    elapsed = time.monotonic() - started
+    assert waits[:5] == [0.0] * 5
+    assert elapsed >= 10 / 50 * 0.9
+
+
+def test_batch_iter_jobs_empty(batch_client, iam_client):
+    """Tests concurrent listing of every queue and status when no jobs are submitted"""
+    conftest.setup_batch(iam_client, batch_client)
+    histogram = timing.LatencyHistogram("ListJobs", output=lambda *args, **keys: None)
+    assert list(batch.iter_jobs(batch.get_queues(), histogram=histogram)) == []
+    assert histogram.count == len(batch.get_queues()) * len(batch.JOB_STATUSES)
+
+
+def test_batch_array_job_ids():
+    """Tests recognizing array job names and splitting array child job ids."""
+    assert batch.split_job_id("5c7b9e4a-0d0e-4f48-9b3d-1a2b3c4d5e6f:12") == ("5c7b9e4a-0d0e-4f48-9b3d-1a2b3c4d5e6f", 12)
+    assert batch.split_job_id("5c7b9e4a_0d0e_4f48_9b3d_1a2b3c4d5e6f") == ("5c7b9e4a_0d0e_4f48_9b3d_1a2b3c4d5e6f", None)
+    assert batch.JOB_ID_RE.fullmatch("5c7b9e4a_0d0e_4f48_9b3d_1a2b3c4d5e6f:3")
+    assert batch.is_array_name(batch.ARRAY_NAME_PREFIX + "0123456789abcdef")
+    assert not batch.is_array_name("ipppssoot")
@@ -0,0 +1,61 @@
+import time
+
+import numpy as np
+
+
+def test_features_doctest():
+    """Doctest for features.py"""
+    import doctest
+    from calcloud import features
+
+    doctest_result = doctest.testmod(features)
+    assert doctest_result[0] == 0, "More than zero doctest errors occurred."
+    assert doctest_result[1] > 4, "Too few tests ran,  something is wrong with testing."
+
+
+def test_features_tables():
+    """Test the encoding of every table entry and default,  and missing fields."""
+    from calcloud import features
+
+    fields = dict(DETECTOR="UVIS", SUBARRAY="True", DRIZCORR="PERFORM", PCTECORR="PERFORM", CRSPLIT="1.0")
+    assert features.encode("lpppssoo1", fields) == [0, 0, 1, 1, 1, 1, 1, 0, 1]
+    fields = dict(DETECTOR="CCD", SUBARRAY="False", DRIZCORR="OMIT", PCTECORR="OMIT", CRSPLIT="NaN")
+    assert features.encode("opppssoo0", fields) == [0, 0, 0, 0, 0, 0, 0, 1, 2]
+    assert features.encode("opppssoo0", dict(CRSPLIT="3"))[4] == 2
+    assert features.encode("Ipppssoo1", {}) == [0, 0, 0, 0, 0, 0, 0, 0, 3]
+    try:
+        features.encode("upppssoo1", {})
+    except ValueError:
+        pass
+    else:
+        assert False, "Expected ValueError for unsupported instrument."
+
+
+def test_features_encode_many_benchmark():
+    """Encode 100k synthetic feature files and check them against row-at-a-time encoding."""
+    from calcloud import features
+
+    rng = np.random.default_rng(0)
+    n = 100_000
+    detectors = np.array(["UVIS", "WFC", "CCD", "IR", "FUV"])
+    flags = np.array(["PERFORM", "OMIT"])
+    crsplits = np.array(["NaN", "1", "1.0", "2", "4"])
+    instrs = np.array(["j", "l", "o", "i"])
+    ipppssoots = [f"{instrs[i % 4]}pppss{i % 1000:03d}{i % 2}" for i in range(n)]
+    bodies = [
+        (
+            f"n_files={rng.integers(1, 200)}\ntotal_mb={rng.uniform(0, 5000):.1f}\n"
+            f"DETECTOR={detectors[i % 5]}\nSUBARRAY={'True' if i % 3 else 'False'}\n"
+            f"DRIZCORR={flags[i % 2]}\nPCTECORR={flags[(i // 2) % 2]}\nCRSPLIT={crsplits[i % 5]}"
+        ).encode()
+        for i in range(n)
+    ]
+
+    start = time.perf_counter()
+    X = features.encode_many(ipppssoots, bodies)
+    seconds = time.perf_counter() - start
+    print(f"features.encode_many {n} files in {seconds:.2f}s, {n / seconds:.0f} files-per-second")
+
+    assert X.shape == (n, 9)
+    for i in rng.integers(0, n, 200):
+        assert list(X[i]) == features.encode(ipppssoots[i], features.parse_features(bodies[i]))
@@ -234,3 +234,122 @@ def test_io_mock_iobundle(s3_client):
     result = comm.messages.listl()
     for i in range(len(sent_messages)):
         assert sent_messages[i] in result
+
+
+def test_io_mock_metadata_cache(s3_client):
+    """Test MetadataIo revalidates cached records with If-None-Match and updates with If-Match."""
+    from calcloud import io
+    from calcloud import s3
+
+    comm = io.get_io_bundle(bucket=conftest.BUCKET, client=s3_client)
+    comm.xdata.cache = io.MetadataCache(maxsize=2)
+    dataset = conftest.TEST_DATASET_NAMES[0]
+    comm.xdata.put(dataset, {"retries": 0})
+    s3_path = comm.xdata.path(dataset)
+    etag, text = comm.xdata.cache.get(s3_path)
+
+    # unchanged records transfer no contents
+    assert s3.get_object_if_changed(s3_path, etag, client=s3_client) == (None, etag)
+    assert comm.xdata.get(dataset) == {"retries": 0}
+
+    # records changed by another writer are refetched
+    other = io.MetadataIo(comm.xdata.s3_path, s3_client, cache=io.MetadataCache())
+    other.put(dataset, {"retries": 5})
+    assert comm.xdata.get(dataset) == {"retries": 5}
+    assert comm.xdata.cache.get(s3_path)[0] != etag
+
+    # stale If-Match loses the race instead of clobbering
+    with pytest.raises(ClientError) as exc:
+        comm.xdata.put(dataset, {"retries": 1}, if_match=etag)
+    assert s3.is_precondition_failure(exc.value)
+    assert other.get(dataset) == {"retries": 5}
+
+    # update() gives up after repeated conflicts
+    def always_conflict(metadata):
+        other.put(dataset, {"retries": metadata["retries"] + 1})
+
+    with pytest.raises(io.MetadataConflict):
+        comm.xdata.update(dataset, always_conflict, retries=3)
+    assert other.get(dataset) == {"retries": 8}
+
+    # deleted records are not served from the cache
+    comm.xdata.delete(dataset)
+    with pytest.raises(ClientError):
+        comm.xdata.get(dataset)
+    assert comm.xdata.cache.get(s3_path) is None
+
+
+class PartialDeleteClient:
+    """S3 client proxy whose DeleteObjects requests report an error for every key containing `fail`."""
+
+    def __init__(self, client, fail):
+        self.client = client
+        self.fail = fail
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def delete_objects(self, Bucket, Delete):
+        keep = [obj for obj in Delete["Objects"] if self.fail not in obj["Key"]]
+        if keep:
+            self.client.delete_objects(Bucket=Bucket, Delete=dict(Delete, Objects=keep))
+        errors = [dict(Key=obj["Key"], Code="AccessDenied") for obj in Delete["Objects"] if self.fail in obj["Key"]]
+        return {"Errors": errors}
+
+
+def test_io_delete_failures(s3_client):
+    """Per-key DeleteObjects errors are raised by clean() and S3Io.delete() rather than only logged."""
+    from calcloud import io
+
+    datasets = conftest.TEST_DATASET_NAMES[:2]
+    comm = io.get_io_bundle(bucket=conftest.BUCKET, client=PartialDeleteClient(s3_client, datasets[0]))
+    for dataset in datasets:
+        comm.messages.put(f"processed-{dataset}")
+        comm.outputs.put(f"{dataset}/preview.txt")
+
+    with pytest.raises(io.DeleteFailed) as exc:
+        comm.clean("all")
+    assert {error["Key"] for error in exc.value.errors} == {
+        f"messages/processed-{datasets[0]}.trigger",
+        f"outputs/{datasets[0]}/preview.txt",
+    }
+    assert comm.outputs.listl() == [f"{datasets[0]}/preview.txt"]
+
+    with pytest.raises(io.DeleteFailed):
+        comm.outputs.delete("all")
+
+
+def test_io_broadcast_encoding_benchmark(s3_client):
+    """Compare pure Python YAML,  libyaml,  and compact JSON encodings of a 10^5 message broadcast,
+    checking compact broadcasts and existing YAML broadcasts both still decode.
+    """
+    import time
+    import yaml
+    from calcloud import io
+
+    bmsg = dict(messages=[f"cancel-ipppss{i % 1000:03d}{i // 1000:02d}" for i in range(10**5)], payload=None)
+    encodings = [
+        ("pure-yaml", yaml.dump, yaml.safe_load),
+        ("lib-yaml", io.yaml_dump, io.yaml_load),
+        ("compact", io.compact_dump, io.message_load),
+    ]
+    for name, dump, load in encodings:
+        start = time.perf_counter()
+        text = dump(bmsg)
+        dumped = time.perf_counter()
+        assert load(text) == bmsg
+        loaded = time.perf_counter()
+        print(
+            f"{name:>10} broadcast of 10^5 messages: {len(text)} bytes dump {dumped - start:.3f}s load {loaded - dumped:.3f}s"
+        )
+
+    comm = io.get_io_bundle(bucket=conftest.BUCKET, client=s3_client)
+    msg = comm.messages.broadcast("cancel", [f"ipppss{i:03d}q" for i in range(10**3)])
+    text = io.S3Io.get(comm.messages, msg)  # raw text,  not decoded
+    assert text.startswith('{"messages":["cancel-ipppss000q",')
+    assert yaml.safe_load(text) == comm.messages.get(msg)  # readable by YAML-only consumers
+
+    legacy = "broadcast-" + comm.messages.get_id()
+    io.S3Io.put(comm.messages, legacy, yaml.dump(dict(messages=["cancel-ipppss000q"], payload={"a": 1})))
+    assert comm.messages.pop(legacy) == dict(messages=["cancel-ipppss000q"], payload={"a": 1})
+    comm.messages.delete("all")
@@ -1,5 +1,7 @@
 """Test the batch event handler for various kinds of error condition handling."""
 
+import json
+
 from calcloud import io
 
 from . import conftest
@@ -105,6 +107,14 @@ def test_batch_caldp_memory_error(s3_client):
     memory_error_handler("batch-event-caldp-memory-error.yaml")
 
 
+def test_batch_memory_error_oom_bins(s3_client):
+    """Memory errors record the bin each failed attempt actually ran in for plan.build_oom_stats()."""
+    _starting, ending = assert_rescue("batch-event-caldp-memory-error.yaml", memory_retries=1, job_bin=2, oom_bins=[1])
+    assert ending["oom_bins"] == [1, 2]
+    _starting, ending = assert_rescue("batch-event-cannot-inspect-error.yaml", job_bin=2, oom_bins=[1])
+    assert ending["oom_bins"] == [1]
+
+
 def test_batch_os_memory_error(s3_client):
     """CALDP reports an OSError when running out of memory while launching a subprocess."""
     memory_error_handler("batch-event-os-memory-error.yaml")
@@ -128,3 +138,226 @@ def test_batch_docker_timeout_error(s3_client):
 def test_batch_cannot_inspect_container(s3_client):
     """Batch returned CannotInspectContainer"""
     error_w_retry("batch-event-cannot-inspect-error.yaml")
+
+
+def test_batch_array_child_memory_error(s3_client):
+    """A memory error in a Batch array child rescues the dataset at its manifest index,  the parent event is ignored."""
+    comm = io.get_io_bundle()
+    array_name = "calcloud-array-0123456789abcdef"
+    comm.control.put_array_manifest(array_name, dict(datasets=["lcw303cjq", "ipppssoot"]))
+    comm.xdata.put("ipppssoot", starting_metadata({}))
+
+    event = conftest.load_event("batch-event-caldp-memory-error.yaml")
+    event["detail"]["jobId"] = "fake-array-id:1"
+    event["detail"]["jobName"] = array_name
+    event["detail"]["arrayProperties"] = {"index": 1}
+    event["detail"]["container"]["command"][1] = "@" + comm.control.array_manifest_path(array_name)
+    batch_event_handler.lambda_handler(event, None)
+
+    assert comm.messages.listl("all-ipppssoot") == ["rescue-ipppssoot"]
+    assert comm.messages.listl("all-lcw303cjq") == []
+    ending = comm.xdata.get("ipppssoot")
+    assert ending["job_id"] == "fake-array-id:1" and ending["memory_retries"] == 1
+
+    comm.messages.delete("all")
+    del event["detail"]["arrayProperties"]["index"]
+    event["detail"]["jobId"] = "fake-array-id"
+    event["detail"]["arrayProperties"]["size"] = 2
+    batch_event_handler.lambda_handler(event, None)
+    assert comm.messages.listl("all") == []
+
+
+def test_batch_packed_job_failure(s3_client):
+    """A packed job failure is charged to its first unprocessed dataset,  later datasets are rescued without retries."""
+    comm = io.get_io_bundle()
+    job_name = "calcloud-pack-0123456789abcdef"
+    datasets = ["lcw300cjq", "lcw301cjq", "lcw302cjq", "lcw303cjq", "lcw304cjq"]
+    comm.control.put_array_manifest(job_name, dict(datasets=datasets))
+    for dataset in datasets:
+        comm.xdata.put(dataset, starting_metadata({}))
+    comm.messages.put("ingested-lcw300cjq")  # already moved on from processed-
+    comm.messages.put("processed-lcw301cjq")
+
+    event = conftest.load_event("batch-event-caldp-memory-error.yaml")
+    event["detail"]["jobName"] = job_name
+    event["detail"]["container"]["command"][1] = "@" + comm.control.array_manifest_path(job_name)
+    batch_event_handler.lambda_handler(event, None)
+
+    assert comm.messages.listl("all-lcw300cjq") == ["ingested-lcw300cjq"]
+    assert comm.messages.listl("all-lcw301cjq") == ["processed-lcw301cjq"]
+    assert comm.xdata.get("lcw300cjq")["memory_retries"] == 0
+    assert comm.xdata.get("lcw302cjq")["memory_retries"] == 1
+    for dataset in datasets[2:]:
+        assert comm.messages.listl(f"all-{dataset}") == [f"rescue-{dataset}"]
+    for dataset in datasets[3:]:
+        metadata = comm.xdata.get(dataset)
+        assert metadata["memory_retries"] == 0 and metadata["retries"] == 0
+        assert metadata["job_name"] == job_name
+
+
+def test_batch_sqs_batch(s3_client):
+    """An SQS batch coalesces duplicate events per dataset and reports records which fail as partial batch failures."""
+    comm = io.get_io_bundle()
+    memory_event = conftest.load_event("batch-event-caldp-memory-error.yaml")
+    cancel_event = conftest.load_event("batch-event-operator-cancelled.yaml")
+    records, datasets = [], []
+    for i in range(20):
+        dataset = f"lcw{300 + i}cjq"
+        datasets.append(dataset)
+        comm.xdata.put(dataset, starting_metadata({}))
+        comm.messages.put(f"submit-{dataset}")
+        event = memory_event if i % 2 else cancel_event
+        event["detail"]["container"]["command"][1] = dataset
+        records.append(dict(messageId=f"id-{i}", body=json.dumps(event)))
+    records.append(dict(messageId="id-20", body=records[1]["body"]))  # redelivered duplicate
+    records.append(dict(messageId="id-bad", body="{not json"))
+
+    response = batch_event_handler.sqs_handler(dict(Records=records), None)
+
+    assert response == {"batchItemFailures": [{"itemIdentifier": "id-bad"}]}
+    for i, dataset in enumerate(datasets):
+        msg_type = "rescue" if i % 2 else "terminated"
+        assert comm.messages.listl(f"all-{dataset}") == [f"{msg_type}-{dataset}"]
+        assert comm.xdata.get(dataset)["memory_retries"] == (1 if i % 2 else 0)
+
+
+def test_batch_sqs_redelivered_pack(s3_client, monkeypatch):
+    """A packed job record redelivered after a partial failure counts its retry once and resends continuations."""
+    comm = io.get_io_bundle()
+    job_name = "calcloud-pack-0123456789abcdef"
+    datasets = ["lcw300cjq", "lcw301cjq", "lcw302cjq"]
+    comm.control.put_array_manifest(job_name, dict(datasets=datasets))
+    for dataset in datasets:
+        comm.xdata.put(dataset, starting_metadata({}))
+    event = conftest.load_event("batch-event-caldp-memory-error.yaml")
+    event["detail"]["jobName"] = job_name
+    event["detail"]["container"]["command"][1] = "@" + comm.control.array_manifest_path(job_name)
+    record = dict(messageId="id-0", body=json.dumps(event))
+
+    update = io.MetadataIo.update
+
+    def failing_update(self, dataset, func, *args, **keys):
+        if dataset == "lcw302cjq":
+            raise RuntimeError("simulated S3 failure")
+        return update(self, dataset, func, *args, **keys)
+
+    monkeypatch.setattr(io.MetadataIo, "update", failing_update)
+    response = batch_event_handler.sqs_handler(dict(Records=[record]), None)
+    assert response == {"batchItemFailures": [{"itemIdentifier": "id-0"}]}
+    assert comm.xdata.get("lcw300cjq")["memory_retries"] == 1
+    assert comm.messages.listl("all-lcw302cjq") == []
+
+    monkeypatch.setattr(io.MetadataIo, "update", update)
+    comm.messages.delete("rescue-lcw301cjq")  # lost continuation is sent again
+    response = batch_event_handler.sqs_handler(dict(Records=[record]), None)
+    assert response == {"batchItemFailures": []}
+    assert comm.xdata.get("lcw300cjq")["memory_retries"] == 1
+    for dataset in datasets:
+        assert comm.messages.listl(f"all-{dataset}") == [f"rescue-{dataset}"]
+        assert comm.xdata.get(dataset)["failure_job_id"] == event["detail"]["jobId"]
+
+    comm.messages.delete("all")
+    comm.xdata.update("lcw300cjq", lambda metadata: metadata.update(job_id="resubmitted_job_id"))
+    assert batch_event_handler.sqs_handler(dict(Records=[record]), None) == {"batchItemFailures": []}
+    assert comm.messages.listl("all-lcw300cjq") == []
+    assert comm.xdata.get("lcw300cjq")["memory_retries"] == 1
+
+
+def test_batch_array_child_failure(s3_client):
+    """A failed child of an array submitted by submit_arrays() is rescued using the metadata recorded at submission."""
+    from calcloud import plan
+    from calcloud import submit
+
+    class ArrayBatchClient:
+        def submit_job(self, **job):
+            return {"jobName": job["jobName"], "jobId": "0123abcd-0123-4567-89ab-0123456789ab"}
+
+    comm = io.get_io_bundle()
+    bucket = f"s3://{conftest.BUCKET}"
+    datasets = ["lcw300cjq", "lcw301cjq", "lcw302cjq"]
+    plans = [
+        plan.Plan(
+            dataset,
+            "acs",
+            dataset,
+            f"{bucket}/outputs/{dataset}",
+            f"{bucket}/inputs",
+            "caldp-config-aws",
+            0,
+            300,
+            conftest.JOBQUEUES[0],
+            conftest.JOBDEFINITIONS[0],
+            "caldp-process",
+        )
+        for dataset in datasets
+    ]
+    results = list(submit.submit_arrays(plans, max_workers=2, rate=1000, client=ArrayBatchClient()))
+    (job_name,) = {result["job_name"] for result in results}
+    for i, dataset in enumerate(datasets):
+        metadata = comm.xdata.get(dataset)
+        assert metadata["job_id"] == f"0123abcd-0123-4567-89ab-0123456789ab:{i}"
+        assert metadata["initial_bin"] == metadata["job_bin"] == 0
+        assert comm.messages.listl(f"all-{dataset}") == [f"submit-{dataset}"]
+
+    event = conftest.load_event("batch-event-caldp-memory-error.yaml")
+    event["detail"].update(
+        jobName=job_name, jobId="0123abcd-0123-4567-89ab-0123456789ab:1", arrayProperties=dict(index=1)
+    )
+    event["detail"]["container"]["command"][1] = "@" + comm.control.array_manifest_path(job_name)
+    batch_event_handler.lambda_handler(event, None)
+
+    assert comm.messages.listl("all-lcw301cjq") == ["rescue-lcw301cjq"]
+    assert comm.xdata.get("lcw301cjq")["memory_retries"] == 1
+    for dataset in ["lcw300cjq", "lcw302cjq"]:
+        assert comm.messages.listl(f"all-{dataset}") == [f"submit-{dataset}"]
+        assert comm.xdata.get(dataset)["memory_retries"] == 0
+
+
+def test_batch_packed_submission_failure(s3_client):
+    """A failed job packed by submit_packed() is handled using the metadata recorded at submission,  and
+    datasets with no metadata at all are handled from the default metadata rather than failing the event.
+    """
+    from calcloud import plan
+    from calcloud import submit
+
+    class PackBatchClient:
+        def submit_job(self, **job):
+            return {"jobName": job["jobName"], "jobId": "4567abcd-0123-4567-89ab-0123456789ab"}
+
+    comm = io.get_io_bundle()
+    bucket = f"s3://{conftest.BUCKET}"
+    datasets = ["lcw310cjq", "lcw311cjq", "lcw312cjq"]
+    plans = [
+        plan.Plan(
+            dataset,
+            "acs",
+            dataset,
+            f"{bucket}/outputs/{dataset}",
+            f"{bucket}/inputs",
+            "caldp-config-aws",
+            0,
+            60,
+            conftest.JOBQUEUES[0],
+            conftest.JOBDEFINITIONS[0],
+            "caldp-process",
+        )
+        for dataset in datasets
+    ]
+    results = list(submit.submit_packed(plans, max_workers=2, rate=1000, client=PackBatchClient()))
+    (job_name,) = {result["job_name"] for result in results}
+    order = comm.control.get_array_manifest(job_name)["datasets"]
+    for dataset in datasets:
+        assert comm.xdata.get(dataset)["job_id"] == "4567abcd-0123-4567-89ab-0123456789ab"
+    comm.messages.put(f"processed-{order[0]}")
+
+    event = conftest.load_event("batch-event-caldp-memory-error.yaml")
+    event["detail"].update(jobName=job_name, jobId="4567abcd-0123-4567-89ab-0123456789ab")
+    event["detail"]["container"]["command"][1] = "@" + comm.control.array_manifest_path(job_name)
+    comm.xdata.delete(order[2])  # e.g. submitted before packed jobs recorded metadata
+    batch_event_handler.lambda_handler(event, None)
+
+    assert comm.xdata.get(order[1])["memory_retries"] == 1
+    assert comm.xdata.get(order[2])["memory_retries"] == 0
+    assert comm.xdata.get(order[2])["job_name"] == job_name
+    for dataset in order[1:]:
+        assert comm.messages.listl(f"all-{dataset}") == [f"rescue-{dataset}"]
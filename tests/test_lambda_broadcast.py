@@ -28,3 +28,28 @@ def test_broadcast_handler(s3_client):
 
     for message in broadcasted_msg:
         assert message not in current_messages
+
+
+def test_broadcast_handler_fanout(s3_client, monkeypatch):
+    """Test that large broadcasts fan out into BROADCAST_FANOUT child broadcasts whose leaves are put concurrently."""
+    from calcloud import io
+    from broadcast import broadcast_handler
+
+    monkeypatch.setattr(broadcast_handler, "BROADCAST_LEAF_SIZE", 10)
+    monkeypatch.setattr(broadcast_handler, "BROADCAST_FANOUT", 3)
+    monkeypatch.setattr(broadcast_handler, "BROADCAST_THREADS", 4)
+
+    comm = io.get_io_bundle()
+
+    datasets = [f"lcw3{i:02d}cjq" for i in range(25)]
+    msg = comm.messages.broadcast("cancel", datasets)
+    broadcast_handler.lambda_handler(conftest.get_message_event(msg), {})
+
+    children = comm.messages.listl("broadcast")
+    assert len(children) == 3
+    assert not comm.messages.listl("cancel")
+
+    for child in children:
+        broadcast_handler.lambda_handler(conftest.get_message_event(child), {})
+
+    assert comm.messages.listl() == sorted(f"cancel-{dataset}" for dataset in datasets)
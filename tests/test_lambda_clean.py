@@ -1,4 +1,5 @@
 import copy
+import json
 import os
 
 import pytest
@@ -174,3 +175,23 @@ def test_clean_single_dataset(s3_client):
         clean_handler.lambda_handler(dataset_event, {})
         assertion_datasets.remove(dataset)
         assert_all_artifacts(comm, assertion_datasets)
+
+
+def test_clean_sqs_batch(s3_client):
+    """One invocation with an SQS batch of clean-dataset notifications cleans every dataset."""
+    comm = io.get_io_bundle()
+    datasets = ["ipppssoo1", "ipppssoo2", "ipppssoo3"]
+    for dataset in datasets:
+        comm.xdata.put(dataset, io.get_default_metadata())
+        s3.put_object("", f"s3://{os.environ['BUCKET']}/inputs/{dataset}.tar.gz", client=s3_client)
+        comm.messages.put(f"ingested-{dataset}")
+
+    records = [
+        dict(messageId=dataset, body=json.dumps(conftest.get_message_event(f"clean-{dataset}")))
+        for dataset in datasets[:2]
+    ]
+    response = clean_handler.lambda_handler(dict(Records=records), {})
+
+    assert response == {"batchItemFailures": []}
+    assert comm.xdata.listl() == ["ipppssoo3"]
+    assert comm.messages.listl() == ["ingested-ipppssoo3"]
@@ -11,17 +11,17 @@ import delete_handler
 
 
 def test_cancel_all(batch_client, s3_client, iam_client):
-    """cancel all simply posts a broadcast message"""
+    """cancel all terminates every killable job in bulk and marks its dataset terminated"""
 
     comm = io.get_io_bundle()
 
     # setup batch and submit a job to each queue
     q_arns, jobdef_arns = conftest.setup_batch(iam_client, batch_client, busybox_sleep_timer=10)
 
-    jobIds = []
+    datasets = []
     for i, (job_q_arn, job_definition_arn) in enumerate(zip(q_arns, jobdef_arns)):
-        response = batch_client.submit_job(jobName=f"ipppssoo{i}", jobQueue=job_q_arn, jobDefinition=job_definition_arn)
-        jobIds.append(response["jobId"].replace("-", "_"))
+        batch_client.submit_job(jobName=f"ipppssoo{i}", jobQueue=job_q_arn, jobDefinition=job_definition_arn)
+        datasets.append(f"ipppssoo{i}")
 
     # post the message (to ensure the message is removed by the lambda)
     comm.messages.put("cancel-all")
@@ -36,11 +36,51 @@ def test_cancel_all(batch_client, s3_client, iam_client):
     # the lambda should delete the message it triggered from
     assert "cancel-all" not in messages
 
-    # get the broadcast messages
-    broadcast = conftest.get_broadcast(comm)
-    expected = [f"cancel-{jobid}" for jobid in jobIds]
+    assert sorted(messages) == sorted(f"terminated-{dataset}" for dataset in datasets)
+    for dataset in datasets:
+        assert comm.xdata.get(dataset)["terminated"]
+
+
+class TerminatingBatchClient:
+    """Fake Batch client which records every TerminateJob request,  failing for `fail_ids`."""
+
+    def __init__(self, fail_ids=()):
+        self.fail_ids = fail_ids
+        self.terminated = []
 
-    assert sorted(broadcast["messages"]) == sorted(expected)
+    def terminate_job(self, jobId, reason):
+        if jobId in self.fail_ids:
+            raise RuntimeError("terminate failed for " + jobId)
+        self.terminated.append(jobId)
+        return {"ResponseMetadata": {"HTTPStatusCode": 200}}
+
+
+def test_cancel_all_bulk(s3_client, monkeypatch):
+    """cancel all handles jobs in chunks,  broadcasting cancel-job_id only for jobs it fails to terminate."""
+    comm = io.get_io_bundle()
+    job_ids = [f"{i:08x}-0000-0000-0000-000000000000" for i in range(25)]
+    listing = [dict(jobId=job_id, jobName=f"lcw{300 + i}cjq") for i, job_id in enumerate(job_ids)]
+    comm.control.put_array_manifest("calcloud-pack-0123456789abcdef", dict(datasets=["ipppss01t", "ipppss02t"]))
+    listing[-1]["jobName"] = "calcloud-pack-0123456789abcdef"
+    for job in listing[:-1]:
+        comm.messages.put(f"submit-{job['jobName']}")
+        comm.xdata.put(job["jobName"], dict(io.get_default_metadata(), job_id=job["jobId"]))
+    client = TerminatingBatchClient(fail_ids=[job_ids[3]])
+    monkeypatch.setattr(batch, "iter_jobs", lambda queues, statuses, formatted: iter(listing))
+    monkeypatch.setattr(batch, "get_terminate_client", lambda max_workers: client)
+    monkeypatch.setattr(delete_handler, "CANCEL_ALL_CHUNK", 10)
+    comm.messages.put("cancel-all")
+
+    delete_handler.lambda_handler(conftest.get_message_event("cancel-all"), {})
+
+    assert sorted(client.terminated) == sorted(job_ids[:3] + job_ids[4:])
+    datasets = [job["jobName"] for job in listing[:-1]] + ["ipppss01t", "ipppss02t"]
+    messages = comm.messages.listl()
+    broadcast = conftest.find_broadcast_message(comm)
+    assert sorted(messages) == sorted([broadcast] + [f"terminated-{dataset}" for dataset in datasets])
+    assert comm.messages.get(broadcast)["messages"] == ["cancel-" + job_ids[3].replace("-", "_")]
+    for dataset in datasets:
+        assert comm.xdata.get(dataset)["terminated"]
 
 
 def test_cancel_jobid_no_xdata(batch_client, s3_client, iam_client):
@@ -1,4 +1,5 @@
 import sys
+import time
 from . import test_model_ingest
 from . import conftest
 
@@ -146,3 +147,142 @@ def test_model_lambda_job_predict_features(s3_client, s3_resource):
     for i in range(len(dict_keys)):
         assert mem_model_features_1[i] == mem_model_expected_dict_1[dict_keys[i]]
         assert mem_model_features_2[i] == mem_model_expected_dict_2[dict_keys[i]]
+
+
+def test_model_lambda_job_predict_warm_start(s3_client, monkeypatch):
+    """Test that models are loaded once per container and re-used by warm invocations,  which are faster."""
+    from JobPredict import predict_handler
+    from calcloud import io
+
+    bucket = conftest.BUCKET
+    comm = io.get_io_bundle(bucket=bucket, client=s3_client)
+    monkeypatch.setattr(predict_handler, "MODEL_DIR", "lambda/JobPredict/models")
+    loads = []
+
+    def counting_loader(model_path, loader=predict_handler.get_dense_model):
+        loads.append(model_path)
+        return loader(model_path)
+
+    monkeypatch.setattr(predict_handler, "get_dense_model", counting_loader)
+    predict_handler.invalidate_models()
+
+    ipst = "ipppssoo0"
+    put_mem_model_file(ipst, comm, fileparams=mem_model_default_param.copy())
+    event = {"Bucket": bucket, "Key": f"control/{ipst}/{ipst}_MemModelFeatures.txt", "Ipppssoot": ipst}
+
+    cold = predict_handler.lambda_handler(event, {})
+    models = predict_handler.get_models()
+    assert len(loads) == 3  # mem_clf, mem_reg, wall_reg
+
+    warm = predict_handler.lambda_handler(event, {})
+    assert cold == warm
+    assert predict_handler.get_models() is models
+    assert len(loads) == 3  # cache hit,  nothing reloaded
+
+    predict_handler.invalidate_models()
+    assert predict_handler.get_models() is not models
+    assert len(loads) == 6
+
+    # a cold load does the warm signature check plus loading,  the fastest of several of each is stable
+    cold_seconds, warm_seconds = [], []
+    for _ in range(5):
+        predict_handler.invalidate_models()
+        start = time.perf_counter()
+        predict_handler.get_models()
+        cold_seconds.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        predict_handler.get_models()
+        warm_seconds.append(time.perf_counter() - start)
+    print(f"JobPredict model load cold {min(cold_seconds) * 1000:.1f}ms warm {min(warm_seconds) * 1000:.1f}ms")
+    assert min(warm_seconds) < min(cold_seconds)
+    predict_handler.invalidate_models()
+
+
+def test_model_lambda_job_predict_batch(s3_client, monkeypatch):
+    """Test that a batch event predicts every item and matches single dataset predictions."""
+    from JobPredict import predict_handler
+    from calcloud import io
+
+    bucket = conftest.BUCKET
+    comm = io.get_io_bundle(bucket=bucket, client=s3_client)
+    monkeypatch.setattr(predict_handler, "MODEL_DIR", "lambda/JobPredict/models")
+
+    ipsts = ["ipppssoo0", "jpppssoo1", "lpppssoo0", "opppssoo1"]
+    sizes = ["10.0", "500.0", "2500.0", "77.7"]
+    for ipst, total_mb in zip(ipsts, sizes):
+        params = dict(mem_model_default_param, total_mb=total_mb, n_files=str(len(total_mb)))
+        put_mem_model_file(ipst, comm, fileparams=params)
+    items = [{"Key": f"control/{ipst}/{ipst}_MemModelFeatures.txt", "Ipppssoot": ipst} for ipst in ipsts]
+
+    results = predict_handler.lambda_handler({"Bucket": bucket, "Items": items}, {})["Results"]
+
+    assert [result["ipppssoot"] for result in results] == ipsts
+    for item, result in zip(items, results):
+        single = predict_handler.lambda_handler(dict(item, Bucket=bucket), {})
+        assert single["memBin"] == result["memBin"]
+        assert single["clockTime"] == result["clockTime"]
+        assert abs(single["memVal"] - result["memVal"]) <= 0.01
+
+    assert predict_handler.lambda_handler({"Bucket": bucket, "Items": []}, {}) == {"Results": []}
+
+
+def test_model_lambda_job_predict_numpy_parity():
+    """Test that the NumPy engine and Yeo-Johnson transform match Keras and scikit-learn within tolerance,
+    skipped unless the optional TensorFlow and scikit-learn packages the lambda doesn't ship are installed.
+    """
+    import numpy as np
+    import pytest
+
+    pytest.importorskip("tensorflow")
+    PowerTransformer = pytest.importorskip("sklearn.preprocessing").PowerTransformer
+    from JobPredict import predict_handler
+
+    model_dir = "lambda/JobPredict/models"
+    pt_data = predict_handler.load_pt_data(f"{model_dir}/pt_transform")
+
+    rng = np.random.default_rng(42)
+    n = 2000
+    inputs = np.column_stack(
+        [
+            rng.integers(1, 500, n),
+            rng.integers(0, 50000, n),
+            rng.integers(0, 2, (n, 5)),
+            rng.integers(0, 3, n),
+            rng.integers(0, 4, n),
+        ]
+    )
+
+    pt = PowerTransformer(standardize=False)
+    pt.lambdas_ = np.array([pt_data["f_lambda"], pt_data["s_lambda"]])
+    expected = pt.transform(inputs[:, :2])
+    assert np.allclose(predict_handler.yeo_johnson(inputs[:, 0], pt_data["f_lambda"]), expected[:, 0])
+    assert np.allclose(predict_handler.yeo_johnson(inputs[:, 1], pt_data["s_lambda"]), expected[:, 1])
+    assert np.allclose(predict_handler.yeo_johnson([-2.0, 0.0, 3.0], 0.0), [-4.0, 0.0, np.log1p(3.0)])
+
+    X = predict_handler.transform(inputs, pt_data)
+    for name in ["mem_clf", "mem_reg", "wall_reg"]:
+        keras_model = predict_handler.get_model(f"{model_dir}/{name}")
+        dense_model = predict_handler.get_dense_model(f"{model_dir}/{name}")
+        keras_preds = keras_model.predict(X, verbose=0)
+        dense_preds = dense_model.predict(X)
+        assert dense_preds.shape == keras_preds.shape
+        assert np.allclose(dense_preds, keras_preds, rtol=1e-4, atol=1e-4), name
+        if name == "mem_clf":
+            assert (np.argmax(dense_preds, axis=-1) == np.argmax(keras_preds, axis=-1)).all()
+
+
+def test_model_lambda_job_predict_cold_start():
+    """Check that importing the handler and loading models with the numpy engine never imports
+    TensorFlow,  the dominant cost of a keras engine cold start,  and report the time taken.
+    """
+    import os
+    import subprocess
+
+    script = "import sys, predict_handler; predict_handler.get_models(); print('tensorflow' in sys.modules)"
+    env = dict(os.environ, MODEL_DIR="models", MODEL_ENGINE="numpy", PYTHONPATH=os.getcwd())
+    start = time.perf_counter()
+    result = subprocess.run(  # nosec
+        [sys.executable, "-c", script], cwd="lambda/JobPredict", env=env, check=True, capture_output=True, text=True
+    )
+    print(f"JobPredict numpy engine cold start {time.perf_counter() - start:.2f}s")
+    assert result.stdout.strip().splitlines()[-1] == "False"
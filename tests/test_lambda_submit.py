@@ -132,3 +132,102 @@ def terminated_submit(comm, bucket, comm_messages):
     assert result["exception"] == fail_message
 
     comm.clean()
+
+
+def test_lambda_submit_wait_for_inputs(s3_client, monkeypatch):
+    """Test the HEAD based input wait picks up late inputs quickly and the deferred / retrigger mode."""
+    import threading
+    import time
+    from calcloud import io
+    from calcloud import lambda_submit
+
+    comm = io.get_io_bundle()
+    dataset = "ieloc4yzq"
+    comm.messages.put(f"placed-{dataset}", {"memory_bin": 1})
+    comm.inputs.put(f"{dataset}.tar.gz")
+
+    # the features file arrives 0.5 seconds after waiting begins
+    timer = threading.Timer(0.5, comm.control.put, [f"{dataset}/{dataset}_MemModelFeatures.txt"])
+    timer.start()
+    start = time.monotonic()
+    lambda_submit._wait_for_inputs(comm, dataset)
+    assert time.monotonic() - start < 3
+    timer.join()
+
+    # deferred mode returns immediately while inputs are missing and leaves the placed message
+    comm.control.delete(f"{dataset}/{dataset}_MemModelFeatures.txt", check_exists=False)
+    monkeypatch.setenv("SUBMIT_DEFER_INPUTS", "1")
+    lambda_submit.main(comm, dataset, conftest.BUCKET, {})
+    assert comm.messages.listl() == [f"placed-{dataset}"]
+    assert lambda_submit.retrigger_if_ready(comm, dataset) is None
+
+    # the last input arriving rewrites the placed message and its payload unchanged
+    comm.control.put(f"{dataset}/{dataset}_MemModelFeatures.txt")
+    assert lambda_submit.retrigger_if_ready(comm, dataset) == f"placed-{dataset}"
+    assert comm.messages.get(f"placed-{dataset}") == {"memory_bin": 1}
+
+    # inputs arriving together retrigger the deferred placed message only once
+    comm.messages.put(f"placed-{dataset}", {"memory_bin": 2})
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(lambda_submit.retrigger_if_ready(comm, dataset)))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(results, key=str) == [None, None, None, f"placed-{dataset}"]
+    assert [path for path in comm.control.listl() if path.endswith(".retrigger")] == [
+        f"{dataset}/placed-{dataset}.retrigger"
+    ]  # one marker per message,  re-used by every claim
+
+    comm.clean()
+
+
+def test_lambda_submit_retry_clears_failure(s3_client, monkeypatch):
+    """Test a memory retry drops the failure of the previous attempt so a job which runs out
+    of memory and then succeeds is counted as an OOM in its first bin only.
+    """
+    from calcloud import io
+    from calcloud import exit_codes
+    from calcloud import lambda_submit
+    from calcloud import plan
+    from calcloud import submit
+
+    comm = io.get_io_bundle()
+    dataset = "ieloc4yzq"
+    comm.messages.put(f"rescue-{dataset}")
+    comm.inputs.put(f"{dataset}.tar.gz")
+    comm.control.put(f"{dataset}/{dataset}_MemModelFeatures.txt")
+    metadata = dict(io.get_default_metadata(), memory_retries=1, job_id="job-1", initial_bin=0, job_bin=0)
+    metadata.update(
+        exit_code=exit_codes.CALDP_MEMORY_ERROR,
+        exit_reason=exit_codes.explain(exit_codes.CALDP_MEMORY_ERROR),
+        status_reason="Essential container in task exited",
+        container_reason="OutOfMemoryError: Container killed due to memory usage",
+    )
+    comm.xdata.put(dataset, metadata)
+
+    resources = plan.JobResources(dataset, "wfc3", dataset, "s3://b/outputs/x", "s3://b/inputs", "c", 0, 600)
+
+    def get_plan(dataset, dataset_type, output_bucket, input_path, metadata):
+        return plan.Plan(*(resources + plan._plan_environment(resources, metadata)))
+
+    monkeypatch.setattr(plan, "get_plan", get_plan)
+    monkeypatch.setattr(submit, "submit_job", lambda job_plan: dict(jobId="job-2"))
+    assert lambda_submit.retrigger_if_ready(comm, dataset) == f"rescue-{dataset}"
+    assert comm.control.listl(f"{dataset}/rescue-{dataset}.retrigger") == [f"{dataset}/rescue-{dataset}.retrigger"]
+    lambda_submit._main(comm, dataset, conftest.BUCKET, {})
+    assert not [path for path in comm.control.listl(dataset) if path.endswith(".retrigger")]  # marker cleared
+
+    metadata = comm.xdata.get(dataset)
+    assert metadata["job_id"] == "job-2" and metadata["job_bin"] == 1
+    assert not set(metadata) & {"exit_code", "exit_reason", "status_reason", "container_reason"}
+
+    running = plan.build_oom_stats([dict(metadata, dataset=dataset)], n_bins=4)
+    assert running.counts["wfc3/0"] == {"0": [1, 1]}  # second attempt's outcome not known yet
+    succeeded = plan.build_oom_stats([dict(metadata, dataset=dataset, finished=True)], n_bins=4)
+    assert succeeded.counts["wfc3/0"] == {"0": [1, 1], "1": [1, 0]}
+
+    comm.clean()
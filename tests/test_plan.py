@@ -60,3 +60,357 @@ def test_plan_query_ddb(s3_client, dynamodb_resource, dynamodb_client):
     query_result = plan.query_ddb(dataset)
     assert query_result[0] in wallclock_times
     assert query_result[1] == wc_std
+
+
+def test_plan_get_plans(s3_client, lambda_client, iam_client, dynamodb_client):
+    """get_plans() should produce the same plans as get_plan() for each dataset."""
+    from calcloud import plan
+    from calcloud import io
+
+    bucket = conftest.BUCKET
+    conftest.create_mock_lambda(lambda_client, iam_client)  # create a mock job_predict lambda
+    conftest.setup_dynamodb(dynamodb_client)
+
+    datasets = ["lpppssoo0", "ipppssoo1", "jpppssoo2"] + conftest.TEST_DATASET_NAMES[1:]
+    metadatas = [io.get_default_metadata() for dataset in datasets]
+
+    plans = plan.get_plans(datasets, bucket, f"{bucket}/inputs", metadatas)
+    for dataset, metadata, job_plan in zip(datasets, metadatas, plans):
+        dataset_type = hst.get_dataset_type(dataset)
+        assert job_plan == plan.get_plan(dataset, dataset_type, bucket, f"{bucket}/inputs", metadata)
+
+    # exhausted bins either raise or are skipped
+    metadatas[0]["memory_bin"] = 5
+    with pytest.raises(plan.AllBinsTriedQuit):
+        plan.get_plans(datasets, bucket, f"{bucket}/inputs", metadatas)
+    plans = plan.get_plans(datasets, bucket, f"{bucket}/inputs", metadatas, skip_exhausted=True)
+    assert [job_plan.dataset for job_plan in plans] == datasets[1:]
+
+
+def test_plan_query_ddb_batch(s3_client, dynamodb_resource, dynamodb_client, monkeypatch):
+    """query_ddb_batch() should return the same stats as query_ddb() across several BatchGetItem requests."""
+    from calcloud import plan
+
+    monkeypatch.setattr(plan, "DDB_BATCH_SIZE", 4)
+    table = dynamodb_resource.Table(os.environ.get("DDBTABLE"))
+    conftest.setup_dynamodb(dynamodb_client)
+
+    datasets = [f"lpppss{i:02d}q" for i in range(10)]
+    for i, dataset in enumerate(datasets[:7]):
+        mock_db_row = {"ipst": dataset, "wallclock": 100.0 + i}
+        if i % 2:
+            mock_db_row["wc_std"] = 1.5
+        table.put_item(Item=json.loads(json.dumps(mock_db_row), parse_int=Decimal, parse_float=Decimal))
+
+    stats = plan.query_ddb_batch(datasets + datasets[:2])
+    assert sorted(stats) == sorted(datasets)
+    for dataset in datasets:
+        assert stats[dataset] == plan.query_ddb(dataset)
+    assert stats[datasets[1]] == (101.0, 1.5)
+    assert stats[datasets[-1]] == (plan.DDB_DEFAULT_CLOCK, plan.DDB_DEFAULT_WC_STD)
+
+
+def test_plan_doctest(s3_client):
+    """Doctest for plan.py"""
+    from calcloud import plan
+
+    doctest_result = plan.test()
+    assert doctest_result[0] == 0, "More than zero doctest errors occurred."  # test errors
+    assert doctest_result[1] > 0, "Too few tests ran,  something is wrong with testing."  # tests run
+
+
+def test_plan_wallclock_cache(s3_client, dynamodb_resource, dynamodb_client, tmp_path, monkeypatch):
+    """Retries of the same dataset should use cached or snapshot wallclock stats instead of DynamoDB."""
+    from calcloud import plan
+
+    table = dynamodb_resource.Table(os.environ.get("DDBTABLE"))
+    conftest.setup_dynamodb(dynamodb_client)
+    table.put_item(Item={"ipst": "lpppssoo0", "wallclock": Decimal("123.5"), "wc_std": Decimal("2.5")})
+
+    assert plan.query_ddb("lpppssoo0") == (123.5, 2.5)
+    table.delete_item(Key={"ipst": "lpppssoo0"})
+    assert plan.query_ddb("lpppssoo0") == (123.5, 2.5)  # cached,  table not re-queried
+    assert plan.query_ddb_batch(["lpppssoo0"]) == {"lpppssoo0": (123.5, 2.5)}
+
+    monkeypatch.setattr(plan, "WALLCLOCK_CACHE_TTL", 0)
+    plan.clear_wallclock_cache()
+    assert plan.query_ddb("lpppssoo0") == (plan.DDB_DEFAULT_CLOCK, plan.DDB_DEFAULT_WC_STD)
+
+    # with a snapshot configured,  datasets in the snapshot never reach DynamoDB
+    csv_path, snapshot_path = tmp_path / "latest.csv", str(tmp_path / "wallclock.snapshot")
+    rows = [f"{100 + i},{i / 10},ipppss{i:03d}q" for i in range(500)]
+    csv_path.write_text("wallclock,wc_std,ipst\n" + "\n".join(rows) + "\n")
+    assert plan.build_wallclock_snapshot(str(csv_path), snapshot_path) == 500
+    monkeypatch.setattr(plan, "WALLCLOCK_SNAPSHOT", snapshot_path)
+    monkeypatch.setattr(plan, "dynamodb", None)
+    monkeypatch.setattr(plan.boto3, "resource", None)  # any DynamoDB access would fail
+    stats = plan.query_ddb_batch([f"ipppss{i:03d}q" for i in range(0, 500, 7)])
+    assert stats["ipppss007q"] == (107.0, 0.7)
+    assert plan.query_ddb("ipppss499q") == (599.0, 49.9)
+    assert len(plan.get_wallclock_snapshot()) == 500
+    plan.get_wallclock_snapshot().close()
+    plan._WALLCLOCK_SNAPSHOTS.clear()
+
+
+def _fake_plan(plan, i, max_seconds, queue="q0"):
+    dataset = f"ipppss{i:03d}"
+    return plan.Plan(
+        dataset,
+        "acs",
+        dataset,
+        f"s3://bucket/outputs/{dataset}",
+        "s3://bucket/inputs",
+        "caldp-config-aws",
+        0,
+        max_seconds,
+        queue,
+        "jd-" + queue,
+        "caldp-process",
+    )
+
+
+def test_plan_pack_plans(aws_credentials):
+    """Tests that small plans of the same job environment are packed within the target duration."""
+    from calcloud import plan
+
+    seconds = [60, 60, 500, 900, 120, 3000, 60, 300, 600]
+    plans = [_fake_plan(plan, i, s, queue=f"q{i % 2}") for (i, s) in enumerate(seconds)]
+    packs = plan.pack_plans(plans, target_seconds=900, small_seconds=600, max_datasets=3)
+
+    assert sorted(p.dataset for pack in packs for p in pack) == sorted(p.dataset for p in plans)
+    for pack in packs:
+        assert len({(p.job_queue, p.job_definition) for p in pack}) == 1
+        if len(pack) > 1:
+            assert sum(p.max_seconds for p in pack) <= 900 and len(pack) <= 3
+        else:
+            assert pack[0].max_seconds <= 600 or pack[0].dataset in ["ipppss003", "ipppss005"]
+    assert len(packs) == 5
+
+
+def test_plan_pack_benchmark(aws_credentials):
+    """Simulate packing 10^4 plans with a long tailed duration distribution,  reporting the
+    reduction in Batch job count and modeled per-job scheduling/startup overhead.
+    """
+    import random
+    import time
+    from calcloud import plan
+
+    rng = random.Random(42)
+    job_overhead = 90  # seconds of scheduling,  container start,  image pull,  and CRDS setup per job
+    plans = [
+        _fake_plan(plan, i, max(60, int(rng.lognormvariate(5, 1.2))), queue=f"q{rng.choice([0, 0, 0, 1])}")
+        for i in range(10**4)
+    ]
+    start = time.perf_counter()
+    packs = plan.pack_plans(plans)
+    elapsed = time.perf_counter() - start
+
+    assert sum(len(pack) for pack in packs) == len(plans)
+    busy = sum(p.max_seconds for p in plans)
+    print(
+        f"packed {len(plans)} plans into {len(packs)} jobs in {elapsed:.3f}s,  "
+        f"overhead {len(plans) * job_overhead / busy:.1%} -> {len(packs) * job_overhead / busy:.1%} of job time"
+    )
+    assert len(packs) < len(plans) / 4
+
+
+def test_plan_queue_depth_routing(aws_credentials, monkeypatch):
+    """Tests that depth routing promotes jobs out of a backed up queue using a cached depth snapshot."""
+    from calcloud import plan
+    from calcloud import batch
+
+    listings = []
+    backlog = {conftest.JOBQUEUES[0]: dict(RUNNABLE=30, RUNNING=2), conftest.JOBQUEUES[1]: dict(RUNNING=4)}
+
+    def iter_jobs(queue, statuses, formatted=True):
+        listings.append(queue)
+        for status in statuses:
+            for _ in range(backlog.get(queue, {}).get(status, 0)):
+                yield dict(status=status)
+
+    monkeypatch.setattr(batch, "iter_jobs", iter_jobs)
+    resources = plan.JobResources(
+        "lpppssoo0", "acs", "lpppssoo0", "s3://b/outputs/lpppssoo0", "s3://b/inputs", "c", 0, 600
+    )
+
+    assert plan._get_environment(resources, 0, None)[0].job_queue == conftest.JOBQUEUES[0]  # default "bin" policy
+    assert listings == []
+
+    monkeypatch.setattr(plan, "QUEUE_ROUTING", "depth")
+    assert plan._get_environment(resources, 0, None)[0].job_queue == conftest.JOBQUEUES[1]
+    assert plan._get_environment(resources, 1, None)[0].job_queue == conftest.JOBQUEUES[1]  # 8g queue not backed up
+    assert len(listings) == len(conftest.JOBQUEUES)  # one snapshot for both plans
+    depths = plan.get_queue_depths(conftest.JOBQUEUES)
+    assert depths[conftest.JOBQUEUES[1]] == dict(RUNNABLE=2, RUNNING=4)  # routed jobs counted as RUNNABLE
+
+
+def test_plan_queue_depth_retries(aws_credentials, monkeypatch):
+    """Tests that a job promoted by depth routing retries an OOM above its promoted bin,
+    stays in the promoted bin for other retries,  and that an explicit memory_bin is never routed.
+    """
+    from calcloud import plan
+    from calcloud import batch
+
+    backlog = {conftest.JOBQUEUES[0]: dict(RUNNABLE=30, RUNNING=2), conftest.JOBQUEUES[1]: dict(RUNNING=4)}
+
+    def iter_jobs(queue, statuses, formatted=True):
+        for status in statuses:
+            for _ in range(backlog.get(queue, {}).get(status, 0)):
+                yield dict(status=status)
+
+    monkeypatch.setattr(batch, "iter_jobs", iter_jobs)
+    monkeypatch.setattr(plan, "QUEUE_ROUTING", "depth")
+    plan.clear_queue_depths()
+    resources = plan.JobResources(
+        "lpppssoo0", "acs", "lpppssoo0", "s3://b/outputs/lpppssoo0", "s3://b/inputs", "c", 0, 600
+    )
+
+    metadata = dict(memory_retries=0, memory_bin=None)
+    assert plan._plan_environment(resources, metadata).job_queue == conftest.JOBQUEUES[1]
+    assert metadata["routed_bins"] == 1
+    assert plan._plan_environment(resources, dict(metadata)).job_queue == conftest.JOBQUEUES[1]  # docker retry
+    metadata["memory_retries"] = 1
+    assert plan._plan_environment(resources, metadata).job_queue == conftest.JOBQUEUES[2]  # bin 1 ran out of memory
+    assert metadata["routed_bins"] == 1
+
+    explicit = dict(memory_retries=0, memory_bin=0)
+    assert plan._plan_environment(resources, explicit).job_queue == conftest.JOBQUEUES[0]
+    assert "routed_bins" not in explicit
+    plan.clear_queue_depths()
+
+
+def _simulate_queues(trace, capacities, policy, job_seconds=300, step=60, cost_ratio=2.0):
+    """Replay `trace` of [(minute, memory_bin, count), ...] job arrivals against queues with
+    `capacities` running slots,  routing each arrival with policy(bin, job_seconds, depths).
+
+    Returns (mean queue wait seconds,  total cost in bin-0 job seconds,  promotions)
+    """
+    runnable = [[] for _ in capacities]  # arrival times
+    running = [[] for _ in capacities]  # finish times
+    arrivals = {}
+    for minute, memory_bin, count in trace:
+        arrivals.setdefault(minute * step, []).extend([memory_bin] * count)
+    waits, cost, promotions = [], 0.0, 0
+    now, end = 0, max(arrivals) + 24 * 3600
+    while now <= end and (now <= max(arrivals) or any(runnable) or any(running)):
+        for q in range(len(capacities)):
+            running[q] = [t for t in running[q] if t > now]
+        for memory_bin in arrivals.get(now, []):
+            depths = [(len(runnable[q]), len(running[q])) for q in range(len(capacities))]
+            routed = policy(memory_bin, job_seconds, depths)
+            promotions += routed != memory_bin
+            cost += job_seconds * cost_ratio**routed
+            runnable[routed].append(now)
+        for q, capacity in enumerate(capacities):
+            while runnable[q] and len(running[q]) < capacity:
+                waits.append(now - runnable[q].pop(0))
+                running[q].append(now + job_seconds)
+        now += step
+    return sum(waits) / len(waits), cost, promotions
+
+
+def test_plan_queue_routing_simulation(aws_credentials):
+    """Replay a queue depth trace with a 2g burst while the 8g queue idles against the bin and depth policies."""
+    from calcloud import plan
+
+    def bin_policy(memory_bin, job_seconds, depths):
+        return memory_bin
+
+    capacities = [4, 8, 4, 2]
+    burst = [(0, 0, 60), (1, 0, 20), (5, 1, 2), (10, 0, 10), (20, 1, 4)]
+    bin_wait, bin_cost, _ = _simulate_queues(burst, capacities, bin_policy)
+    depth_wait, depth_cost, promotions = _simulate_queues(burst, capacities, plan.choose_bin)
+    print(
+        f"burst trace:  bin policy mean wait {bin_wait:.0f}s cost {bin_cost:.0f};  "
+        f"depth policy mean wait {depth_wait:.0f}s cost {depth_cost:.0f} with {promotions} promotions"
+    )
+    assert depth_wait < bin_wait / 2
+    assert promotions and depth_cost < 2 * bin_cost
+
+    steady = [(minute, 0, 1) for minute in range(0, 60, 2)]
+    assert _simulate_queues(steady, capacities, bin_policy) == _simulate_queues(steady, capacities, plan.choose_bin)
+
+
+def test_plan_oom_stats(aws_credentials, tmp_path, monkeypatch):
+    """Tests aggregating OOM statistics from job metadata and ingest rows and starting jobs above risky bins."""
+    from calcloud import plan
+    from calcloud import exit_codes
+
+    metadatas = []
+    for i in range(30):  # wfc3 predicted bin 0: half need bin 1,  one still fails there
+        metadata = dict(dataset=f"ipppss{i:03d}", initial_bin=0, memory_retries=0, job_bin=0, finished=True)
+        if i % 2:
+            metadata.update(memory_retries=1, job_bin=1)
+        if i == 1:
+            metadata.update(exit_code=exit_codes.CALDP_MEMORY_ERROR, finished=False)
+        metadatas.append(metadata)
+    metadatas.append(dict(dataset="ipppss999", memory_retries=0))  # no bins recorded,  ignored
+    metadatas.append(dict(dataset="ipppss998", initial_bin=0, memory_retries=0, job_bin=0))  # running,  ignored
+    failed = dict(dataset="ipppss997", initial_bin=0, memory_retries=0, job_bin=0, exit_code=exit_codes.STAGE1_ERROR)
+    metadatas.append(failed)  # non-memory failure,  ignored
+    routed = dict(dataset="lpppss001", initial_bin=0, memory_retries=1, job_bin=2, routed_bins=1, finished=True)
+    metadatas.append(dict(routed, oom_bins=[1]))  # promoted to bin 1 which ran out of memory,  never ran in bin 0
+    metadatas.append(dict(dataset="lpppss002", initial_bin=0, memory_retries=0, job_bin=0, container_reason=137))
+    ingest_items = [dict(ipst=f"jpppss{i:03d}", mem_bin=Decimal(2 if i < 5 else 0)) for i in range(25)]
+
+    stats = plan.build_oom_stats(metadatas, ingest_items, n_bins=4)
+    assert stats.counts["wfc3/0"] == {"0": [30, 15], "1": [15, 1]}
+    assert stats.counts["acs/*"] == {"0": [25, 5], "1": [5, 5], "2": [5, 0]}
+    assert stats.counts["cos/0"] == {"1": [1, 1], "2": [1, 0]}
+
+    path = str(tmp_path / "oom_stats.json")
+    stats.save(path)
+    monkeypatch.setattr(plan, "OOM_STATS", path)
+    resources = plan.JobResources("ipppss000", "wfc3", "ipppss000", "s3://b/outputs/x", "s3://b/inputs", "c", 0, 600)
+    assert plan.get_oom_stats().counts == stats.counts
+    assert plan._get_environment(resources, 0, None)[0].job_queue == conftest.JOBQUEUES[0]  # 0.5 OOM rate is on target
+    monkeypatch.setattr(plan, "OOM_TARGET", 0.1)
+    assert plan._get_environment(resources, 0, None)[0].job_queue == conftest.JOBQUEUES[1]
+    assert plan._get_environment(resources, 1, None)[0].job_queue == conftest.JOBQUEUES[2]  # retries climb from there
+    assert plan._get_environment(resources, 0, 0)[0].job_queue == conftest.JOBQUEUES[0]  # explicit memory_bin wins
+    acs = resources._replace(instrument="acs")
+    assert (
+        plan._get_environment(acs, 0, None)[0].job_queue == conftest.JOBQUEUES[1]
+    )  # too little bin 1 history to go on
+    plan.get_oom_stats().min_samples = 5
+    assert plan._get_environment(acs, 0, None)[0].job_queue == conftest.JOBQUEUES[2]  # instrument wide fallback
+    plan._OOM_STATS.clear()
+
+
+def test_plan_oom_replay_benchmark(aws_credentials):
+    """Replay a synthetic job history,  comparing compute hours wasted on OOM failed attempts
+    and over-provisioning when starting at the predicted bin versus the bin chosen from OOM
+    statistics of the preceding history.
+    """
+    import random
+    from calcloud import plan
+
+    rng = random.Random(7)
+    n_bins, oom_fraction = 4, 0.8  # OOM failures are assumed to use most of the job's runtime
+    underpredict = {("wfc3", 0): 0.85, ("acs", 0): 0.7}  # chance the model is one bin low,  otherwise 0.05
+    instruments = ["wfc3", "acs", "cos", "stis"]
+
+    def job():
+        instrument = rng.choice(instruments)
+        predicted = rng.choice([0, 0, 0, 1, 1, 2])
+        low = rng.random() < underpredict.get((instrument, predicted), 0.05)
+        required = min(predicted + low, n_bins - 1)
+        return instrument, predicted, required, rng.lognormvariate(-1, 1)  # hours
+
+    history, replay = [job() for _ in range(10**4)], [job() for _ in range(10**4)]
+    stats = plan.OomStats()
+    for instrument, predicted, required, _hours in history:
+        stats.add_job(instrument, predicted, range(predicted, required), required)
+
+    def wasted(start_bin, required, hours):
+        failed = sum(hours * oom_fraction * 2**b for b in range(start_bin, required))
+        overprovisioned = hours * (2 ** max(start_bin, required) - 2**required)
+        return failed + overprovisioned
+
+    before = sum(wasted(predicted, required, hours) for _, predicted, required, hours in replay)
+    after = sum(
+        wasted(stats.start_bin(instrument, predicted, n_bins), required, hours)
+        for instrument, predicted, required, hours in replay
+    )
+    print(f"OOM replay of {len(replay)} jobs:  wasted bin-0 compute hours {before:.0f} -> {after:.0f}")
+    assert after < before
@@ -1,5 +1,6 @@
 import os
 import glob
+import pytest
 from . import conftest
 
 
@@ -84,3 +85,201 @@ def test_s3_upload_download(s3_client):
         os.remove(downloaded_file)
 
     os.rmdir(local_download_path)
+
+
+def test_s3_upload_download_directory(s3_client, tmp_path):
+    """Test s3.upload_directory() and parallel s3.download_objects() round trip a nested directory."""
+    from calcloud import s3
+    from calcloud import timing
+
+    s3_dirpath = f"s3://{conftest.BUCKET}/outputs/j8cb010b0"
+    upload_path = tmp_path / "upload"
+    contents = {}
+    for i in range(20):
+        relpath = f"sub{i % 3}/file{i}.fits"
+        (upload_path / relpath).parent.mkdir(parents=True, exist_ok=True)
+        (upload_path / relpath).write_text(f"contents of file {i}")
+        contents[relpath] = f"contents of file {i}"
+
+    stats = timing.TimingStats()
+    uploads = s3.upload_directory(str(upload_path), s3_dirpath, max_workers=4, stats=stats)
+    assert sorted(uploads) == sorted(f"{s3_dirpath}/{relpath}" for relpath in contents)
+    assert stats.get_stat("objects") == len(contents)
+    assert stats.get_stat("bytes") == sum(len(text) for text in contents.values())
+
+    download_path = tmp_path / "download"
+    downloads = s3.download_objects(str(download_path), s3_dirpath, client=s3_client, max_workers=4)
+    assert len(downloads) == len(contents)
+    for relpath, text in contents.items():
+        assert (download_path / relpath).read_text() == text
+
+
+def test_s3_transfer_scaling(s3_client, tmp_path):
+    """Benchmark objects/sec for download_objects() against moto as worker count grows.
+
+    moto serves requests in-process under the GIL so these rates reflect client overhead
+    rather than the network latency hiding seen against real S3.  Each worker count is run
+    twice so the second,  reported pass uses warm pooled clients.   Since no client is
+    passed every worker borrows its own pooled client.
+    """
+    from calcloud import s3
+    from calcloud import timing
+
+    n_objects = 64
+    s3_dirpath = f"s3://{conftest.BUCKET}/outputs/j8cb010b0"
+    for i in range(n_objects):
+        s3.put_object(f"contents of file {i}", f"{s3_dirpath}/file{i}.fits", client=s3_client)
+
+    for max_workers in [1, 4, 16]:
+        for _ in range(2):
+            stats = timing.TimingStats()
+            downloads = s3.download_objects(
+                str(tmp_path / f"workers{max_workers}"),
+                s3_dirpath,
+                max_workers=max_workers,
+                stats=stats,
+            )
+            assert len(downloads) == n_objects
+        stats.log_status("objects", f"download_objects max_workers={max_workers}")
+
+
+def test_s3_transfer_shared_client(s3_client, tmp_path, monkeypatch):
+    """A client passed to download_objects() or upload_directory() is used by every worker thread."""
+    from calcloud import s3
+
+    def no_pool():
+        raise AssertionError("pooled client used despite explicit client")
+
+    monkeypatch.setattr(s3, "borrow_client", no_pool)
+    s3_dirpath = f"s3://{conftest.BUCKET}/outputs/j8cb010b0"
+    for i in range(8):
+        s3.put_object(f"contents of file {i}", f"{s3_dirpath}/file{i}.fits", client=s3_client)
+    downloads = s3.download_objects(str(tmp_path / "down"), s3_dirpath, client=s3_client, max_workers=4)
+    assert len(downloads) == 8
+    uploads = s3.upload_directory(str(tmp_path / "down"), s3_dirpath + "_copy", client=s3_client, max_workers=4)
+    assert sorted(uploads) == sorted(f"{s3_dirpath}_copy/file{i}.fits" for i in range(8))
+
+
+def test_s3_delete_objects(s3_client, monkeypatch):
+    """Test s3.delete_objects() removes every listed key using chunked DeleteObjects requests."""
+    from calcloud import s3
+
+    monkeypatch.setattr(s3, "MAX_DELETE_KEYS", 10)
+    s3_dirpath = f"s3://{conftest.BUCKET}/outputs"
+    s3_filepaths = [f"{s3_dirpath}/j8cb010b0/file{i}.fits" for i in range(25)]
+    for s3_filepath in s3_filepaths:
+        s3.put_object("contents", s3_filepath, client=s3_client)
+
+    chunks = list(s3._chunk_keys(s3_filepaths + ["s3://other-bucket/file.fits"]))
+    assert [len(keys) for _bucket, keys in chunks] == [10, 10, 5, 1]
+    assert chunks[-1] == ("other-bucket", ["file.fits"])
+
+    errors = s3.delete_objects(s3.list_objects(s3_dirpath, client=s3_client), client=s3_client, max_workers=2)
+    assert errors == []
+    assert list(s3.list_objects(s3_dirpath, client=s3_client)) == []
+
+
+def test_s3_list_directory(s3_client):
+    """Test s3.list_directory() returns each subdirectory once regardless of how many files it contains."""
+    from calcloud import s3
+
+    s3_dirpath = f"s3://{conftest.BUCKET}/outputs"
+    strings = {f"{s3_dirpath}/{dataset}/file{i}.fits": "" for dataset in conftest.TEST_DATASET_NAMES for i in range(20)}
+    strings[f"{s3_dirpath}/loose.txt"] = ""
+    s3.put_objects(strings, client=s3_client, max_workers=4)
+
+    listed = sorted(s3.list_directory(s3_dirpath + "/", client=s3_client))
+    expected = sorted(
+        [f"{s3_dirpath}/{dataset}/" for dataset in conftest.TEST_DATASET_NAMES] + [f"{s3_dirpath}/loose.txt"]
+    )
+    assert listed == expected
+
+    dataset = conftest.TEST_DATASET_NAMES[0]
+    assert list(s3.list_directory(f"{s3_dirpath}/{dataset[:4]}", client=s3_client)) == [f"{s3_dirpath}/{dataset}/"]
+
+
+def test_s3_exists_many(s3_client):
+    """Test s3.exists_many() reports existence of every path using concurrent HeadObject requests."""
+    from calcloud import s3
+
+    s3_dirpath = f"s3://{conftest.BUCKET}/messages"
+    present = [f"{s3_dirpath}/placed-{dataset}" for dataset in conftest.TEST_DATASET_NAMES]
+    missing = [f"{s3_dirpath}/error-{dataset}" for dataset in conftest.TEST_DATASET_NAMES]
+    s3.put_objects({path: "" for path in present}, client=s3_client)
+
+    for max_workers in [1, 4]:
+        found = s3.exists_many(present + missing, client=s3_client, max_workers=max_workers)
+        assert found == {**{path: True for path in present}, **{path: False for path in missing}}
+
+
+def test_s3_exists_many_shared_client(s3_client, monkeypatch):
+    """A client passed to exists_many() is used by every probe thread rather than pooled clients."""
+    import threading
+    from calcloud import s3
+
+    def no_pool():
+        raise AssertionError("pooled client used despite explicit client")
+
+    class CountingClient:
+        def __init__(self, client):
+            self.client, self.heads, self.lock = client, 0, threading.Lock()
+
+        def __getattr__(self, name):
+            return getattr(self.client, name)
+
+        def head_object(self, **params):
+            with self.lock:
+                self.heads += 1
+            return self.client.head_object(**params)
+
+    monkeypatch.setattr(s3, "borrow_client", no_pool)
+    s3_dirpath = f"s3://{conftest.BUCKET}/messages"
+    paths = [f"{s3_dirpath}/placed-{dataset}" for dataset in conftest.TEST_DATASET_NAMES]
+    s3.put_objects({path: "" for path in paths[::2]}, client=s3_client)
+    client = CountingClient(s3_client)
+    found = s3.exists_many(paths, client=client, max_workers=4)
+    assert found == {path: i % 2 == 0 for i, path in enumerate(paths)}
+    assert client.heads == len(paths)
+
+
+def test_s3_parse_s3_events():
+    """Every record of S3 events and SQS wrapped S3 events is decoded,  SQS record failures are reported per record."""
+    import json
+    from calcloud import s3
+
+    direct = conftest.get_message_event("placed-lcw301cjq")
+    direct["Records"].append(conftest.get_message_event("placed-lcw302cjq")["Records"][0])
+    bucket = "s3://" + direct["Records"][0]["s3"]["bucket"]["name"]
+    assert s3.parse_s3_event(direct) == (bucket, "lcw301cjq")
+    assert list(s3.parse_s3_events(direct)) == [(bucket, "lcw301cjq"), (bucket, "lcw302cjq")]
+
+    bodies = [conftest.get_message_event(f"rescue-lcw30{i}cjq") for i in range(3, 6)]
+    bodies.insert(1, {"Event": "s3:TestEvent"})
+    sqs = dict(Records=[dict(messageId=f"id-{i}", body=json.dumps(body)) for i, body in enumerate(bodies)])
+    assert [dataset for _bucket, dataset in s3.parse_s3_events(sqs)] == ["lcw303cjq", "lcw304cjq", "lcw305cjq"]
+
+    handled = []
+
+    def handler(bucket_name, dataset):
+        if dataset == "lcw304cjq":
+            raise RuntimeError("failed " + dataset)
+        handled.append(dataset)
+
+    assert s3.handle_s3_events(sqs, handler) == {"batchItemFailures": [{"itemIdentifier": "id-2"}]}
+    assert handled == ["lcw303cjq", "lcw305cjq"]
+    assert s3.handle_s3_events(direct, handler) is None
+    assert handled[2:] == ["lcw301cjq", "lcw302cjq"]
+
+    # every record of a direct event is handled before its failures are raised
+    direct["Records"][1:1] = conftest.get_message_event("placed-lcw304cjq")["Records"]
+    with pytest.raises(RuntimeError, match="failed lcw304cjq"):
+        s3.handle_s3_events(direct, handler)
+    assert handled[4:] == ["lcw301cjq", "lcw302cjq"]
+    direct["Records"].append(conftest.get_message_event("placed-lcw304cjq")["Records"][0])
+    with pytest.raises(s3.S3EventFailed) as failed:
+        s3.handle_s3_events(direct, handler)
+    assert [key for key, _exc in failed.value.errors] == ["messages/placed-lcw304cjq"] * 2
+    assert handled[6:] == ["lcw301cjq", "lcw302cjq"]
+
+    with pytest.raises(ValueError, match="no S3 notification records"):
+        s3.parse_s3_event(dict(Records=[]))
@@ -1,6 +1,12 @@
 from . import conftest
 from calcloud import hst
 import os
+import json
+import time
+import threading
+import collections
+
+from botocore.exceptions import ClientError
 
 
 def test_submit_plans(s3_client, lambda_client, iam_client, dynamodb_client, batch_client):
@@ -63,3 +69,211 @@ def test_submit_plans(s3_client, lambda_client, iam_client, dynamodb_client, bat
 
     # remove test_plan_file
     os.remove(planfilepath)
+
+
+class ThrottlingBatchClient:
+    """Fake Batch client which throttles the first submission of every job."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = collections.Counter()
+        self.active = self.max_active = 0
+
+    def submit_job(self, **job):
+        with self.lock:
+            self.calls[job["jobName"]] += 1
+            first = self.calls[job["jobName"]] == 1
+            self.active += 1
+            self.max_active = max(self.active, self.max_active)
+        time.sleep(0.01)
+        with self.lock:
+            self.active -= 1
+        if first:
+            raise ClientError({"Error": {"Code": "TooManyRequestsException", "Message": "slow down"}}, "SubmitJob")
+        if job["jobName"] == "bad":
+            raise ClientError({"Error": {"Code": "ClientException", "Message": "bad queue"}}, "SubmitJob")
+        return {"jobName": job["jobName"], "jobId": "id-" + job["jobName"]}
+
+
+def test_submit_plans_concurrent(tmp_path):
+    """Tests streaming concurrent submission with throttle retries and a JSON lines result log."""
+    from calcloud import submit
+    from calcloud import plan
+
+    datasets = [f"ipppss{i:03d}" for i in range(40)] + ["bad"]
+    planfilepath = tmp_path / "plans.txt"
+    with open(planfilepath, "w") as fp:
+        for dataset in datasets:
+            job_plan = plan.Plan(
+                dataset, "acs", dataset, "s3://out", "s3://in", "caldp-config-aws", 0, 300, "q0", "jd0", "caldp-process"
+            )
+            fp.write(repr(tuple(job_plan)) + "\n\n")
+    logpath = tmp_path / "results.jsonl"
+    client = ThrottlingBatchClient()
+
+    failures = submit.submit_plans(str(planfilepath), max_workers=8, rate=1000, log_file=str(logpath), client=client)
+
+    results = [json.loads(line) for line in open(logpath)]
+    assert failures == 1
+    assert sorted(r["dataset"] for r in results) == sorted(datasets)
+    for r in results:
+        if r["dataset"] == "bad":
+            assert r["status"] == "error" and r["job_id"] is None and "ClientException" in r["error"]
+        else:
+            assert r["status"] == "submitted" and r["job_id"] == "id-" + r["dataset"]
+        assert r["attempts"] == 2
+    assert 1 < client.max_active <= 8
+
+
+class RecordingBatchClient:
+    """Fake Batch client which records every SubmitJob request."""
+
+    def __init__(self):
+        self.jobs = []
+
+    def submit_job(self, **job):
+        self.jobs.append(job)
+        return {"jobName": job["jobName"], "jobId": f"job-{len(self.jobs)}"}
+
+
+def test_submit_plans_array(s3_client, tmp_path):
+    """Tests grouping plans by job environment into array jobs with dataset manifests in control/."""
+    from calcloud import submit
+    from calcloud import plan
+    from calcloud import io
+
+    bucket = f"s3://{conftest.BUCKET}"
+    datasets = [f"ipppss{i:03d}" for i in range(7)]
+    queues = ["q0", "q0", "q1", "q0", "q1", "q0", "q2"]
+    planfilepath = tmp_path / "plans.txt"
+    with open(planfilepath, "w") as fp:
+        for i, (dataset, queue) in enumerate(zip(datasets, queues)):
+            job_plan = plan.Plan(
+                dataset,
+                "acs",
+                dataset,
+                f"{bucket}/outputs/{dataset}",
+                f"{bucket}/inputs",
+                "caldp-config-aws",
+                0,
+                300 + i,
+                queue,
+                "jd-" + queue,
+                "caldp-process",
+            )
+            fp.write(repr(tuple(job_plan)) + "\n")
+    logpath = tmp_path / "results.jsonl"
+    client = RecordingBatchClient()
+
+    failures = submit.submit_plans(str(planfilepath), max_workers=2, log_file=str(logpath), client=client, array_size=3)
+
+    assert failures == 0
+    results = {r["dataset"]: r for r in map(json.loads, open(logpath))}
+    assert sorted(results) == datasets
+    # q0 has 4 plans -> arrays of 3 + 1,  q1 has 2 -> array,  q2 has 1;  lone plans are single jobs
+    arrays = [job for job in client.jobs if "arrayProperties" in job]
+    singles = [job for job in client.jobs if "arrayProperties" not in job]
+    assert sorted(job["arrayProperties"]["size"] for job in arrays) == [2, 3]
+    assert sorted(job["jobName"] for job in singles) == ["ipppss005", "ipppss006"]
+
+    comm = io.get_io_bundle()
+    for job in arrays:
+        manifest = comm.control.get_array_manifest(job["jobName"])
+        command = job["containerOverrides"]["command"]
+        assert command[1] == "@" + comm.control.array_manifest_path(job["jobName"])
+        assert command[3] == f"{bucket}/outputs"
+        assert job["timeout"]["attemptDurationSeconds"] == max(p[7] for p in manifest["plans"])
+        for i, dataset in enumerate(manifest["datasets"]):
+            assert results[dataset]["job_name"] == job["jobName"]
+            assert results[dataset]["job_id"].endswith(f":{i}")
+            assert results[dataset]["job_queue"] == job["jobQueue"]
+    (q0_array,) = [job for job in arrays if job["jobQueue"] == "q0"]
+    assert comm.control.get_array_manifest(q0_array["jobName"])["datasets"] == ["ipppss000", "ipppss001", "ipppss003"]
+
+
+def test_submit_arrays_manifest_once(s3_client):
+    """Throttled array submissions re-use one manifest and unsubmittable arrays leave none behind."""
+    from calcloud import submit
+    from calcloud import plan
+    from calcloud import io
+
+    bucket = f"s3://{conftest.BUCKET}"
+    plans = []
+    for i, queue in enumerate(["q0", "q0", "bad", "bad"]):
+        dataset = f"ipppss{i:03d}"
+        plans.append(
+            plan.Plan(
+                dataset,
+                "acs",
+                dataset,
+                f"{bucket}/outputs/{dataset}",
+                f"{bucket}/inputs",
+                "caldp-config-aws",
+                0,
+                300,
+                queue,
+                "jd-" + queue,
+                "caldp-process",
+            )
+        )
+
+    class RejectingBatchClient(ThrottlingBatchClient):
+        def submit_job(self, **job):
+            response = super().submit_job(**job)
+            if job["jobQueue"] == "bad":
+                raise ClientError({"Error": {"Code": "ClientException", "Message": "bad queue"}}, "SubmitJob")
+            return response
+
+    client = RejectingBatchClient()
+    results = list(submit.submit_arrays(plans, max_workers=2, rate=1000, client=client))
+
+    assert sorted(r["status"] for r in results) == ["error", "error", "submitted", "submitted"]
+    assert sorted(client.calls.values()) == [2, 2]  # one job name per group across the throttle retry
+    comm = io.get_io_bundle()
+    manifests = [path for path in comm.control.listl() if path.endswith(io.ARRAY_MANIFEST)]
+    (submitted,) = {r["job_name"] for r in results if r["status"] == "submitted"}
+    assert manifests == [f"{submitted}/{io.ARRAY_MANIFEST}"]
+
+
+def test_submit_plans_packed(s3_client, tmp_path):
+    """Tests packing short plans into multi-dataset jobs while long plans are submitted alone."""
+    from calcloud import submit
+    from calcloud import plan
+    from calcloud import io
+
+    bucket = f"s3://{conftest.BUCKET}"
+    seconds = [60, 120, 60, 2400, 300, 90]
+    planfilepath = tmp_path / "plans.txt"
+    with open(planfilepath, "w") as fp:
+        for i, max_seconds in enumerate(seconds):
+            dataset = f"ipppss{i:03d}"
+            job_plan = plan.Plan(
+                dataset,
+                "acs",
+                dataset,
+                f"{bucket}/outputs/{dataset}",
+                f"{bucket}/inputs",
+                "caldp-config-aws",
+                0,
+                max_seconds,
+                "q0",
+                "jd0",
+                "caldp-process",
+            )
+            fp.write(repr(tuple(job_plan)) + "\n")
+    logpath = tmp_path / "results.jsonl"
+    client = RecordingBatchClient()
+
+    failures = submit.submit_plans(str(planfilepath), log_file=str(logpath), client=client, pack_seconds=630)
+
+    assert failures == 0
+    results = {r["dataset"]: r for r in map(json.loads, open(logpath))}
+    assert len(results) == len(seconds)
+    assert len(client.jobs) == 2
+    packed, single = sorted(client.jobs, key=lambda job: job["jobName"])
+    assert single["jobName"] == "ipppss003"
+    comm = io.get_io_bundle()
+    manifest = comm.control.get_array_manifest(packed["jobName"])
+    assert manifest["datasets"] == ["ipppss004", "ipppss001", "ipppss005", "ipppss000", "ipppss002"]
+    assert packed["timeout"]["attemptDurationSeconds"] == 630 and "arrayProperties" not in packed
+    assert {results[dataset]["job_id"] for dataset in manifest["datasets"]} == {"job-1"}